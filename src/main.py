@@ -1,14 +1,17 @@
-from fastapi import FastAPI, HTTPException
+import secrets
+from typing import Optional
+from fastapi import FastAPI, HTTPException, Header, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pathlib import Path
-import shutil
-import os
 
-from .models.schemas import VideoRequest, VideoResponse
-from .services.video_scorer import VideoScorer
-from .services.video_generator import VideoGenerator
-from .utils.helpers import get_video_metadata, send_email
-from .utils.db_helpers import init_db, set_response_data, get_response_data
+from .models.schemas import VideoRequest, VideoResponse, JobStatus
+from .services.video_pipeline import submit_video_request, start_video_job, job_status, job_preview_path
+from .utils.admission import AdmissionRejected, admission
+from .utils.db_helpers import init_db, get_response_data
+from .utils.metrics import render_metrics
+from .utils.progress import broker, format_sse
+from .utils.fal_helpers import FAL_WEBHOOK_SECRET, handle_fal_webhook
 
 app = FastAPI(title="Video Scoring API | Team Chill Guys")
 app.add_middleware(
@@ -19,63 +22,27 @@ app.add_middleware(
     allow_headers=["*"],
 )
 init_db()
-FRONTEND_URL = os.environ.get("FRONTEND_URL")
+
+def too_many_jobs(rejected: AdmissionRejected) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(rejected), headers={"Retry-After": str(rejected.retry_after)})
 
 @app.post("/score-video", response_model=VideoResponse)
 async def score_video(
     request: VideoRequest,
+    x_api_key: Optional[str] = Header(default=None),
 ):
     """
     Score a video based on provided criteria
     """
-    # first we generate the video
-    generator = VideoGenerator(request)
-    try:
-        video_path, generated_url = generator.generate_video()
-        video_path = Path(video_path)
-        print(f"Generated video url: {generated_url}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-    # now we score the video
+    # the pipeline generates the video, then uploads, scores and probes it
+    # concurrently before saving the response and sending the email.
+    # identical requests share one job and can be served from the cache
     try:
-        # initialize scorer with request data
-        scorer = VideoScorer(request, video_path)
-        
-        # get video scoring
-        scoring = scorer.score_video()
-        
-        # get video metadata
-        metadata = get_video_metadata(str(video_path))
-        metadata.resolution.width = request.video_details.dimensions.width
-        metadata.resolution.height = request.video_details.dimensions.height
-        # creating response
-        response = VideoResponse(
-            status="success",
-            video_url=generated_url,
-            scoring=scoring,
-            metadata=metadata,
-            identifier=""
-        )
-        # save response to db
-        response = set_response_data(response)
-        # send email if email is provided
-        if request.email:
-            send_email("VideoCreativeGen", request.email, "Your Requested Video is Ready", 
-                       f"""Thank you for using VideoCreativeGen. 
-Your requested video has been generated and scored.
-Access it now at {FRONTEND_URL}/{response.identifier}.
-""")
-        return response
-    
+        return await submit_video_request(request, tenant=x_api_key)
+    except AdmissionRejected as e:
+        raise too_many_jobs(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        # clean up uploaded file
-        if video_path.exists():
-            # for testing we are not deleting the video
-            #video_path.unlink()
-            ...
 
 @app.get("/score-video/{identifier}/", response_model=VideoResponse)
 async def get_scored_video(identifier: str):
@@ -88,6 +55,87 @@ async def get_scored_video(identifier: str):
     except Exception as e:
         raise HTTPException(status_code=404, detail=str(e))
 
+@app.post("/jobs", response_model=JobStatus, status_code=202)
+async def create_job(
+    request: VideoRequest,
+    x_api_key: Optional[str] = Header(default=None),
+):
+    """
+    Start generating and scoring a video without waiting for it.
+    Follow the job with /jobs/{job_id}/events
+    """
+    try:
+        job_id, _ = await start_video_job(request, tenant=x_api_key)
+    except AdmissionRejected as e:
+        raise too_many_jobs(e)
+    return job_status(job_id)
+
+@app.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str):
+    """
+    Get the current status of a job
+    """
+    status = job_status(job_id)
+    if status.status == "unknown":
+        raise HTTPException(status_code=404, detail="Job not found")
+    return status
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, last_event_id: Optional[int] = Header(default=0)):
+    """
+    Stream the progress of a job as server-sent events, with heartbeats
+    to keep idle connections open, until the job completes or fails
+    """
+    if job_status(job_id).status == "unknown":
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        async for progress_event in broker.subscribe(job_id, last_event_id or 0):
+            yield format_sse(progress_event)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/jobs/{job_id}/preview")
+async def get_job_preview(job_id: str):
+    """
+    The watermarked segments of a job assembled so far, playable while
+    the remaining segments are still being rendered
+    """
+    path = job_preview_path(job_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="No preview available yet")
+    return FileResponse(path, media_type="video/mp4", headers={"Cache-Control": "no-cache"})
+
+@app.post("/fal/webhook")
+async def fal_webhook(request: Request, token: Optional[str] = None):
+    """
+    Receive completed renders from the fal queue
+    """
+    # without a configured secret nobody can be trusted to deliver results
+    if not FAL_WEBHOOK_SECRET or not token or not secrets.compare_digest(token, FAL_WEBHOOK_SECRET):
+        raise HTTPException(status_code=403, detail="Invalid webhook token")
+    payload = await request.json()
+    if "request_id" not in payload:
+        raise HTTPException(status_code=422, detail="Missing request_id")
+    waiting = await run_in_threadpool(handle_fal_webhook, payload)
+    return {"status": "ok", "waiting": waiting}
+
+@app.get("/admission")
+async def admission_utilization():
+    """
+    Jobs, Kling segments, scratch disk and per tenant jobs in use against
+    their limits, with the requests waiting for room and those rejected
+    """
+    return await run_in_threadpool(admission.utilization)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Prometheus style latency histograms for every external call and local stage
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, HttpUrl
-from typing import List, Dict
+from typing import List, Dict, Optional
 import typing_extensions as typing
 class Dimensions(BaseModel):
     width: int
@@ -21,6 +21,12 @@ class VideoRequest(BaseModel):
     additional_guidelines: str
     video_style: str
     email:str
+    # encoder settings of the final video, see utils/encoding.py. Defaults
+    # to VIDEO_ENCODE_PROFILE
+    encode_profile: Optional[typing.Literal["fast-preview", "balanced", "archive"]] = None
+    # who places the text overlays, see utils/text_placement.py. Defaults
+    # to TEXT_PLANNER
+    text_planner: Optional[typing.Literal["model", "local"]] = None
 
 class Resolution(BaseModel):
     width: int
@@ -30,6 +36,15 @@ class Metadata(BaseModel):
     file_size_mb: float
     duration_seconds: int
     resolution: Resolution
+    # from the container header, see utils/probe.py
+    duration: Optional[float] = None
+    fps: Optional[float] = None
+    frame_count: Optional[int] = None
+    codec: Optional[str] = None
+    bitrate_kbps: Optional[float] = None
+    # clockwise degrees to display the video upright, like the rotate tag
+    rotation: int = 0
+    variable_frame_rate: Optional[bool] = None
 
 # class Scoring(BaseModel):
 #     background_foreground_separation: float
@@ -42,12 +57,41 @@ class Metadata(BaseModel):
 #     justifications: Dict[str, str]
 
 
+class StageTiming(BaseModel):
+    start: float # seconds since the pipeline started
+    end: float
+    duration: float
+
+class TimelineSpan(BaseModel):
+    operation: str
+    labels: Dict[str, str] = {}
+    start: float # seconds since the job started
+    duration: float
+    error: Optional[str] = None
+
 class VideoResponse(BaseModel):
     status: str
     video_url: str
     scoring: Dict
     metadata: Metadata
+    # palette coverage, logo presence and preliminary scores measured locally
+    brand_analytics: Optional[Dict] = None
     identifier: str
+    stage_timings: Dict[str, StageTiming] = {}
+    timeline: List[TimelineSpan] = []
+
+class ProgressEvent(BaseModel):
+    id: int # sequence number within the job
+    job_id: str
+    event: str
+    data: Dict = {}
+    time: float
+
+class JobStatus(BaseModel):
+    job_id: str
+    status: str # queued, running, completed, failed or unknown
+    identifier: Optional[str] = None # set once the response is stored
+    last_event: Optional[ProgressEvent] = None
 
 class VideoGenerationPrompts(BaseModel):
     hero_prompt: str
@@ -72,4 +116,14 @@ class TextOverlay(typing.TypedDict):
     color: str # RGB color code
 
 class TextOverlays(typing.TypedDict):
-    texts: List[TextOverlay]
\ No newline at end of file
+    texts: List[TextOverlay]
+
+# a text overlay without its position and color, for the local planner
+class TextCopy(typing.TypedDict):
+    text: str
+    text_duration: TextDuration
+    font_size: str # small, medium, large
+    font: str # font type from Normal, Bold, Stylish
+
+class TextCopies(typing.TypedDict):
+    texts: List[TextCopy]
@@ -1,23 +1,107 @@
 import json
 import math
+import os
 import re
-from typing import Dict, List
+import uuid
+from typing import Dict, List, Optional, Tuple
 import fal_client
 import google.generativeai as genai
-from ..models.schemas import VideoRequest, VideoGenerationPrompts, TextOverlays
-from ..utils.llm_helpers import upload_to_gemini, wait_for_files_active, safety_settings, gemini_generation_config
-from ..utils.helpers import download_file, upload_image, get_last_frame, merge_videos, upload_and_crop_video, add_watermark, fade_in_text, embed_text_clips, convert_xml_string_to_float
-from PIL import ImageColor
+from ..models.schemas import VideoRequest, VideoGenerationPrompts, TextOverlays, TextCopies
+from ..utils.llm_helpers import upload_to_gemini, upload_files, wait_for_files_active, send_message, generate_content, safety_settings, gemini_generation_config
+from ..utils.fal_helpers import fal_run
+from ..utils.progress import publish
+from ..utils.metrics import timed
+from ..utils.checkpoints import JobCheckpoint
+from ..utils.prefetch import Prefetcher
+from ..utils.fmp4 import FragmentedMp4Appender
+from ..utils.encoding import encode_profile
+from ..utils.extraction import ExtractionFailed, extract, json_schema
+from ..utils.chat_history import ChatHistory
+from ..utils.context_cache import context_cache
+from ..utils.llm_cache import cache_key
+from ..utils.segment_quality import SEGMENT_ATTEMPTS, SegmentReport, check_segment
+from ..utils.text_placement import DEFAULT_TEXT_PLANNER, place_texts
+from ..utils.smart_render import SMART_RENDER, keyframe_params
+from ..utils.media_pool import (BackgroundStatsTask, LastFrameTask, MergeTask, OverlayTask, ProbeTask, WatermarkTask,
+                                WatermarkVideoTask, media_pool)
+from ..utils.helpers import download_file, upload_image, upload_and_crop_video, video_size, prepare_watermark, convert_xml_string_to_float
+from PIL import Image, ImageColor
 from xmltodict import parse as xml_parse
 
 def on_queue_update(update):
     if isinstance(update, fal_client.InProgress):
         for log in update.logs:
            print(log["message"])
+           publish("fal_log", message=log["message"])
+
+_parse_text_overlays = json_schema(TextOverlays)
+
+
+def check_text_overlays(text_overlays: Dict) -> Dict:
+    """validate text overlays against the schema and the fonts and sizes fade_in_text knows"""
+    text_overlays = _parse_text_overlays(json.dumps(text_overlays))
+    for text in text_overlays["texts"]:
+        if text["font"].strip().lower() not in ("normal", "bold", "stylish"):
+            raise ValueError(f"Unknown font {text['font']}")
+        if text["font_size"].strip().lower() not in ("small", "medium", "large"):
+            raise ValueError(f"Unknown font size {text['font_size']}")
+        if not re.fullmatch(r"\s*rgb\(\s*\d+\s*,\s*\d+\s*,\s*\d+\s*\)\s*", text["color"]):
+            raise ValueError(f"Color {text['color']} is not rgb(r,g,b)")
+    return text_overlays
+
+
+def parse_text_overlays_xml(text: str) -> Dict:
+    match = re.search(r'<texts>[\s\S]*?</texts>', text)
+    if not match:
+        raise ValueError("No <texts> element in the output")
+    return check_text_overlays(convert_xml_string_to_float(xml_parse(match.group(0))))
+
+
+def parse_text_overlays_json(text: str) -> Dict:
+    return check_text_overlays(json.loads(text))
+
+
+_parse_text_copies = json_schema(TextCopies)
+
+
+def parse_text_copies(text: str) -> Dict:
+    """validate the copy of the text overlays, whose fonts and sizes must be ones fade_in_text knows"""
+    text_copies = _parse_text_copies(text)
+    for copy in text_copies["texts"]:
+        if copy["font"].strip().lower() not in ("normal", "bold", "stylish"):
+            raise ValueError(f"Unknown font {copy['font']}")
+        if copy["font_size"].strip().lower() not in ("small", "medium", "large"):
+            raise ValueError(f"Unknown font size {copy['font_size']}")
+    return text_copies
+
 
 class VideoGenerator:
-    def __init__(self, video_request: VideoRequest):
+    def __init__(self, video_request: VideoRequest, job_id: Optional[str] = None):
         self.video_request = video_request
+        # every job gets its own scratch directories so concurrent jobs don't
+        # overwrite each other's segments and outputs
+        self.job_id = job_id or str(uuid.uuid4())
+        self.tmp_dir = os.path.join("tmp", self.job_id)
+        self.data_dir = os.path.join("data", self.job_id)
+        # stages finished by an earlier attempt of this job are skipped
+        self.checkpoint = JobCheckpoint(self.job_id)
+        # local work that runs while the segments are rendered remotely
+        self.prefetch = Prefetcher()
+        self.part_size = None
+        # resolution of the first segment, the others are checked against it
+        self.segment_size = None
+        self.sprite_path = None
+        # size of the logo image, the shape of the watermark
+        self.logo_size = None
+        # each part is appended here as soon as it is encoded, so this is a
+        # playable preview while the job runs and the final watermarked video
+        # once the last part is in
+        self.encode_profile = encode_profile(video_request.encode_profile)
+        self.text_planner = video_request.text_planner or DEFAULT_TEXT_PLANNER
+        # the parts are encoded for the final video and only the ranges
+        # under the texts are encoded again
+        self.smart_render = SMART_RENDER
+        self.assembler = FragmentedMp4Appender(os.path.join(self.data_dir, "merged_output_watermarked.mp4"))
         self.llm =  genai.GenerativeModel(
                         model_name="gemini-2.0-flash-exp",
                        # model_name="gemini-exp-1206",
@@ -309,7 +393,7 @@ Remember: Each prompt must be self-contained and use full product names. Never r
             safety_settings=safety_settings,
             system_instruction="""From the given text extract the required data in the following xml-like format:
 <texts>
-  <x`zz>
+  <text>
     <color>
       <!-- Format: rgb(R,G,B) where R,G,B are 0-255 -->
     </color>
@@ -354,35 +438,74 @@ Remember: Each prompt must be self-contained and use full product names. Never r
             safety_settings=safety_settings,
             system_instruction="From the given text, extract the required data for the given JSON schema and provide the JSON response. If some data is missing, just write 'None' in that particular respective field. For positions, the text might contain %, but you only need to provide the number as float. Choose font size from 'small', 'medium', 'large'. For font, choose from 'Normal', 'Bold', 'Stylish'. For color, provide RGB values in the format rgb(r,g,b)."
         )
+        self.llm_json_text_copy_writer = genai.GenerativeModel(
+            model_name= "gemini-2.0-flash-exp",
+            generation_config={
+                "temperature": 1,
+                "top_p": 0.95,
+                "top_k": 40,
+                "response_mime_type": "application/json",
+                "response_schema": TextCopies
+            },
+            safety_settings=safety_settings,
+            system_instruction="From the given text, extract the text overlays for the given JSON schema and provide the JSON response. Ignore their positions and colors. Choose font size from 'small', 'medium', 'large'. For font, choose from 'Normal', 'Bold', 'Stylish'. Times are in seconds, as floats."
+        )
+    def tmp_name(self, filename: str) -> str:
+        """name of a file inside this job's tmp directory, as expected by download_file"""
+        return os.path.join(self.job_id, filename)
+
     def generate_video(self) -> tuple[str, str]:
+        video_path = self.render_video()
+        return video_path, self.upload_video(video_path)
+
+    def upload_video(self, video_path: str) -> str:
+        """upload and crop the rendered video based on the requested dimensions"""
+        url = upload_and_crop_video(video_path, self.video_request.video_details.dimensions.width, self.video_request.video_details.dimensions.height)
+        if url is None:
+            raise Exception(f"Error uploading the video: {os.path.basename(video_path)}")
+        return url
+
+    def render_video(self) -> str:
+        """
+        Generate the final video locally and return its path.
+        Uploading is kept separate so it can overlap with scoring.
+        """
+        try:
+            return self._render_video()
+        finally:
+            # waits for the background work and reports the time it hid
+            self.prefetch.close()
+
+    def _render_video(self) -> str:
+        os.makedirs(self.data_dir, exist_ok=True)
         # if the request is for EcoVive Bottle, we will just provide the video we created manually
         # else we will generate the video 
         if "ecovive" in self.video_request.video_details.product_name.lower():
             eco_wive_full_res = "https://res.cloudinary.com/dzz1r3hcf/video/upload/v1734951827/xszvrae8vyvyv2ftudwj.mp4"
-            video_path = download_file(eco_wive_full_res, "final_video_ecovive.mp4")
-            logo_path = download_file(self.video_request.video_details.logo_url, "logo.png")
-            add_watermark(video_path, logo_path,"tmp/final_video_ecovive_watermarked.mp4")
-            return "tmp/final_video_ecovive_watermarked.mp4", upload_and_crop_video("tmp/final_video_ecovive_watermarked.mp4", self.video_request.video_details.dimensions.width, self.video_request.video_details.dimensions.height)
+            video_path = download_file(eco_wive_full_res, self.tmp_name("final_video_ecovive.mp4"))
+            logo_path = download_file(self.video_request.video_details.logo_url, self.tmp_name("logo.png"))
+            output_path = os.path.join(self.tmp_dir, "final_video_ecovive_watermarked.mp4")
+            media_pool.run(WatermarkVideoTask(video_path, logo_path, output_path, self.encode_profile))
+            return output_path
 
 
         # downloading logo
         logo_url = self.video_request.video_details.logo_url
         try:
-            logo_path = download_file(logo_url, "logo.png")
+            logo_path = download_file(logo_url, self.tmp_name("logo.png"))
+            with Image.open(logo_path) as logo:
+                self.logo_size = logo.size
         except Exception as e:
             raise Exception(f"Error downloading logo: {str(e)}")
         # download product video
         product_video_url = self.video_request.video_details.product_video_url
         try:
-            product_video_path = download_file(product_video_url, "product_video.mp4")
+            product_video_path = download_file(product_video_url, self.tmp_name("product_video.mp4"))
         except Exception as e:
             raise Exception(f"Error downloading product video: {str(e)}")
-        # upload to gemini
-        files = [
-            upload_to_gemini(logo_path),
-            upload_to_gemini(product_video_path)
-        ]
-        wait_for_files_active(files)
+        # the system instruction, logo and product video are the same for
+        # every job of a brand, they are uploaded only when not cached
+        prefix = context_cache.prefix(self.llm, [logo_path, product_video_path], upload=upload_files)
 
         # create the input text
         video_request_dict = self.video_request.model_dump()
@@ -408,29 +531,22 @@ The product video and logo have been attached for reference.
             }
             for color in colors
         ]
-        video_paths = [f"segment_{i}.mp4" for i in range(total_segments)]
+        video_paths = [self.tmp_name(f"segment_{i}.mp4") for i in range(total_segments)]
 
         # start chat session
-        chat_sess = self.llm.start_chat(
-            history=[
-                {
-                    "role": "user",
-                    "parts": [
-                        files[0],
-                    ],
-                },
-                {
-                    "role": "user",
-                    "parts": [
-                        files[1],
-                    ],
-                },
-            ]
-        )
-        response = chat_sess.send_message(input_text).text
-        print(f"{response=}")
-        # get the first prompt in json format
-        prompts = json.loads(self.llm_json_writer.generate_content(response).text)
+        chat_sess = prefix.model.start_chat(history=prefix.history)
+        # the logo and product video stay, older segments are summarized
+        history = ChatHistory(chat_sess, pinned=len(prefix.history))
+        checkpoint = self.checkpoint
+        plan = checkpoint.get("prompts_0")
+        if plan is None:
+            response = send_message(chat_sess, input_text).text
+            print(f"{response=}")
+            # get the first prompt in json format
+            prompts = self.extract_prompts(response)
+            checkpoint.save("prompts_0", response=response, prompts=prompts)
+        else:
+            prompts = self.replay_turn(chat_sess, input_text, plan)
         print(f"{prompts=}")
 
         # get the first frame
@@ -438,100 +554,186 @@ The product video and logo have been attached for reference.
         
 
         # generate the first segment
+        publish("segment", index=1, total=total_segments, status="started")
         last_frame_url = self.generate_segment(prompts["motion_prompt"], first_frame_url, video_paths[0])
+        publish("segment", index=1, total=total_segments, status="finished")
+        # the first segment decides the frame size of the parts and the
+        # watermark size. Each part is encoded while the next segment renders
+        assemble = checkpoint.output("watermark") is None
+        parts = []
+        if assemble:
+            first_segment = os.path.join("tmp", video_paths[0])
+            self.prefetch.submit("watermark_sprite", self.prepare_sprite, first_segment, logo_path)
+            parts.append(self.prefetch.submit("segment_part", self.prepare_part, 0, first_segment))
 
         # now we loop throught the next segments
         for i in range(1, total_segments):
-            
-            # download the last frame of the previous segment
-            last_frame = download_file(last_frame_url, "last_frame.png")
-            # upload the last frame of the previous segment and the video
-            files = [
-                upload_to_gemini(last_frame),
-                upload_to_gemini(f"tmp/{video_paths[i-1]}")
-            ]
-
-            wait_for_files_active(files)
-
-            chat_sess.history.append(
-                {
-                    "role": "user",
-                    "parts": [
-                        files[0],
-                    ],
-                }
-            )
-            chat_sess.history.append(
-                                {
-                    "role": "user",
-                    "parts": [
-                        files[1],
-                    ],
-                }
-            )
             input_text = f"Now write the prompt for the next segment no. {i+1}"
-            response = chat_sess.send_message(input_text).text
-            print(f"segment_{i+1}_response={response}")
-            prompts = json.loads(self.llm_json_writer.generate_content(response).text)
+            plan = checkpoint.get(f"prompts_{i}")
+            if plan is None:
+                # download the last frame of the previous segment
+                last_frame = download_file(last_frame_url, self.tmp_name("last_frame.png"))
+                # upload the last frame of the previous segment and the video
+                files = [
+                    upload_to_gemini(last_frame),
+                    upload_to_gemini(os.path.join("tmp", video_paths[i-1]))
+                ]
+
+                wait_for_files_active(files)
+
+                history.add_media(i, files, summary=(
+                    f"(The last frame and video of segment no. {i} were shown here. "
+                    f"It was rendered from this motion prompt: {prompts['motion_prompt']})"))
+                history.compact()
+                response = send_message(chat_sess, input_text).text
+                print(f"segment_{i+1}_response={response}")
+                prompts = self.extract_prompts(response)
+                checkpoint.save(f"prompts_{i}", response=response, prompts=prompts)
+            else:
+                prompts = self.replay_turn(chat_sess, input_text, plan)
             print(f"segment_{i+1}_prompts={prompts}")
+            publish("segment", index=i+1, total=total_segments, status="started")
             last_frame_url = self.generate_segment(prompts["motion_prompt"], last_frame_url, f"{video_paths[i]}")
-
-        # combine the segments
-        video_paths = ["tmp/"+path for path in video_paths]
-        output_path = "data/merged_output.mp4"
-        merge_videos(video_paths, output_path)
-        output_path_w = "data/merged_output_watermarked.mp4"
-        add_watermark(output_path, logo_path, output_path_w)
-        
-        # adding textual content
-        # we upload the final video to gemini first and get the textual content
-        files = [
-            upload_to_gemini(output_path_w)
-        ]
-        wait_for_files_active(files)
-        chat_sess.history.append(
-            {
-                "role": "user",
-                "parts": [
-                    files[0],
-                ],
-            }
-        )
-        input_text = "Provide the Post-Production Text Overlays for the final video"
-
-        response = chat_sess.send_message(input_text).text
-        print(f"text_prompt_{response=}")
-
-        text_xml = self.llm_xml_writer.generate_content(response).text
-        print(f"text_xml={text_xml}")
-
-        # text_overlays = json.loads(self.llm_json_text_overlay_writer.generate_content(text_xml).text)
-        # print(f"text_overlays={text_overlays}")
-
-        pattern = r'<texts>[\s\S]*?</texts>'
-        match = re.search(pattern, text_xml)
-        if match:
-            text_xml = match.group(0)
-            text_overlays = xml_parse(text_xml)
-            # text_overlays = json.loads(json.dumps(text_overlays))
-            text_overlays = convert_xml_string_to_float(text_overlays)
-            print(f"text_overlays={text_overlays}")
+            publish("segment", index=i+1, total=total_segments, status="finished")
+            if assemble:
+                parts.append(self.prefetch.submit("segment_part", self.prepare_part, i, os.path.join("tmp", video_paths[i])))
+
+        # the parts are already watermarked and appended as they were encoded
+        output_path_w = self.assembler.output_path
+        if assemble:
+            part_paths = [part.result() for part in parts]
+            if self.assembler.parts != len(part_paths):
+                # a part could not be appended, join them all instead
+                publish("render", step="merge")
+                media_pool.run(MergeTask(part_paths, output_path_w))
+            checkpoint.save("watermark", path=output_path_w)
+
+        text_plan = checkpoint.get("text_plan")
+        if text_plan is None:
+            text_overlays = self.plan_text_overlays(history, output_path_w)
+            checkpoint.save("text_plan", text_overlays=text_overlays)
         else:
-            text_overlays = json.loads(self.llm_json_text_overlay_writer.generate_content(text_xml).text)
+            text_overlays = text_plan["text_overlays"]
             print(f"text_overlays={text_overlays}")
 
         # generate the final video with text overlays
-        output_path_t = "data/merged_output_watermarked_text.mp4"
+        output_path_t = os.path.join(self.data_dir, "merged_output_watermarked_text.mp4")
         if self.video_request.video_details.dimensions.width > self.video_request.video_details.dimensions.height:
             aspect_ratio = "landscape"
         else:
             aspect_ratio = "portrait"
-        self.generate_text_overlay(text_overlays, output_path_w, output_path_t,aspect_ratio)
+        if checkpoint.output("text_overlay") is None:
+            publish("render", step="text_overlay")
+            self.generate_text_overlay(text_overlays, output_path_w, output_path_t,aspect_ratio)
+            checkpoint.save("text_overlay", path=output_path_t)
+
+        return output_path_t
+
+    def prepare_sprite(self, segment_path: str, logo_path: str) -> str:
+        """size the parts after the first segment and render the watermark for that width"""
+        resolution = media_pool.run(ProbeTask(segment_path)).resolution
+        # h264 with yuv420p needs even dimensions
+        self.part_size = (resolution.width - resolution.width % 2, resolution.height - resolution.height % 2)
+        self.sprite_path = prepare_watermark(logo_path, self.part_size[0], os.path.join(self.tmp_dir, "watermark.png"))
+        return self.sprite_path
+
+    def prepare_part(self, index: int, segment_path: str) -> str:
+        """watermark a finished segment into a part and append it to the running output"""
+        stage = f"part_{index}"
+        part_path = self.checkpoint.output(stage)
+        if part_path is None:
+            part_path = os.path.join(self.tmp_dir, f"part_{index}.mp4")
+            if self.smart_render:
+                task = WatermarkTask(segment_path, self.sprite_path, self.part_size, part_path,
+                                     self.encode_profile, keyframe_params())
+            else:
+                task = WatermarkTask(segment_path, self.sprite_path, self.part_size, part_path)
+            media_pool.run(task)
+            self.checkpoint.save(stage, path=part_path)
+        # appending is only possible while every earlier part made it in
+        if self.assembler.parts == index:
+            try:
+                with timed("fmp4_append"):
+                    self.assembler.append(part_path)
+                publish("preview", segments=index + 1, duration=round(self.assembler.duration, 3))
+            except ValueError as e:
+                print(f"Error appending {part_path}, the parts will be joined at the end: {e}")
+        return part_path
+
+    def replay_turn(self, chat_sess, input_text: str, plan: Dict) -> Dict:
+        """
+        Put a checkpointed exchange back into the chat history instead of
+        asking Gemini again. Only the text is restored, the media uploaded
+        for that turn is not, since the model's answer already describes it.
+        """
+        chat_sess.history.append({"role": "user", "parts": [input_text]})
+        chat_sess.history.append({"role": "model", "parts": [plan["response"]]})
+        return plan["prompts"]
+
+    def plan_text_overlays(self, history: ChatHistory, video_path: str) -> Dict:
+        """ask Gemini for the text overlays of the watermarked video"""
+        if self.text_planner == "local":
+            return self.place_text_overlays(history, video_path)
+        # adding textual content
+        # we upload the final video to gemini first and get the textual content
+        files = [
+            upload_to_gemini(video_path)
+        ]
+        wait_for_files_active(files)
+        # the whole video replaces the segments still attached
+        history.add_media("final", files, summary="(The final video was shown here.)",
+                          video_seconds=self.video_request.video_details.duration)
+        history.compact()
+        input_text = "Provide the Post-Production Text Overlays for the final video"
 
-        # upload and crop the video based on the given dimensions
-        output_url = upload_and_crop_video(output_path_t, self.video_request.video_details.dimensions.width, self.video_request.video_details.dimensions.height)
+        response = send_message(history.chat_sess, input_text).text
+        print(f"text_prompt_{response=}")
 
-        return output_path_t, output_url
+        # the xml writer is more reliable, the json writer is the fallback
+        try:
+            text_overlays = extract(lambda: generate_content(self.llm_xml_writer, response).text,
+                                    parse_text_overlays_xml, step="text_overlays_xml",
+                                    cache_key=cache_key(self.llm_xml_writer, response))
+        except ExtractionFailed as e:
+            print(f"Falling back to the json text overlay writer: {e}")
+            text_xml = e.output or response
+            text_overlays = extract(lambda: generate_content(self.llm_json_text_overlay_writer, text_xml).text,
+                                    parse_text_overlays_json, step="text_overlays_json",
+                                    cache_key=cache_key(self.llm_json_text_overlay_writer, text_xml))
+        print(f"text_overlays={text_overlays}")
+        return text_overlays
+
+    def place_text_overlays(self, history: ChatHistory, video_path: str) -> Dict:
+        """
+        ask Gemini only for the copy and timing of the text overlays, from
+        the conversation so far, and place and color them locally. The
+        final video is never uploaded.
+        """
+        duration = self.video_request.video_details.duration
+        # the background is measured while the model writes
+        stats = self.prefetch.submit("background_stats", media_pool.run, BackgroundStatsTask(video_path))
+        input_text = (f"Provide the Post-Production Text Overlays for the final video of {duration} seconds. "
+                      "Only write the content, font, font size and timing of each text, "
+                      "their positions and colors are chosen from the video afterwards.")
+        with self.prefetch.remote_wait():
+            response = send_message(history.chat_sess, input_text).text
+        print(f"text_prompt_{response=}")
+        text_copies = extract(lambda: generate_content(self.llm_json_text_copy_writer, response).text,
+                              parse_text_copies, step="text_copies",
+                              cache_key=cache_key(self.llm_json_text_copy_writer, response))
+        dimensions = self.video_request.video_details.dimensions
+        text_overlays = check_text_overlays(place_texts(
+            stats.result(), text_copies["texts"], video_size(video_path),
+            palette=self.video_request.video_details.brand_palette, portrait=dimensions.width <= dimensions.height,
+            logo_size=self.logo_size))
+        print(f"text_overlays={text_overlays}")
+        return text_overlays
+
+    def extract_prompts(self, response: str) -> Dict:
+        """the prompts of a segment from the creative director's answer, as json"""
+        return extract(lambda: generate_content(self.llm_json_writer, response).text,
+                       json_schema(VideoGenerationPrompts), step="prompts",
+                       cache_key=cache_key(self.llm_json_writer, response))
     
     def get_first_frame(self,prompts:Dict,colors:List) -> str:
         # getting the style
@@ -570,8 +772,13 @@ The product video and logo have been attached for reference.
 
 
 
+        done = self.checkpoint.get("first_frame")
+        if done is not None:
+            print(f"first_frame_url={done['url']} (checkpoint)")
+            return done["url"]
+
         try:
-            result = fal_client.subscribe(
+            result = fal_run(
                 "fal-ai/recraft-v3",
                 arguments={
                     "prompt": prompts["keyframe_prompt"],
@@ -579,54 +786,95 @@ The product video and logo have been attached for reference.
                     "style": style,
                     "colors": colors
                 },
-                with_logs=True,
+                job_id=self.job_id,
+                step="first_frame",
                 on_queue_update=on_queue_update,
             )
             first_frame_url = result["images"][0]["url"]
             print(f"{first_frame_url=}")
+            self.checkpoint.save("first_frame", url=first_frame_url)
             return first_frame_url
         except Exception as e:
             raise Exception(f"Error generating first frame: {str(e)}")
     
     def generate_segment(self, prompt:str, image_url:str, save_path:str) -> str:
         """generate a 5 seconds long segment, these take ~220 seconds each to generate"""
-        try:
-            result = fal_client.subscribe(
-                "fal-ai/kling-video/v1.6/standard/image-to-video",
-                arguments={
-                    "prompt":prompt,
-                    "image_url": image_url,
-                    # "prompt_optimizer": True
-                },
-                with_logs=True,
-                on_queue_update=on_queue_update,
-            )
-            segment_url = result["video"]["url"]
-            print(f"{segment_url=}")
-        except Exception as e:
-            raise Exception(f"Error generating segment: {str(e)}")
-        # download the first 5 seconds
-        try:
-            segment_path = download_file(segment_url, save_path)
-        except Exception as e:
-            raise Exception(f"Error downloading segment: {str(e)}")
+        # one render per segment file, e.g. segment_0
+        step = os.path.splitext(os.path.basename(save_path))[0]
+        done = self.checkpoint.get(step)
+        if done is not None:
+            # the file may be gone if the job is resumed on another machine
+            if not os.path.exists(done["path"]):
+                download_file(done["video_url"], save_path)
+            print(f"{step} restored from checkpoint")
+            # it passed the quality check, the later segments must match its size
+            if self.segment_size is None:
+                self.segment_size = tuple(done["size"])
+            return done["last_frame_url"]
+
+        # a segment that fails the quality check is rendered again before
+        # the next one starts from its last frame
+        for attempt in range(1, SEGMENT_ATTEMPTS + 1):
+            try:
+                # the segments finished so far are encoded while this renders
+                with self.prefetch.remote_wait():
+                    result = fal_run(
+                        "fal-ai/kling-video/v1.6/standard/image-to-video",
+                        arguments={
+                            "prompt":prompt,
+                            "image_url": image_url,
+                            # "prompt_optimizer": True
+                        },
+                        job_id=self.job_id,
+                        # every attempt is a render of its own
+                        step=step if attempt == 1 else f"{step}_attempt_{attempt}",
+                        on_queue_update=on_queue_update,
+                    )
+                segment_url = result["video"]["url"]
+                print(f"{segment_url=}")
+            except Exception as e:
+                raise Exception(f"Error generating segment: {str(e)}")
+            # download the first 5 seconds
+            try:
+                segment_path = download_file(segment_url, save_path)
+            except Exception as e:
+                raise Exception(f"Error downloading segment: {str(e)}")
+
+            report, last_frame = self.check_segment(segment_path)
+            publish("segment_quality", step=step, attempt=attempt, passed=report.passed, problems=report.problems, **report.stats)
+            if report.passed:
+                break
+            print(f"{step} attempt {attempt} failed the quality check: {'; '.join(report.problems)}")
+        if not report.passed:
+            raise Exception(f"Error generating segment: {step} failed the quality check {SEGMENT_ATTEMPTS} times: "
+                            f"{'; '.join(report.problems)}")
+        if self.segment_size is None:
+            self.segment_size = tuple(report.stats["resolution"])
 
-        # get the last frame of the first 5 seconds
-        try:
-            last_frame = get_last_frame(segment_path)
-        except Exception as e:
-            raise Exception(f"Error getting last frame of segment: {str(e)}")
-        
         # upload the frame and get url
         last_frame_url = upload_image(last_frame)
         print(f"{last_frame_url=}")
+        # a failed upload returns its error, which must not be checkpointed
+        if last_frame_url.startswith("Error"):
+            raise Exception(last_frame_url)
+        self.checkpoint.save(step, video_url=segment_url, path=segment_path, last_frame_url=last_frame_url,
+                             size=self.segment_size)
         return last_frame_url
     
+    def check_segment(self, segment_path: str) -> Tuple[SegmentReport, Optional[str]]:
+        """the quality report and the path of the last frame of a downloaded segment, from one decode"""
+        frame_path = os.path.splitext(segment_path)[0] + "_last_frame.png"
+        try:
+            results = media_pool.run(LastFrameTask(segment_path, frame_path))
+        except Exception as e:
+            return SegmentReport(passed=False, problems=[f"could not be decoded: {e}"], stats={}), None
+        # later segments must match the first, they are joined into one video
+        report = check_segment(results["segment_quality"], results["metadata"], expected_size=self.segment_size)
+        return report, results["last_frame"]
+
     def generate_text_overlay(self, text_overlays:Dict, video_path:str, output_path:str, aspect_ratio:str="landscape") -> str:
-        text_clips = []
-        for text in text_overlays["texts"]:
-            text_clip = fade_in_text(video_path, text["text_duration"], text["text"], text["font_size"], text["position"], text["color"], text["font"], aspect_ratio)
-            text_clips.append(text_clip)
-        print(f"succesfully generated {len(text_clips)} text clips")
-        embed_text_clips(video_path,text_clips, output_path)
+        seconds = media_pool.run(OverlayTask(video_path, text_overlays["texts"], output_path, self.encode_profile,
+                                             aspect_ratio, smart=self.smart_render))
+        if seconds is not None:
+            publish("render", step="smart_render", **seconds)
         return output_path
@@ -0,0 +1,374 @@
+import asyncio
+import os
+import uuid
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from ..models.schemas import VideoRequest, VideoResponse, Metadata, JobStatus
+from ..utils.helpers import download_file, send_email
+from ..utils.db_helpers import set_response_data, get_response_data, set_cached_response_id, get_cached_response_id, set_job_status, get_resumable_job_id
+from ..utils.admission import admission, projected_segments
+from ..utils.brand_analytics import preliminary_scores
+from ..utils.dedupe import InFlightJobs, request_fingerprint
+from ..utils.job_queue import get_job_queue
+from ..utils.media_pool import AnalysisTask, ProbeTask, media_pool
+from ..utils.metrics import JobTimeline, job_timeline
+from ..utils.pipeline import Pipeline
+from ..utils.progress import broker, current_job_id, publish
+from .video_generator import VideoGenerator
+from .video_scorer import VideoScorer
+
+FRONTEND_URL = os.environ.get("FRONTEND_URL")
+# seconds for which an identical request returns the stored response
+# instead of generating a new video, 0 disables the cache
+RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL", "0"))
+
+in_flight_jobs = InFlightJobs()
+# with JOB_QUEUE set, jobs are enqueued for worker processes (src/worker.py)
+# instead of running here
+job_queue = get_job_queue()
+# seconds between checks of a queued job's state
+QUEUE_POLL_INTERVAL = float(os.environ.get("QUEUE_POLL_INTERVAL", "2"))
+# tasks following queued jobs, one per job id
+_followed_jobs: Dict[str, asyncio.Future] = {}
+
+
+def notify_requester(email: str, identifier: str) -> None:
+    if email:
+        send_email("VideoCreativeGen", email, "Your Requested Video is Ready",
+                   f"""Thank you for using VideoCreativeGen.
+Your requested video has been generated and scored.
+Access it now at {FRONTEND_URL}/{identifier}.
+""")
+
+
+def build_video_pipeline(request: VideoRequest, job_id: Optional[str] = None, timeline: Optional[JobTimeline] = None) -> Pipeline:
+    """
+    Build the stage graph for one request:
+
+        render -> upload ---------------\\
+               -> analysis -> score -----> persist -> notify
+               -> metadata ------------/
+
+    Scoring, the analysis and the metadata probe only need the local file,
+    so they run while the rendered video is being uploaded to Cloudinary.
+    The analysis measures the brand palette and logo locally, which gives
+    a preliminary brand score at once and context to the scoring model.
+    The render, upload and score stages are checkpointed under the job id,
+    so running the pipeline again for a failed job only repeats what did
+    not finish.
+    """
+    job_id = job_id or str(uuid.uuid4())
+    generator = VideoGenerator(request, job_id=job_id)
+    checkpoint = generator.checkpoint
+    pipeline = Pipeline()
+
+    def render() -> Path:
+        video_path = Path(generator.render_video())
+        print(f"Generated video: {video_path}")
+        return video_path
+
+    def upload(render: Path) -> str:
+        done = checkpoint.get("upload")
+        if done is not None:
+            return done["url"]
+        generated_url = generator.upload_video(str(render))
+        print(f"Generated video url: {generated_url}")
+        checkpoint.save("upload", url=generated_url)
+        return generated_url
+
+    def analysis(render: Path) -> Dict:
+        # one decode gives the poster, a contact sheet, the palette and the
+        # brand analytics. The render carries our own watermark, the logo
+        # search leaves it out
+        logo_path = download_file(request.video_details.logo_url, generator.tmp_name("logo.png"))
+        results = media_pool.run(AnalysisTask(str(render), os.path.join(generator.data_dir, "poster.jpg"),
+                                              os.path.join(generator.data_dir, "contact_sheet.jpg"),
+                                              request.video_details.brand_palette, logo_path))
+        publish("analysis", **results["palette"])
+        brand = results["brand"]
+        brand["preliminary_scores"] = preliminary_scores(brand, request.scoring_criteria)
+        publish("preliminary_score", scores=brand["preliminary_scores"], logo_presence=brand["logo_presence"],
+                on_palette_share=brand["on_palette_share"])
+        return brand
+
+    def score(render: Path, analysis: Dict) -> Dict:
+        done = checkpoint.get("score")
+        if done is not None:
+            return done["scoring"]
+        scorer = VideoScorer(request, render, job_id=job_id, brand_analytics=analysis)
+        scoring = scorer.score_video()
+        checkpoint.save("score", scoring=scoring)
+        return scoring
+
+    def metadata(render: Path) -> Metadata:
+        # the header has the metadata
+        video_metadata = media_pool.run(ProbeTask(str(render)))
+        video_metadata.resolution.width = request.video_details.dimensions.width
+        video_metadata.resolution.height = request.video_details.dimensions.height
+        return video_metadata
+
+    def persist(upload: str, score: Dict, metadata: Metadata, analysis: Dict) -> VideoResponse:
+        # the timings cover every stage that finished before this one
+        response = VideoResponse(
+            status="success",
+            video_url=upload,
+            scoring=score,
+            metadata=metadata,
+            brand_analytics=analysis,
+            identifier="",
+            stage_timings=dict(pipeline.timings),
+            timeline=timeline.to_list() if timeline else [],
+        )
+        return set_response_data(response)
+
+    def notify(persist: VideoResponse) -> None:
+        notify_requester(request.email, persist.identifier)
+
+    pipeline.add_stage("render", render)
+    pipeline.add_stage("upload", upload, deps=["render"])
+    pipeline.add_stage("analysis", analysis, deps=["render"])
+    pipeline.add_stage("score", score, deps=["render", "analysis"])
+    pipeline.add_stage("metadata", metadata, deps=["render"])
+    pipeline.add_stage("persist", persist, deps=["upload", "score", "metadata", "analysis"])
+    pipeline.add_stage("notify", notify, deps=["persist"])
+    return pipeline
+
+
+def run_video_pipeline(request: VideoRequest, job_id: Optional[str] = None) -> VideoResponse:
+    """
+    Generate, upload, score and store a video for the given request.
+    Progress is published to the broker under the job id.
+    """
+    job_id = job_id or str(uuid.uuid4())
+    token = current_job_id.set(job_id)
+    try:
+        publish("started")
+        with job_timeline() as timeline:
+            pipeline = build_video_pipeline(request, job_id, timeline)
+            results = pipeline.run()
+        # timings stop where the response was stored, so the returned and
+        # the stored response are the same
+        response = results["persist"]
+        publish("completed", identifier=response.identifier)
+        return response
+    except Exception as e:
+        publish("failed", error=str(e))
+        raise
+    finally:
+        current_job_id.reset(token)
+
+
+# keeps background tasks referenced until they finish
+_background_tasks = set()
+
+
+def _track(task: asyncio.Future) -> asyncio.Future:
+    _background_tasks.add(task)
+
+    def _done(finished: asyncio.Future) -> None:
+        _background_tasks.discard(finished)
+        if not finished.cancelled():
+            finished.exception()
+
+    task.add_done_callback(_done)
+    return task
+
+
+async def start_video_job(request: VideoRequest, tenant: Optional[str] = None) -> Tuple[str, asyncio.Future]:
+    """
+    Start the job for a request and return its id with a future for the
+    response, without waiting for it.
+
+    If an identical request (ignoring the email) is already running, the
+    id and future are those of that job; if one finished less than
+    RESULT_CACHE_TTL seconds ago, a new job id is returned that is already
+    completed with its stored response. If an earlier job for the request
+    failed (or was interrupted by a restart), it is resumed under its id
+    from its checkpoints. Otherwise every run gets a new id, so the progress
+    of separate runs is never mixed.
+
+    Jobs that generate a video go through admission control, counted
+    against the tenant (the caller's API key, or else the email). Raises
+    AdmissionRejected when there is no room for them.
+    """
+    fingerprint = request_fingerprint(request)
+    if RESULT_CACHE_TTL > 0:
+        cached_id = await run_in_threadpool(get_cached_response_id, fingerprint, RESULT_CACHE_TTL)
+        if cached_id:
+            print(f"Returning cached response {cached_id} for request {fingerprint[:12]}")
+            response = await run_in_threadpool(get_response_data, cached_id)
+            job_id = str(uuid.uuid4())
+            # published before returning so the job is already completed
+            # when the caller looks it up
+            broker.publish(job_id, "completed", identifier=response.identifier, cached=True)
+            return job_id, _track(asyncio.ensure_future(_serve_cached(request, response)))
+
+    running = await _join_running(request, fingerprint)
+    if running is not None:
+        return running
+
+    ticket = await admission.acquire(tenant or request.email or None, projected_segments(request.video_details.duration))
+    try:
+        # an identical request may have started the job while this one waited
+        running = await _join_running(request, fingerprint)
+        if running is not None:
+            admission.release(ticket)
+            return running
+        job_id, task = await _start(request, fingerprint)
+    except Exception:
+        admission.release(ticket)
+        raise
+    task.add_done_callback(lambda _: admission.release(ticket))
+    return job_id, task
+
+
+async def _join_running(request: VideoRequest, fingerprint: str) -> Optional[Tuple[str, asyncio.Future]]:
+    """the id and a future of the job already running for the request, if any"""
+    if job_queue is not None:
+        active = await run_in_threadpool(job_queue.find_active, fingerprint)
+        if active is None:
+            return None
+        print(f"Joining queued job {active.job_id} for request {fingerprint[:12]}")
+        return active.job_id, _track(asyncio.ensure_future(_join(request, _follow(active.job_id), active.owner)))
+    running = in_flight_jobs.get(fingerprint)
+    if running is None:
+        return None
+    print(f"Joining in-flight job {running.job_id} for request {fingerprint[:12]}")
+    return running.job_id, _track(asyncio.ensure_future(_join(request, running.task, running.owner)))
+
+
+async def _start(request: VideoRequest, fingerprint: str) -> Tuple[str, asyncio.Future]:
+    if job_queue is not None:
+        return await _enqueue(request, fingerprint)
+
+    job_id = await run_in_threadpool(get_resumable_job_id, fingerprint)
+    if job_id is not None:
+        print(f"Resuming job {job_id} for request {fingerprint[:12]}")
+        # the events of the failed attempt would end the new stream at once
+        broker.clear(job_id)
+    else:
+        job_id = str(uuid.uuid4())
+    await run_in_threadpool(set_job_status, job_id, fingerprint, "running")
+    broker.publish(job_id, "queued")
+    task = in_flight_jobs.start(fingerprint, _run_and_cache(request, fingerprint, job_id),
+                                owner=request.email, job_id=job_id)
+    return job_id, task
+
+
+async def submit_video_request(request: VideoRequest, tenant: Optional[str] = None) -> VideoResponse:
+    """
+    Run (or join) the job for a request and wait for its response.
+    """
+    _, task = await start_video_job(request, tenant)
+    # shield so a disconnecting client doesn't cancel the shared job
+    return await asyncio.shield(task)
+
+
+async def _serve_cached(request: VideoRequest, response: VideoResponse) -> VideoResponse:
+    await run_in_threadpool(notify_requester, request.email, response.identifier)
+    return response
+
+
+async def _join(request: VideoRequest, task: asyncio.Task, owner_email: str) -> VideoResponse:
+    response = await asyncio.shield(task)
+    if request.email != owner_email:
+        await run_in_threadpool(notify_requester, request.email, response.identifier)
+    return response
+
+
+async def _run_and_cache(request: VideoRequest, fingerprint: str, job_id: str) -> VideoResponse:
+    try:
+        response = await run_in_threadpool(run_video_pipeline, request, job_id)
+    except Exception:
+        await run_in_threadpool(set_job_status, job_id, fingerprint, "failed")
+        raise
+    await run_in_threadpool(set_job_status, job_id, fingerprint, "completed")
+    await run_in_threadpool(set_cached_response_id, fingerprint, response.identifier)
+    return response
+
+
+async def _enqueue(request: VideoRequest, fingerprint: str) -> Tuple[str, asyncio.Future]:
+    """start a job for queue deployments, it is run by a worker process"""
+    job_id = await run_in_threadpool(get_resumable_job_id, fingerprint)
+    if job_id is not None:
+        print(f"Resuming job {job_id} for request {fingerprint[:12]}")
+        broker.clear(job_id)
+    else:
+        job_id = str(uuid.uuid4())
+    await run_in_threadpool(set_job_status, job_id, fingerprint, "queued")
+    await run_in_threadpool(job_queue.enqueue, job_id, fingerprint, request.model_dump_json(), request.email)
+    broker.publish(job_id, "queued")
+    return job_id, _follow(job_id)
+
+
+def _follow(job_id: str) -> asyncio.Future:
+    """the task that waits for a queued job, shared by everyone waiting on it"""
+    task = _followed_jobs.get(job_id)
+    if task is None:
+        task = _track(asyncio.ensure_future(_follow_queued_job(job_id)))
+        _followed_jobs[job_id] = task
+        task.add_done_callback(lambda _: _followed_jobs.pop(job_id, None))
+    return task
+
+
+async def _follow_queued_job(job_id: str) -> VideoResponse:
+    """
+    Wait for a worker to finish a queued job, and publish its state changes
+    here so /jobs/{job_id} and the event stream follow it. The detailed
+    progress events stay in the worker's process.
+    """
+    status = "queued"
+    while True:
+        job = await run_in_threadpool(job_queue.get, job_id)
+        if job is None:
+            raise RuntimeError(f"Job {job_id} is no longer queued")
+        if job.status == "running" and status != "running":
+            broker.publish(job_id, "started", worker=job.worker_id, attempt=job.attempts)
+        elif job.status == "completed":
+            response = await run_in_threadpool(get_response_data, job.identifier)
+            broker.publish(job_id, "completed", identifier=job.identifier)
+            return response
+        elif job.status == "failed":
+            broker.publish(job_id, "failed", error=job.error)
+            raise RuntimeError(job.error)
+        status = job.status
+        await asyncio.sleep(QUEUE_POLL_INTERVAL)
+
+
+def job_preview_path(job_id: str) -> Optional[str]:
+    """
+    The watermarked video of a job as far as it has been assembled, without
+    text overlays, or None if no segment has been appended yet.
+    """
+    # job ids are uuids, anything else must not reach the filesystem
+    try:
+        job_id = str(uuid.UUID(job_id))
+    except ValueError:
+        return None
+    path = os.path.join("data", job_id, "merged_output_watermarked.mp4")
+    return path if os.path.exists(path) else None
+
+
+def job_status(job_id: str) -> JobStatus:
+    """Current status of a job from its latest progress event."""
+    last_event = broker.latest(job_id)
+    if last_event is None and job_queue is not None:
+        # enqueued by another API process, or before a restart
+        job = job_queue.get(job_id)
+        if job is not None:
+            return JobStatus(job_id=job_id, status=job.status, identifier=job.identifier)
+    if last_event is None:
+        return JobStatus(job_id=job_id, status="unknown")
+    if last_event.event in ("queued", "completed", "failed"):
+        status = last_event.event
+    else:
+        status = "running"
+    return JobStatus(
+        job_id=job_id,
+        status=status,
+        identifier=last_event.data.get("identifier") if status == "completed" else None,
+        last_event=last_event,
+    )
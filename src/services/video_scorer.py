@@ -1,18 +1,24 @@
-import json
-from typing import Dict
+from typing import Dict, Optional
 import google.generativeai as genai
 import os
 from fastapi import HTTPException
 from ..models.schemas import VideoRequest
-from ..utils.llm_helpers import upload_to_gemini, wait_for_files_active, safety_settings, gemini_generation_config
+from ..utils.llm_helpers import upload_files, send_message, generate_content, safety_settings, gemini_generation_config
+from ..utils.extraction import extract, json_schema
+from ..utils.context_cache import context_cache
+from ..utils.llm_cache import cache_key
+from ..utils.brand_analytics import describe
 from ..utils.helpers import download_file, create_dynamic_scoring_td
 
 
 genai.configure(api_key=os.environ["GEMINI_API_KEY"])
 class VideoScorer:
-    def __init__(self,video_request: VideoRequest, generated_video_path: str):
+    def __init__(self,video_request: VideoRequest, generated_video_path: str, job_id: Optional[str] = None,
+                 brand_analytics: Optional[Dict] = None):
         self.video_request = video_request
+        self.brand_analytics = brand_analytics
         self.generated_video_path = generated_video_path
+        self.job_id = job_id
         self.llm =  genai.GenerativeModel(
                         model_name="gemini-2.0-flash-exp",
                         generation_config=gemini_generation_config,
@@ -36,6 +42,7 @@ Now based on the criteria, and the information provided, you need to:
 """
                     )
         scoring_criteria = list(video_request.scoring_criteria.keys())
+        self.scoring_schema = create_dynamic_scoring_td(scoring_criteria)
         self.llm_json_writer = genai.GenerativeModel(
             model_name= "gemini-1.5-flash",
             generation_config={
@@ -43,7 +50,7 @@ Now based on the criteria, and the information provided, you need to:
                 "top_p": 0.95,
                 "top_k": 40,
                 "response_mime_type": "application/json", 
-                "response_schema": create_dynamic_scoring_td(scoring_criteria)
+                "response_schema": self.scoring_schema
             },
             safety_settings=safety_settings,
             system_instruction="From the given text, extract the required data for the given JSON schema and provide the JSON response. For the jusitification part, provide brief summaries of each scoring criteria and how the video meets that criteria. For the scores, don't do any divisions to make it a percentage, just provide the raw scores."
@@ -51,7 +58,7 @@ Now based on the criteria, and the information provided, you need to:
     def score_video(self) -> Dict:
         generated_video_path = os.path.abspath(self.generated_video_path)
         logo_url = self.video_request.video_details.logo_url
-        logo_path = download_file(logo_url, "logo.png")
+        logo_path = download_file(logo_url, os.path.join(self.job_id, "logo.png") if self.job_id else "logo.png")
         video_request_dict = self.video_request.model_dump()
         input_text = f"""
 product_name: {video_request_dict['video_details']['product_name']}
@@ -73,30 +80,30 @@ More info on Scording Criteria:
 ○ Audience Relevance:
 	■ Appeal to the target audience's values and preferences.
 """
-        files = [
-            upload_to_gemini(generated_video_path),
-            upload_to_gemini(logo_path)
-        ]
-        wait_for_files_active(files)
-
-        chat_sess = self.llm.start_chat(
-            history=[
+        if self.brand_analytics:
+            # measured on the frames, so the brand score doesn't depend on
+            # what the model happens to notice
+            input_text += f"""Measured brand analytics of the video, use them for the brand guideline score:
+{describe(self.brand_analytics)}
+"""
+        # the rubric instruction and logo are the same for every video of a
+        # brand and can be cached, the generated video is new every time
+        prefix = context_cache.prefix(self.llm, [logo_path], upload=upload_files)
+        files = upload_files([generated_video_path])
+        chat_sess = prefix.model.start_chat(
+            history=prefix.history + [
                 {
                     "role": "user",
                     "parts": [
                         files[0],
                     ],
                 },
-                {
-                    "role": "user",
-                    "parts": [
-                        files[1],
-                    ],
-                },
             ]
         )
-        response = chat_sess.send_message(input_text).text
+        response = send_message(chat_sess, input_text).text
         print(response)
-        scoring = json.loads(self.llm_json_writer.generate_content(response).text)
+        scoring = extract(lambda: generate_content(self.llm_json_writer, response).text,
+                          json_schema(self.scoring_schema), step="scoring",
+                          cache_key=cache_key(self.llm_json_writer, response))
         print(scoring)
         return scoring
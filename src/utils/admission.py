@@ -0,0 +1,161 @@
+import asyncio
+import math
+import os
+import time
+from collections import Counter
+from typing import Dict, NamedTuple, Optional
+
+# limits on the work admitted at once, 0 disables a limit
+# jobs generating a video in this process (or enqueued by it)
+ADMISSION_MAX_JOBS = int(os.environ.get("ADMISSION_MAX_JOBS", "0"))
+# Kling segments of those jobs, ceil(duration / 5) each
+ADMISSION_MAX_SEGMENTS = int(os.environ.get("ADMISSION_MAX_SEGMENTS", "0"))
+# MB on disk under the scratch directories tmp/ and data/
+ADMISSION_MAX_SCRATCH_MB = float(os.environ.get("ADMISSION_MAX_SCRATCH_MB", "0"))
+# jobs of a single tenant, its API key or else its email
+ADMISSION_MAX_JOBS_PER_TENANT = int(os.environ.get("ADMISSION_MAX_JOBS_PER_TENANT", "0"))
+# how long a request waits for room before it is rejected, 0 rejects at once
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "0"))
+# sent as Retry-After with a rejection
+ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", "60"))
+
+SCRATCH_DIRS = ("tmp", "data")
+SEGMENT_SECONDS = 5
+
+
+def projected_segments(duration: int) -> int:
+    """Kling segments a video of this duration is rendered in"""
+    return math.ceil(duration / SEGMENT_SECONDS)
+
+
+def directory_size_mb(*paths: str) -> float:
+    total = 0
+    for path in paths:
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass # removed while walking
+    return total / 2**20
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, resource: str, retry_after: int):
+        super().__init__(f"Too many jobs: {resource} limit reached")
+        self.resource = resource
+        self.retry_after = retry_after
+
+
+class Ticket(NamedTuple):
+    tenant: Optional[str]
+    segments: int
+
+
+class AdmissionController:
+    """
+    Tracks the jobs admitted in this process and what they use, and holds
+    back new ones that would exceed a limit. A job is admitted when it
+    starts generating; cached and joined requests cost nothing and are
+    never held back. Call release() with the ticket once the job is done.
+    """
+    def __init__(self, max_jobs: int = ADMISSION_MAX_JOBS, max_segments: int = ADMISSION_MAX_SEGMENTS,
+                 max_scratch_mb: float = ADMISSION_MAX_SCRATCH_MB, max_jobs_per_tenant: int = ADMISSION_MAX_JOBS_PER_TENANT,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT, retry_after: int = ADMISSION_RETRY_AFTER,
+                 poll_interval: float = 0.5, disk_usage_ttl: float = 5.0):
+        self.limits = {
+            "jobs": max_jobs,
+            "segments": max_segments,
+            "scratch_mb": max_scratch_mb,
+            "tenant_jobs": max_jobs_per_tenant,
+        }
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.poll_interval = poll_interval
+        self.disk_usage_ttl = disk_usage_ttl
+        self.jobs = 0
+        self.segments = 0
+        self.tenants: Counter = Counter()
+        self.waiting = 0
+        self.rejected: Counter = Counter()
+        self._disk_usage = (0.0, -math.inf) # MB, when it was measured
+
+    def scratch_mb(self) -> float:
+        """disk used under the scratch directories, measured at most every disk_usage_ttl seconds"""
+        usage, measured = self._disk_usage
+        if time.monotonic() - measured >= self.disk_usage_ttl:
+            usage = directory_size_mb(*SCRATCH_DIRS)
+            self._disk_usage = (usage, time.monotonic())
+        return usage
+
+    def blocking_resource(self, tenant: Optional[str], segments: int) -> Optional[str]:
+        """the first resource a new job would exceed, or None if it fits"""
+        limits = self.limits
+        if limits["jobs"] and self.jobs + 1 > limits["jobs"]:
+            return "jobs"
+        # a job bigger than the whole limit is admitted once nothing else runs
+        if limits["segments"] and self.jobs and self.segments + segments > limits["segments"]:
+            return "segments"
+        if limits["tenant_jobs"] and tenant is not None and self.tenants[tenant] + 1 > limits["tenant_jobs"]:
+            return "tenant_jobs"
+        if limits["scratch_mb"] and self.scratch_mb() >= limits["scratch_mb"]:
+            return "scratch_mb"
+        return None
+
+    async def _blocking_resource(self, tenant: Optional[str], segments: int) -> Optional[str]:
+        """blocking_resource, with the scratch directories walked off the event loop"""
+        _, measured = self._disk_usage
+        if self.limits["scratch_mb"] and time.monotonic() - measured >= self.disk_usage_ttl:
+            await asyncio.to_thread(self.scratch_mb)
+        return self.blocking_resource(tenant, segments)
+
+    async def acquire(self, tenant: Optional[str], segments: int) -> Ticket:
+        """
+        Admit a job, waiting up to queue_timeout seconds for room. Raises
+        AdmissionRejected if there is none by then.
+        """
+        deadline = time.monotonic() + self.queue_timeout
+        resource = await self._blocking_resource(tenant, segments)
+        if resource is not None:
+            self.waiting += 1
+            try:
+                while resource is not None and time.monotonic() < deadline:
+                    await asyncio.sleep(min(self.poll_interval, max(deadline - time.monotonic(), 0)))
+                    resource = await self._blocking_resource(tenant, segments)
+            finally:
+                self.waiting -= 1
+        if resource is not None:
+            self.rejected[resource] += 1
+            raise AdmissionRejected(resource, self.retry_after)
+        self.jobs += 1
+        self.segments += segments
+        if tenant is not None:
+            self.tenants[tenant] += 1
+        return Ticket(tenant, segments)
+
+    def release(self, ticket: Ticket) -> None:
+        self.jobs -= 1
+        self.segments -= ticket.segments
+        if ticket.tenant is not None:
+            self.tenants[ticket.tenant] -= 1
+            if self.tenants[ticket.tenant] <= 0:
+                del self.tenants[ticket.tenant]
+
+    def utilization(self) -> Dict:
+        """current use and limit of every resource, plus waiting and rejected requests"""
+        used = {
+            "jobs": self.jobs,
+            "segments": self.segments,
+            "scratch_mb": round(self.scratch_mb(), 1),
+            # per tenant counts would expose emails and keys, report the busiest
+            "tenant_jobs": max(self.tenants.values(), default=0),
+        }
+        return {
+            "resources": {name: {"used": used[name], "limit": self.limits[name] or None} for name in used},
+            "tenants": len(self.tenants),
+            "waiting": self.waiting,
+            "rejected": dict(self.rejected),
+        }
+
+
+admission = AdmissionController()
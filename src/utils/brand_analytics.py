@@ -0,0 +1,194 @@
+"""
+Local brand analytics of a rendered video: how much of each frame is in the
+brand palette, and whether the logo is on screen. It runs on sampled frames
+during the analysis pass, in a few seconds on CPU, so the scorer gets the
+numbers as context and a preliminary brand score is ready before the
+video has even been uploaded for scoring.
+
+Colours are compared in CIE Lab, where the euclidean distance (delta E)
+follows perceived difference: every sampled pixel is assigned to its
+nearest palette colour at once, and counts as on-palette when it is
+closer than PALETTE_DELTA_E. The logo is found by template matching its
+masked silhouette at a few sizes around the watermark's. In a watermarked
+video the watermark's corner is left out of the search, the logo must be
+on screen somewhere else to count.
+
+    results = analyze(path, [BrandAnalytics(palette, logo_path, watermarked=True)])
+    results["brand"]["logo_presence"]
+"""
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from .helpers import watermark_box
+from .media_analysis import StreamInfo, _Sampler
+
+# delta E under which a pixel counts as a brand colour, around 10 is
+# "clearly the same colour", 20 still reads as the same hue
+PALETTE_DELTA_E = float(os.environ.get("PALETTE_DELTA_E", "20"))
+# share of on-palette pixels that earns a video the full palette half of
+# the preliminary brand score, a video is never all brand colours
+PALETTE_TARGET_SHARE = float(os.environ.get("PALETTE_TARGET_SHARE", "0.25"))
+# normalized correlation above which the logo counts as on screen
+LOGO_MATCH_THRESHOLD = float(os.environ.get("LOGO_MATCH_THRESHOLD", "0.7"))
+# logo widths searched for, as a share of the frame width; the watermark is
+# an eighth of it
+LOGO_SCALES = (1 / 16, 1 / 12, 1 / 8, 1 / 6, 1 / 4)
+# frames are downscaled to these widths for the palette and the logo search
+PALETTE_WIDTH = 160
+MATCH_WIDTH = 480
+
+# sRGB (D65) to XYZ, and the D65 white point
+_RGB_TO_XYZ = np.array([[0.4124564, 0.3575761, 0.1804375],
+                        [0.2126729, 0.7151522, 0.0721750],
+                        [0.0193339, 0.1191920, 0.9503041]], dtype=np.float32)
+_WHITE = np.array([0.95047, 1.0, 1.08883], dtype=np.float32)
+_EPSILON = 216 / 24389
+_KAPPA = 24389 / 27
+
+
+def hex_to_rgb(color: str) -> Tuple[int, int, int]:
+    color = color.strip().lstrip("#")
+    if len(color) == 3:
+        color = "".join(c * 2 for c in color)
+    if len(color) != 6:
+        raise ValueError(f"Invalid hex color: #{color}")
+    return tuple(int(color[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def rgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """CIE Lab of uint8 sRGB values of any shape (..., 3), as float32"""
+    c = np.asarray(rgb, dtype=np.float32) / 255
+    linear = np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ _RGB_TO_XYZ.T / _WHITE
+    f = np.where(xyz > _EPSILON, np.cbrt(xyz), (_KAPPA * xyz + 16) / 116)
+    return np.stack([116 * f[..., 1] - 16, 500 * (f[..., 0] - f[..., 1]), 200 * (f[..., 1] - f[..., 2])], axis=-1)
+
+
+def nearest_palette(lab: np.ndarray, palette_lab: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """index of the nearest palette colour and its delta E, for every row of an (n, 3) array"""
+    # |p - q|^2 = |p|^2 - 2 p.q + |q|^2, one matrix product for all pixels
+    distances = ((lab ** 2).sum(axis=1)[:, None] - 2 * lab @ palette_lab.T + (palette_lab ** 2).sum(axis=1)[None, :])
+    index = distances.argmin(axis=1)
+    return index, np.sqrt(np.maximum(distances[np.arange(len(lab)), index], 0))
+
+
+def _logo_template(logo_path: str) -> Tuple[np.ndarray, np.ndarray, Tuple[int, int]]:
+    """the logo in gray and its opaque area as a mask, cropped to the mask, and the size of the image"""
+    with Image.open(logo_path) as logo:
+        rgba = np.asarray(logo.convert("RGBA"))
+        size = logo.size
+    mask = (rgba[..., 3] > 127).astype(np.uint8) * 255
+    ys, xs = np.nonzero(mask)
+    if not len(xs):
+        # a logo without transparency is matched as a whole
+        mask[:] = 255
+        ys, xs = np.nonzero(mask)
+    box = (slice(ys.min(), ys.max() + 1), slice(xs.min(), xs.max() + 1))
+    return cv2.cvtColor(rgba[..., :3], cv2.COLOR_RGB2GRAY)[box], mask[box], size
+
+
+class BrandAnalytics(_Sampler):
+    """Palette coverage over time and logo presence of the sampled frames."""
+    name = "brand"
+
+    def __init__(self, palette: Sequence[str], logo_path: Optional[str] = None, rate: float = 2.0,
+                 delta_e: float = PALETTE_DELTA_E, watermarked: bool = False):
+        super().__init__(rate)
+        self.palette = list(palette)
+        self.palette_lab = rgb_to_lab(np.array([hex_to_rgb(color) for color in self.palette], dtype=np.uint8))
+        self.logo_path = logo_path
+        self.watermarked = watermarked
+        self.delta_e = delta_e
+        self.counts = np.zeros(len(self.palette), dtype=np.int64)
+        self.pixels = 0
+        self.coverage: List[Dict] = []
+        self.logo_scores: List[float] = []
+
+    def start(self, info: StreamInfo) -> None:
+        super().start(info)
+        self.palette_size = (PALETTE_WIDTH, max(1, round(info.height * PALETTE_WIDTH / info.width)))
+        self.match_size = (MATCH_WIDTH, max(1, round(info.height * MATCH_WIDTH / info.width)))
+        self.templates: List[Tuple[np.ndarray, np.ndarray]] = []
+        self.excluded: Optional[Tuple[int, int, int, int]] = None
+        if self.logo_path:
+            gray, mask, logo_size = _logo_template(self.logo_path)
+            if self.watermarked:
+                # the watermark's box on the search frame, rounded outwards
+                scale = MATCH_WIDTH / info.width
+                x0, y0, x1, y1 = watermark_box((info.width, info.height), logo_size)
+                self.excluded = (int(x0 * scale), int(y0 * scale), int(np.ceil(x1 * scale)), int(np.ceil(y1 * scale)))
+            for scale in LOGO_SCALES:
+                width = round(MATCH_WIDTH * scale)
+                height = round(gray.shape[0] * width / gray.shape[1])
+                if 4 <= height < self.match_size[1]:
+                    size = (width, height)
+                    self.templates.append((cv2.resize(gray, size, interpolation=cv2.INTER_AREA),
+                                           cv2.resize(mask, size, interpolation=cv2.INTER_NEAREST)))
+
+    def sample(self, t: float, frame: np.ndarray) -> None:
+        small = cv2.resize(frame, self.palette_size, interpolation=cv2.INTER_AREA)
+        index, distance = nearest_palette(rgb_to_lab(small).reshape(-1, 3), self.palette_lab)
+        on_palette = distance <= self.delta_e
+        self.counts += np.bincount(index[on_palette], minlength=len(self.palette))
+        self.pixels += len(index)
+        self.coverage.append({"t": round(t, 2), "share": round(float(on_palette.mean()), 4)})
+        if self.templates:
+            gray = cv2.cvtColor(cv2.resize(frame, self.match_size, interpolation=cv2.INTER_AREA), cv2.COLOR_RGB2GRAY)
+            best = 0.0
+            for template, mask in self.templates:
+                scores = cv2.matchTemplate(gray, template, cv2.TM_CCOEFF_NORMED, mask=mask)
+                if self.excluded is not None:
+                    # placements that overlap the watermark
+                    x0, y0, x1, y1 = self.excluded
+                    height, width = template.shape
+                    scores[max(0, y0 - height + 1):y1, max(0, x0 - width + 1):x1] = np.nan
+                # flat areas divide by zero
+                scores = scores[np.isfinite(scores)]
+                if scores.size:
+                    best = max(best, float(scores.max()))
+            self.logo_scores.append(best)
+
+    def finish(self) -> Dict:
+        pixels = self.pixels or 1
+        shares = [point["share"] for point in self.coverage]
+        logo_scores = np.array(self.logo_scores)
+        return {
+            "palette_coverage": [{"color": color, "share": round(float(count / pixels), 4)}
+                                 for color, count in zip(self.palette, self.counts)],
+            "on_palette_share": round(float(self.counts.sum() / pixels), 4),
+            "coverage_over_time": self.coverage,
+            "min_coverage": min(shares) if shares else None,
+            "max_coverage": max(shares) if shares else None,
+            "logo_presence": round(float((logo_scores >= LOGO_MATCH_THRESHOLD).mean()), 4) if logo_scores.size else None,
+            "logo_match_score": round(float(np.median(logo_scores)), 4) if logo_scores.size else None,
+            "frames_sampled": len(self.coverage),
+        }
+
+
+def preliminary_scores(analytics: Dict, scoring_criteria: Dict[str, int]) -> Dict[str, float]:
+    """
+    Brand criteria scored from the analytics alone, half for the palette
+    coverage and half for the logo presence. The other criteria need the
+    scoring model and are left out.
+    """
+    palette = min(1.0, analytics["on_palette_share"] / PALETTE_TARGET_SHARE)
+    logo = analytics["logo_presence"] if analytics["logo_presence"] is not None else palette
+    return {criterion: round(maximum * (palette + logo) / 2, 1)
+            for criterion, maximum in scoring_criteria.items() if "brand" in criterion.lower()}
+
+
+def describe(analytics: Dict) -> str:
+    """the analytics as text for the scoring prompt"""
+    coverage = ", ".join(f"{entry['color']} {entry['share']:.1%}" for entry in analytics["palette_coverage"])
+    lines = [
+        f"share of pixels per brand color: {coverage}",
+        f"share of pixels in the brand palette: {analytics['on_palette_share']:.1%} overall, "
+        f"from {analytics['min_coverage']:.1%} to {analytics['max_coverage']:.1%} per frame",
+    ]
+    if analytics["logo_presence"] is not None:
+        lines.append(f"logo visible in {analytics['logo_presence']:.0%} of the sampled frames")
+    return "\n".join(lines)
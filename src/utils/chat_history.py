@@ -0,0 +1,126 @@
+import mimetypes
+import os
+from typing import Any, Dict, Hashable, List, Optional
+
+from .progress import publish
+
+# segments whose last frame and video stay attached to the chat, older
+# ones are replaced by a text summary
+CHAT_MEDIA_WINDOW = int(os.environ.get("CHAT_MEDIA_WINDOW", "1"))
+# estimated tokens the history may hold before more of it is summarized
+CHAT_TOKEN_BUDGET = int(os.environ.get("CHAT_TOKEN_BUDGET", "32000"))
+
+# Gemini bills a fixed amount per image and per second of video
+IMAGE_TOKENS = 258
+VIDEO_TOKENS_PER_SECOND = 263
+# assumed length of a video whose duration we don't know, one segment
+DEFAULT_VIDEO_SECONDS = 5.0
+
+
+def _mime_type(part: Any) -> Optional[str]:
+    file_data = getattr(part, "file_data", None)
+    mime_type = getattr(part, "mime_type", None) or getattr(file_data, "mime_type", None)
+    if not mime_type:
+        name = getattr(part, "display_name", None) or getattr(part, "name", None) or getattr(file_data, "file_uri", None)
+        mime_type = mimetypes.guess_type(str(name))[0] if name else None
+    return mime_type or None
+
+
+def estimate_part_tokens(part: Any, video_seconds: float = DEFAULT_VIDEO_SECONDS) -> int:
+    """rough prompt tokens of one part: text, an uploaded file or a proto Part"""
+    if isinstance(part, str):
+        return len(part) // 4 + 1
+    text = part.get("text") if isinstance(part, dict) else getattr(part, "text", None)
+    if text:
+        return len(text) // 4 + 1
+    mime_type = _mime_type(part) or ""
+    if mime_type.startswith("image/"):
+        return IMAGE_TOKENS
+    return round(VIDEO_TOKENS_PER_SECOND * video_seconds)
+
+
+def _parts(entry: Any) -> List:
+    parts = entry.get("parts", []) if isinstance(entry, dict) else getattr(entry, "parts", [])
+    return list(parts)
+
+
+def estimate_tokens(history: List) -> int:
+    """rough prompt tokens of a chat history"""
+    return sum(estimate_part_tokens(part) for entry in history for part in _parts(entry))
+
+
+class _MediaTurn:
+    def __init__(self, index: int, segment: Hashable, tokens: int, summary: str):
+        self.index = index # position in the chat history
+        self.segment = segment
+        self.tokens = tokens
+        self.summary = summary
+        self.summarized = False
+
+
+class ChatHistory:
+    """
+    Keeps the creative director's chat history bounded. Every segment
+    attaches its last frame and video, so left alone each message resends
+    all segments so far and the cost of a job grows with the square of its
+    length. Only the media of the last `media_window` segments stays
+    attached. Older media is replaced by a short text summary. If the
+    estimated size is still above `token_budget`, the remaining media and
+    then the oldest text turns are replaced too. The first `pinned`
+    entries, the brand's logo and product video, are always kept.
+    """
+    def __init__(self, chat_sess, pinned: int = 2, media_window: int = CHAT_MEDIA_WINDOW, token_budget: int = CHAT_TOKEN_BUDGET):
+        self.chat_sess = chat_sess
+        self.pinned = pinned
+        self.media_window = media_window
+        self.token_budget = token_budget
+        self._media: List[_MediaTurn] = []
+
+    def add_media(self, segment: Hashable, parts: List, summary: str, video_seconds: float = DEFAULT_VIDEO_SECONDS) -> None:
+        """attach the media of a segment, one user turn per part, and the summary that replaces it later"""
+        for part in parts:
+            self.chat_sess.history.append({"role": "user", "parts": [part]})
+            self._media.append(_MediaTurn(len(self.chat_sess.history) - 1, segment,
+                                          estimate_part_tokens(part, video_seconds), summary))
+
+    def _estimate(self, history: List) -> int:
+        media = {turn.index: turn.tokens for turn in self._media if not turn.summarized}
+        return sum(media[i] if i in media else sum(estimate_part_tokens(part) for part in _parts(entry))
+                   for i, entry in enumerate(history))
+
+    def compact(self) -> Dict[str, int]:
+        """apply the window and the budget before the next message, returns the estimated size"""
+        history = list(self.chat_sess.history)
+        segments = list(dict.fromkeys(turn.segment for turn in self._media))
+        recent = set(segments[-self.media_window:]) if self.media_window > 0 else set()
+
+        def summarize(turn: _MediaTurn) -> None:
+            # one summary per segment, its other media turns become a stub
+            first = not any(other.summarized for other in self._media if other.segment == turn.segment)
+            history[turn.index] = {"role": "user", "parts": [turn.summary if first else "(media omitted)"]}
+            turn.summarized = True
+
+        for turn in self._media:
+            if not turn.summarized and turn.segment not in recent:
+                summarize(turn)
+        for turn in self._media:
+            if self._estimate(history) <= self.token_budget:
+                break
+            if not turn.summarized:
+                summarize(turn)
+        media_indexes = {turn.index for turn in self._media}
+        for i in range(self.pinned, len(history)):
+            if self._estimate(history) <= self.token_budget:
+                break
+            if i not in media_indexes:
+                role = history[i].get("role") if isinstance(history[i], dict) else getattr(history[i], "role", "user")
+                history[i] = {"role": role, "parts": ["(earlier turn omitted)"]}
+
+        self.chat_sess.history = history
+        stats = {
+            "estimated_tokens": self._estimate(history),
+            "attached_media": sum(1 for turn in self._media if not turn.summarized),
+            "turns": len(history),
+        }
+        publish("chat_history", **stats)
+        return stats
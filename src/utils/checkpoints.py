@@ -0,0 +1,48 @@
+import os
+import threading
+from typing import Any, Dict, Optional
+
+from .db_helpers import get_checkpoints, set_checkpoint
+from .progress import publish
+
+
+class JobCheckpoint:
+    """
+    The completed stages of a job and what they produced (prompts, fal
+    urls, local files, text plans), persisted in sqlite as each stage
+    finishes. A job started again with the same job id loads them and skips
+    every stage that is already done, so a failure late in the render only
+    costs the failed step on retry.
+    """
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Dict[str, Any]] = get_checkpoints(job_id)
+        if self._stages:
+            print(f"Resuming job {job_id} after {', '.join(self._stages)}")
+
+    def __contains__(self, stage: str) -> bool:
+        with self._lock:
+            return stage in self._stages
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._stages)
+
+    def get(self, stage: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._stages.get(stage)
+
+    def save(self, stage: str, **data: Any) -> None:
+        """Record a completed stage, the data must be json serializable."""
+        set_checkpoint(self.job_id, stage, data)
+        with self._lock:
+            self._stages[stage] = data
+        publish("checkpoint", stage=stage)
+
+    def output(self, stage: str) -> Optional[str]:
+        """The file a stage wrote, if the stage is done and the file still exists."""
+        data = self.get(stage)
+        if data is None or not data.get("path") or not os.path.exists(data["path"]):
+            return None
+        return data["path"]
@@ -0,0 +1,122 @@
+import datetime
+import hashlib
+import os
+import time
+from typing import Any, Callable, List, NamedTuple
+
+import google.generativeai as genai
+from google.generativeai import caching
+
+from .db_helpers import get_context_cache, set_context_cache
+from .metrics import timed
+from .progress import publish
+
+# cache the system instruction and brand assets of the creative director
+# and scorer chats in Gemini, so repeat brands don't resend them
+CONTEXT_CACHE = os.environ.get("CONTEXT_CACHE", "1") == "1"
+# lifetime of a cache, it is extended when it is used close to its expiry
+CONTEXT_CACHE_TTL = int(os.environ.get("CONTEXT_CACHE_TTL", "3600"))
+# a cache expiring sooner than this is extended before a job uses it, so it
+# outlives the job
+CONTEXT_CACHE_REFRESH = int(os.environ.get("CONTEXT_CACHE_REFRESH", "900"))
+
+
+class CachedPrefix(NamedTuple):
+    model: Any # the model to start the chat with
+    history: List # entries to start its history with, empty when they are cached
+    cached: bool
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(2**20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def prefix_key(model, asset_paths: List[str]) -> str:
+    """identifies a model, its system instruction and the content of its assets"""
+    key = hashlib.sha256()
+    key.update(model.model_name.encode())
+    key.update(str(model._system_instruction).encode())
+    for path in asset_paths:
+        key.update(_file_digest(path).encode())
+    return key.hexdigest()
+
+
+class ContextCache:
+    """
+    Registers the static prefix of a chat, the model's system instruction
+    and the brand assets it starts with, as a Gemini context cache. Later
+    jobs with the same assets start from the cache handle instead of
+    uploading and sending the assets again. Handles are kept in sqlite so
+    every worker shares them. When a cache can't be created (the model
+    doesn't support caching, or the prefix is below its minimum size), the
+    chat starts from the uploaded assets and no cache is tried again for
+    that prefix until CONTEXT_CACHE_TTL has passed.
+    """
+    def __init__(self, enabled: bool = CONTEXT_CACHE, ttl: int = CONTEXT_CACHE_TTL, refresh: int = CONTEXT_CACHE_REFRESH):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.refresh = refresh
+
+    def prefix(self, model, asset_paths: List[str], upload: Callable[[List[str]], List]) -> CachedPrefix:
+        """
+        The model and history to start a chat whose first user turns are the
+        assets, one per turn. upload turns the paths into Gemini files and
+        is only called when the assets are not cached.
+        """
+        if not self.enabled:
+            return CachedPrefix(model, self._history(upload(asset_paths)), False)
+        key = prefix_key(model, asset_paths)
+        entry = get_context_cache(key)
+        if entry is not None and entry["name"] is not None:
+            cached_model = self._use(key, entry["name"], model)
+            if cached_model is not None:
+                publish("context_cache", status="hit")
+                return CachedPrefix(cached_model, [], True)
+        history = self._history(upload(asset_paths))
+        if entry is not None and entry["name"] is None and entry["expires_at"] > time.time():
+            publish("context_cache", status="unavailable")
+            return CachedPrefix(model, history, False)
+        try:
+            with timed("gemini_cache_create", model=model.model_name):
+                cached = caching.CachedContent.create(
+                    model=model.model_name,
+                    system_instruction=model._system_instruction,
+                    contents=history,
+                    ttl=datetime.timedelta(seconds=self.ttl),
+                )
+        except Exception as e:
+            print(f"Context caching is not available for {model.model_name}: {e}")
+            set_context_cache(key, None, time.time() + self.ttl)
+            publish("context_cache", status="unavailable")
+            return CachedPrefix(model, history, False)
+        set_context_cache(key, cached.name, cached.expire_time.timestamp())
+        publish("context_cache", status="created")
+        return CachedPrefix(self._from_cache(cached, model), [], True)
+
+    def _use(self, key: str, name: str, model):
+        """a model on an existing cache, extended if it expires soon, or None if it is gone"""
+        try:
+            cached = caching.CachedContent.get(name=name)
+            if cached.expire_time.timestamp() - time.time() < self.refresh:
+                cached.update(ttl=datetime.timedelta(seconds=self.ttl))
+                set_context_cache(key, cached.name, cached.expire_time.timestamp())
+        except Exception as e:
+            print(f"Context cache {name} can't be used, creating it again: {e}")
+            return None
+        return self._from_cache(cached, model)
+
+    @staticmethod
+    def _from_cache(cached, model):
+        return genai.GenerativeModel.from_cached_content(
+            cached, generation_config=model._generation_config, safety_settings=model._safety_settings)
+
+    @staticmethod
+    def _history(files: List) -> List:
+        return [{"role": "user", "parts": [file]} for file in files]
+
+
+context_cache = ContextCache()
@@ -1,28 +1,89 @@
 import json
+import os
 import sqlite3
+import time
 import uuid
 
 from fastapi import HTTPException
 from ..models.schemas import VideoResponse
-from typing import Optional
+from .metrics import timed
+from typing import Dict, Optional
+
+# the API and the workers of a queue deployment must share this file
+DB_PATH = os.environ.get("VIDEO_DB_PATH", "video_responses.db")
 
 def generate_unique_id()->str:
     return str(uuid.uuid4())
 
 def init_db():
-    conn = sqlite3.connect('video_responses.db')
+    conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     c.execute('''
         CREATE TABLE IF NOT EXISTS video_responses
         (id TEXT PRIMARY KEY,
          response_data TEXT)
     ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS fal_requests
+        (job_id TEXT,
+         step TEXT,
+         application TEXT,
+         request_id TEXT,
+         status TEXT,
+         result_data TEXT,
+         updated_at REAL,
+         PRIMARY KEY (job_id, step))
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS jobs
+        (job_id TEXT PRIMARY KEY,
+         fingerprint TEXT,
+         status TEXT,
+         updated_at REAL)
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS job_checkpoints
+        (job_id TEXT,
+         stage TEXT,
+         checkpoint_data TEXT,
+         updated_at REAL,
+         PRIMARY KEY (job_id, stage))
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS job_queue
+        (job_id TEXT PRIMARY KEY,
+         fingerprint TEXT,
+         request_data TEXT,
+         owner TEXT,
+         status TEXT,
+         worker_id TEXT,
+         lease_expires REAL,
+         attempts INTEGER,
+         identifier TEXT,
+         error TEXT,
+         enqueued_at REAL,
+         updated_at REAL)
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS request_cache
+        (fingerprint TEXT PRIMARY KEY,
+         response_id TEXT,
+         created_at REAL)
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS context_caches
+        (prefix_key TEXT PRIMARY KEY,
+         name TEXT,
+         expires_at REAL,
+         updated_at REAL)
+    ''')
     conn.commit()
     conn.close()
 
+@timed("sqlite_write", table="video_responses")
 def set_response_data(video_response:VideoResponse)->VideoResponse:
     response_id = generate_unique_id()
-    conn = sqlite3.connect('video_responses.db')
+    conn = sqlite3.connect(DB_PATH)
     video_response.identifier = response_id
     c = conn.cursor()
     response_json = video_response.model_dump_json()
@@ -34,7 +95,7 @@ def set_response_data(video_response:VideoResponse)->VideoResponse:
     return video_response
 
 def get_response_data(response_id:str)->Optional[VideoResponse]:
-    conn = sqlite3.connect('video_responses.db')
+    conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     c.execute('SELECT response_data FROM video_responses WHERE id = ?', (response_id,))
     result = c.fetchone()
@@ -43,4 +104,129 @@ def get_response_data(response_id:str)->Optional[VideoResponse]:
         raise HTTPException(status_code=404, detail="Video response not found")
     response_json = result[0]
     response = VideoResponse.model_validate(json.loads(response_json))
-    return response
\ No newline at end of file
+    return response
+
+@timed("sqlite_write", table="request_cache")
+def set_cached_response_id(fingerprint:str, response_id:str)->None:
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute('INSERT OR REPLACE INTO request_cache (fingerprint, response_id, created_at) VALUES (?, ?, ?)',
+              (fingerprint, response_id, time.time()))
+    conn.commit()
+    conn.close()
+
+def get_cached_response_id(fingerprint:str, max_age:float)->Optional[str]:
+    """
+    Identifier of the stored response for an identical request
+    made less than max_age seconds ago, if there is one.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute('SELECT response_id FROM request_cache WHERE fingerprint = ? AND created_at >= ?',
+              (fingerprint, time.time() - max_age))
+    result = c.fetchone()
+    conn.close()
+    return result[0] if result else None
+
+
+@timed("sqlite_write", table="context_caches")
+def set_context_cache(prefix_key:str, name:Optional[str], expires_at:float)->None:
+    """the Gemini cache of a chat prefix, or None if caching it failed and shouldn't be retried before expires_at"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute('INSERT OR REPLACE INTO context_caches (prefix_key, name, expires_at, updated_at) VALUES (?, ?, ?, ?)',
+              (prefix_key, name, expires_at, time.time()))
+    conn.commit()
+    conn.close()
+
+def get_context_cache(prefix_key:str)->Optional[Dict]:
+    """the cache name and expiry recorded for a chat prefix, if any"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute('SELECT name, expires_at FROM context_caches WHERE prefix_key = ?', (prefix_key,))
+    result = c.fetchone()
+    conn.close()
+    if result is None:
+        return None
+    return {"name": result[0], "expires_at": result[1]}
+@timed("sqlite_write", table="fal_requests")
+def set_fal_request(job_id:str, step:str, application:str, request_id:str, status:str, result:Optional[Dict]=None)->None:
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute('INSERT OR REPLACE INTO fal_requests (job_id, step, application, request_id, status, result_data, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+              (job_id, step, application, request_id, status, json.dumps(result) if result is not None else None, time.time()))
+    conn.commit()
+    conn.close()
+
+@timed("sqlite_write", table="fal_requests")
+def complete_fal_request(request_id:str, status:str, result:Optional[Dict]=None)->None:
+    """record the outcome of a fal request delivered by webhook"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute('UPDATE fal_requests SET status = ?, result_data = ?, updated_at = ? WHERE request_id = ?',
+              (status, json.dumps(result) if result is not None else None, time.time(), request_id))
+    conn.commit()
+    conn.close()
+
+def get_fal_request(job_id:str, step:str)->Optional[Dict]:
+    """
+    The fal queue request submitted for a step of a job, if any, as a dict
+    with application, request_id, status and result.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute('SELECT application, request_id, status, result_data FROM fal_requests WHERE job_id = ? AND step = ?',
+              (job_id, step))
+    result = c.fetchone()
+    conn.close()
+    if result is None:
+        return None
+    application, request_id, status, result_data = result
+    return {
+        "application": application,
+        "request_id": request_id,
+        "status": status,
+        "result": json.loads(result_data) if result_data else None,
+    }
+
+
+@timed("sqlite_write", table="jobs")
+def set_job_status(job_id:str, fingerprint:str, status:str)->None:
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute('INSERT OR REPLACE INTO jobs (job_id, fingerprint, status, updated_at) VALUES (?, ?, ?, ?)',
+              (job_id, fingerprint, status, time.time()))
+    conn.commit()
+    conn.close()
+
+def get_resumable_job_id(fingerprint:str)->Optional[str]:
+    """
+    The id of the latest job for a request fingerprint that did not
+    complete (it failed, or the server stopped while it was running).
+    """
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute("SELECT job_id FROM jobs WHERE fingerprint = ? AND status != 'completed' ORDER BY updated_at DESC LIMIT 1",
+              (fingerprint,))
+    result = c.fetchone()
+    conn.close()
+    return result[0] if result else None
+
+@timed("sqlite_write", table="job_checkpoints")
+def set_checkpoint(job_id:str, stage:str, data:Dict)->None:
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute('INSERT OR REPLACE INTO job_checkpoints (job_id, stage, checkpoint_data, updated_at) VALUES (?, ?, ?, ?)',
+              (job_id, stage, json.dumps(data), time.time()))
+    conn.commit()
+    conn.close()
+
+def get_checkpoints(job_id:str)->Dict[str, Dict]:
+    """every checkpointed stage of a job, keyed by stage name"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute('SELECT stage, checkpoint_data FROM job_checkpoints WHERE job_id = ? ORDER BY updated_at',
+              (job_id,))
+    result = c.fetchall()
+    conn.close()
+    return {stage: json.loads(data) for stage, data in result}
@@ -0,0 +1,60 @@
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Dict, NamedTuple, Optional
+
+from ..models.schemas import VideoRequest
+
+
+def request_fingerprint(request: VideoRequest) -> str:
+    """
+    Stable hash of a request, ignoring the email so the same video requested
+    for different addresses maps to the same job.
+    """
+    data = request.model_dump(mode="json", exclude={"email"})
+    # scoring criteria order doesn't change the job, the palette order does
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class InFlightJob(NamedTuple):
+    task: asyncio.Task
+    owner: Any # whoever the job was started for, e.g. the requester's email
+    job_id: Optional[str] # the id progress is published under
+
+
+class InFlightJobs:
+    """
+    Keeps track of the jobs currently running, keyed by request fingerprint,
+    so identical requests arriving while a job runs can wait on it instead
+    of starting another generation. The fingerprint is only used to find
+    the running job; every run has its own job id.
+    """
+    def __init__(self):
+        self._jobs: Dict[str, InFlightJob] = {}
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def get(self, fingerprint: str) -> Optional[InFlightJob]:
+        """the running job for a fingerprint, if any"""
+        return self._jobs.get(fingerprint)
+
+    def start(self, fingerprint: str, job: Awaitable, owner: Any = None, job_id: Optional[str] = None) -> asyncio.Task:
+        """
+        Run the job as its own task so it keeps going even if the client
+        that started it disconnects.
+        """
+        if fingerprint in self._jobs:
+            raise ValueError(f"Job {fingerprint} is already running")
+        task = asyncio.ensure_future(job)
+        self._jobs[fingerprint] = InFlightJob(task, owner, job_id)
+
+        def _done(finished: asyncio.Task) -> None:
+            self._jobs.pop(fingerprint, None)
+            # mark the exception as retrieved, the waiters re-raise it
+            if not finished.cancelled():
+                finished.exception()
+
+        task.add_done_callback(_done)
+        return task
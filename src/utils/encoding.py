@@ -0,0 +1,59 @@
+import os
+from typing import Dict, List, NamedTuple, Optional
+
+
+class EncodeProfile(NamedTuple):
+    """x264 and audio settings of one kind of encode."""
+    name: str
+    preset: str
+    crf: int
+    threads: Optional[int] = None # None lets ffmpeg pick one per core
+    tune: Optional[str] = None
+    audio_codec: str = "aac"
+    audio_bitrate: Optional[str] = None
+
+    def video_params(self) -> List[str]:
+        """ffmpeg output options for the quality settings moviepy has no argument for"""
+        params = ["-crf", str(self.crf)]
+        if self.tune:
+            params += ["-tune", self.tune]
+        return params
+
+    def write_options(self, *ffmpeg_params: str, audio: bool = True) -> Dict:
+        """keyword arguments for moviepy's write_videofile"""
+        options = {
+            "codec": "libx264",
+            "preset": self.preset,
+            "threads": self.threads,
+            "ffmpeg_params": [*self.video_params(), "-pix_fmt", "yuv420p", *ffmpeg_params],
+            "audio": audio,
+        }
+        if audio:
+            options["audio_codec"] = self.audio_codec
+            options["audio_bitrate"] = self.audio_bitrate
+        return options
+
+
+# profiles a request can ask for, balanced matches moviepy's defaults
+PROFILES: Dict[str, EncodeProfile] = {
+    profile.name: profile for profile in (
+        EncodeProfile("fast-preview", preset="veryfast", crf=28, tune="fastdecode", audio_bitrate="96k"),
+        EncodeProfile("balanced", preset="medium", crf=23, audio_bitrate="128k"),
+        EncodeProfile("archive", preset="slow", crf=18, tune="film", audio_bitrate="192k"),
+    )
+}
+
+# used for every file that is decoded and encoded again later (the
+# watermarked parts under the text overlay), where encode time matters more
+# than size and a second lossy generation should cost as little as possible
+INTERMEDIATE = EncodeProfile("intermediate", preset="ultrafast", crf=10, threads=os.cpu_count(), audio_bitrate="192k")
+
+# profile of the final encode when the request doesn't name one
+DEFAULT_ENCODE_PROFILE = os.environ.get("VIDEO_ENCODE_PROFILE", "balanced")
+if DEFAULT_ENCODE_PROFILE not in PROFILES:
+    raise ValueError(f"VIDEO_ENCODE_PROFILE must be one of {', '.join(PROFILES)}, not {DEFAULT_ENCODE_PROFILE}")
+
+
+def encode_profile(name: Optional[str] = None) -> EncodeProfile:
+    """The named profile, or the default one."""
+    return PROFILES[name or DEFAULT_ENCODE_PROFILE]
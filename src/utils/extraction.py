@@ -0,0 +1,171 @@
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, List, Optional, TypeVar
+
+from pydantic import BaseModel, TypeAdapter
+
+from .llm_cache import llm_cache
+from .metrics import REGISTRY, Histogram
+from .progress import current_job_id, publish
+
+T = TypeVar("T")
+
+# calls per extraction before the job fails
+EXTRACTION_ATTEMPTS = int(os.environ.get("EXTRACTION_ATTEMPTS", "3"))
+# base of the jittered backoff between attempts, in seconds
+EXTRACTION_BACKOFF = float(os.environ.get("EXTRACTION_BACKOFF", "1"))
+# send a second, hedged request when the first one is slower than the p95
+# of the step's recent calls
+EXTRACTION_HEDGING = os.environ.get("EXTRACTION_HEDGING", "0") == "1"
+# hedge threshold until a step has enough history for a p95
+EXTRACTION_HEDGE_AFTER = float(os.environ.get("EXTRACTION_HEDGE_AFTER", "15"))
+
+attempts_per_extraction = REGISTRY.register(Histogram(
+    "video_api_extraction_attempts",
+    "Calls an LLM extraction step needed until its output validated",
+    buckets=(1, 2, 3, 4, 5, 10),
+))
+
+# hedged requests and their losers run here, the losers can't be cancelled
+_hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="extraction-hedge")
+
+
+class ExtractionFailed(Exception):
+    def __init__(self, step: str, errors: List[str], output: Optional[str]):
+        super().__init__(f"{step} returned no valid output after {len(errors)} attempts: {errors[-1]}")
+        self.step = step
+        self.errors = errors
+        self.output = output # the last invalid output
+
+
+def json_schema(schema: Any) -> Callable[[str], Any]:
+    """
+    Parser for json output that has to match a pydantic model or TypedDict.
+    Returns plain dicts, with the values coerced to the schema's types.
+    """
+    adapter = TypeAdapter(schema)
+
+    def parse(text: str) -> Any:
+        value = adapter.validate_json(text)
+        return value.model_dump() if isinstance(value, BaseModel) else value
+
+    return parse
+
+
+class LatencyWindow:
+    """Recent latencies per step, to hedge at their p95."""
+    def __init__(self, size: int = 50, min_samples: int = 10):
+        self.size = size
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._samples: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=self.size))
+
+    def add(self, step: str, seconds: float) -> None:
+        with self._lock:
+            self._samples[step].append(seconds)
+
+    def p95(self, step: str) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples[step])
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+
+latencies = LatencyWindow()
+
+
+def _backoff(rng: random.Random, attempt: int, base: float) -> float:
+    # equal jitter: at least half of the exponential delay
+    delay = base * 2 ** attempt
+    return delay / 2 + rng.uniform(0, delay / 2)
+
+
+def extract(call: Callable[[], str], parse: Callable[[str], T], step: str, attempts: int = EXTRACTION_ATTEMPTS,
+            backoff: float = EXTRACTION_BACKOFF, hedge: bool = EXTRACTION_HEDGING, cache_key: Optional[str] = None) -> T:
+    """
+    Run a short structured-extraction LLM call until parse accepts its
+    output, and return what parse returned. parse raises on invalid output
+    (malformed json, missing fields, ...), which is retried up to
+    `attempts` calls with a jittered backoff. The jitter is seeded with the
+    job and step, so a replayed job waits the same way.
+
+    With `hedge`, a second request is sent when the first has taken longer
+    than the step's recent p95 latency, and the first valid answer wins.
+
+    With a `cache_key` (see llm_cache.cache_key), a valid output stored for
+    it on disk is returned without calling, and a new valid output is stored.
+    """
+    if cache_key is not None:
+        cached = llm_cache.get(cache_key, step)
+        if cached is not None:
+            try:
+                return parse(cached)
+            except Exception as e:
+                # stored under an older schema, call again
+                print(f"Ignoring the cached {step} output: {e}")
+    rng = random.Random(f"{current_job_id.get()}:{step}")
+    errors: List[str] = []
+    output: Optional[str] = None
+    for attempt in range(attempts):
+        if attempt:
+            time.sleep(_backoff(rng, attempt - 1, backoff))
+        try:
+            result, output = _hedged(call, parse, step) if hedge else _attempt(call, parse, step)
+        except Exception as e:
+            errors.append(str(e) if isinstance(e, _InvalidOutput) else f"{type(e).__name__}: {e}")
+            output = getattr(e, "output", output)
+            print(f"{step} extraction attempt {attempt + 1} failed: {errors[-1]}")
+            publish("extraction_retry", step=step, attempt=attempt + 1, error=errors[-1])
+            continue
+        attempts_per_extraction.observe(attempt + 1, step=step)
+        if cache_key is not None:
+            llm_cache.put(cache_key, output)
+        return result
+    attempts_per_extraction.observe(attempts, step=step)
+    raise ExtractionFailed(step, errors, output)
+
+
+class _InvalidOutput(Exception):
+    def __init__(self, error: Exception, output: str):
+        super().__init__(f"{type(error).__name__}: {error}")
+        self.output = output
+
+
+def _attempt(call: Callable[[], str], parse: Callable[[str], T], step: str):
+    started = time.perf_counter()
+    output = call()
+    latencies.add(step, time.perf_counter() - started)
+    try:
+        return parse(output), output
+    except Exception as e:
+        raise _InvalidOutput(e, output) from e
+
+
+def _hedged(call: Callable[[], str], parse: Callable[[str], T], step: str):
+    def submit() -> Future:
+        return _hedge_executor.submit(contextvars.copy_context().run, _attempt, call, parse, step)
+
+    threshold = latencies.p95(step) or EXTRACTION_HEDGE_AFTER
+    pending = {submit()}
+    done, pending = wait(pending, timeout=threshold)
+    if not done:
+        print(f"{step} is slower than {threshold:.1f}s, sending a hedged request")
+        publish("extraction_hedge", step=step, after=round(threshold, 3))
+        pending.add(submit())
+    error: Optional[Exception] = None
+    while pending or done:
+        for future in done:
+            try:
+                return future.result()
+            except Exception as e:
+                error = e
+        if not pending:
+            break
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+    raise error
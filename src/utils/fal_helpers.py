@@ -0,0 +1,208 @@
+import contextvars
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import fal_client
+
+from .db_helpers import get_fal_request, set_fal_request, complete_fal_request
+from .metrics import timed
+from .rate_limit import rate_limiter
+
+# "subscribe" blocks on fal_client.subscribe like before, "queue" submits to
+# the fal queue and waits for a webhook or the polling supervisor
+FAL_BACKEND = os.environ.get("FAL_BACKEND", "subscribe")
+# public url of the /fal/webhook endpoint, polling only when unset
+FAL_WEBHOOK_URL = os.environ.get("FAL_WEBHOOK_URL")
+# shared secret expected as ?token= on webhook deliveries, include it in
+# FAL_WEBHOOK_URL. Webhooks are not used (and the endpoint refuses every
+# call) without it, since a forged delivery could point a job at any file
+FAL_WEBHOOK_SECRET = os.environ.get("FAL_WEBHOOK_SECRET")
+if FAL_WEBHOOK_URL and not FAL_WEBHOOK_SECRET:
+    print("FAL_WEBHOOK_URL is ignored because FAL_WEBHOOK_SECRET is not set, falling back to polling")
+# how long a render may take before we give up waiting on it
+FAL_TIMEOUT = float(os.environ.get("FAL_TIMEOUT", "1800"))
+
+
+class FalRequestFailed(Exception):
+    pass
+
+
+class _PendingRequest:
+    def __init__(self, application: str, request_id: str, on_queue_update: Optional[Callable], poll_interval: float):
+        self.application = application
+        self.request_id = request_id
+        self.on_queue_update = on_queue_update
+        # run the callback in the context of the waiting job so its
+        # progress events are published under the right job id
+        self.context = contextvars.copy_context()
+        self.interval = poll_interval
+        self.next_poll = time.monotonic() + poll_interval
+        self.logs_seen = 0
+        self.done = threading.Event()
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+
+
+class FalQueueSupervisor:
+    """
+    Tracks every outstanding fal queue request of this process. A single
+    background thread polls them with exponential backoff, and webhook
+    deliveries complete them immediately, so waiting on many renders at
+    once costs one thread instead of one blocked subscribe per render.
+    """
+    def __init__(self, min_interval: float = 2.0, max_interval: float = 30.0):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._pending: Dict[str, _PendingRequest] = {}
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        with self._condition:
+            return len(self._pending)
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._poll_loop, name="fal-queue-supervisor", daemon=True)
+            self._thread.start()
+
+    def watch(self, application: str, request_id: str, on_queue_update: Optional[Callable] = None) -> _PendingRequest:
+        with self._condition:
+            pending = self._pending.get(request_id)
+            if pending is None:
+                pending = _PendingRequest(application, request_id, on_queue_update, self.min_interval)
+                self._pending[request_id] = pending
+            self._ensure_thread()
+            self._condition.notify()
+        return pending
+
+    def wait(self, application: str, request_id: str, on_queue_update: Optional[Callable] = None, timeout: float = FAL_TIMEOUT) -> Dict:
+        pending = self.watch(application, request_id, on_queue_update)
+        try:
+            if not pending.done.wait(timeout):
+                raise FalRequestFailed(f"Timed out waiting for fal request {request_id}")
+        finally:
+            # a request nobody waits on any more is not polled
+            with self._condition:
+                if self._pending.get(request_id) is pending:
+                    del self._pending[request_id]
+        if pending.error is not None:
+            raise FalRequestFailed(pending.error)
+        return pending.result
+
+    def complete(self, request_id: str, result: Optional[Dict] = None, error: Optional[str] = None) -> bool:
+        """Finish a request, returns False if nobody in this process waits on it."""
+        with self._condition:
+            pending = self._pending.pop(request_id, None)
+        if pending is None:
+            return False
+        pending.result = result
+        pending.error = error
+        pending.done.set()
+        return True
+
+    def _poll(self, pending: _PendingRequest) -> None:
+        try:
+            status = fal_client.status(pending.application, pending.request_id, with_logs=True)
+        except Exception as e:
+            print(f"Error polling fal request {pending.request_id}: {e}")
+            return
+        if isinstance(status, fal_client.InProgress) and pending.on_queue_update is not None:
+            logs = status.logs or []
+            new_logs = logs[pending.logs_seen:]
+            pending.logs_seen = len(logs)
+            if new_logs:
+                pending.context.run(pending.on_queue_update, fal_client.InProgress(logs=new_logs))
+        if isinstance(status, fal_client.Completed):
+            if status.error:
+                self.complete(pending.request_id, error=f"fal request {pending.request_id} failed: {status.error}")
+                return
+            try:
+                result = fal_client.result(pending.application, pending.request_id)
+            except Exception as e:
+                self.complete(pending.request_id, error=f"Error fetching fal result: {e}")
+                return
+            self.complete(pending.request_id, result=result)
+
+    def _poll_loop(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                now = time.monotonic()
+                due = [p for p in self._pending.values() if p.next_poll <= now]
+                if not due:
+                    next_poll = min(p.next_poll for p in self._pending.values())
+                    self._condition.wait(max(next_poll - now, 0))
+                    continue
+            for pending in due:
+                self._poll(pending)
+                # back off while the render is still going
+                pending.interval = min(pending.interval * 2, self.max_interval)
+                pending.next_poll = time.monotonic() + pending.interval
+
+
+fal_supervisor = FalQueueSupervisor()
+
+
+def fal_run(application: str, arguments: Dict, job_id: str, step: str, on_queue_update: Optional[Callable] = None) -> Dict:
+    """
+    Run a fal application and return its result.
+
+    With FAL_BACKEND=queue the request is submitted to the fal queue and its
+    id is stored per job and step. Resuming is keyed on the step alone: when
+    a retried or restarted job with the same job id reaches a step that was
+    already submitted, it waits on (or reuses) that render instead of paying
+    for a new one, even though Gemini may have written different prompts
+    this time.
+    """
+    with timed("fal_subscribe", application=application):
+        if FAL_BACKEND != "queue":
+            return rate_limiter.call(
+                "fal", application, fal_client.subscribe,
+                application,
+                arguments=arguments,
+                with_logs=True,
+                on_queue_update=on_queue_update,
+            )
+
+        record = get_fal_request(job_id, step)
+        # failed requests are submitted again
+        if record is not None and record["application"] == application and record["status"] != "FAILED":
+            if record["status"] == "COMPLETED" and record["result"] is not None:
+                print(f"Reusing completed fal request {record['request_id']} for {step}")
+                return record["result"]
+            request_id = record["request_id"]
+            print(f"Resuming fal request {request_id} for {step}")
+        else:
+            webhook_url = FAL_WEBHOOK_URL if FAL_WEBHOOK_SECRET else None
+            handle = rate_limiter.call("fal", application, fal_client.submit, application, arguments, webhook_url=webhook_url)
+            request_id = handle.request_id
+            set_fal_request(job_id, step, application, request_id, "SUBMITTED")
+            print(f"Submitted fal request {request_id} for {step}")
+
+        try:
+            result = fal_supervisor.wait(application, request_id, on_queue_update)
+        except FalRequestFailed:
+            set_fal_request(job_id, step, application, request_id, "FAILED")
+            raise
+        set_fal_request(job_id, step, application, request_id, "COMPLETED", result)
+        return result
+
+
+def handle_fal_webhook(payload: Dict) -> bool:
+    """
+    Record a webhook delivery from the fal queue and wake up the job waiting
+    on it. The result is stored even if no job in this process is waiting,
+    so a job resumed after a restart finds it.
+    """
+    request_id = payload["request_id"]
+    if payload.get("status") == "OK":
+        result = payload.get("payload")
+        complete_fal_request(request_id, "COMPLETED", result)
+        return fal_supervisor.complete(request_id, result=result)
+    error = payload.get("error") or payload.get("payload_error") or "unknown error"
+    complete_fal_request(request_id, "FAILED")
+    return fal_supervisor.complete(request_id, error=f"fal request {request_id} failed: {error}")
@@ -0,0 +1,230 @@
+import os
+import struct
+import threading
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+# boxes that contain other boxes, as far as we need to walk into them
+_CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"mvex", b"moof", b"traf"}
+
+# ffmpeg options that make the mp4 muxer write a fragmented file: an empty
+# moov up front and one moof/mdat pair per keyframe
+FRAGMENTED_MP4_FLAGS = ["-movflags", "+frag_keyframe+empty_moov+default_base_moof"]
+
+
+def iter_boxes(data: bytes, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[bytes, int, int, int]]:
+    """Yield (type, start, end, header size) of the boxes between start and end."""
+    end = len(data) if end is None else end
+    position = start
+    while position + 8 <= end:
+        size, box_type = struct.unpack(">I4s", data[position:position + 8])
+        header = 8
+        if size == 1:
+            size = struct.unpack(">Q", data[position + 8:position + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - position
+        if size < header or position + size > end:
+            raise ValueError(f"Truncated {box_type!r} box at {position}")
+        yield box_type, position, position + size, header
+        position += size
+
+
+def find_box(data: bytes, path: Tuple[bytes, ...], start: int = 0, end: Optional[int] = None) -> Optional[Tuple[int, int, int]]:
+    """(start, end, header size) of the first box at a path like (b"moov", b"trak"), or None."""
+    for box_type, box_start, box_end, header in iter_boxes(data, start, end):
+        if box_type != path[0]:
+            continue
+        if len(path) == 1:
+            return box_start, box_end, header
+        if box_type in _CONTAINERS:
+            found = find_box(data, path[1:], box_start + header, box_end)
+            if found is not None:
+                return found
+    return None
+
+
+def _box(data: bytes, path: Tuple[bytes, ...], start: int = 0, end: Optional[int] = None) -> Tuple[int, int, int]:
+    found = find_box(data, path, start, end)
+    if found is None:
+        raise ValueError(f"No {b'/'.join(path).decode()} box")
+    return found
+
+
+def _timescale(data: bytes) -> int:
+    start, _, header = _box(data, (b"moov", b"trak", b"mdia", b"mdhd"))
+    version = data[start + header]
+    offset = start + header + (20 if version == 1 else 12)
+    return struct.unpack(">I", data[offset:offset + 4])[0]
+
+
+def _default_sample_duration(data: bytes) -> int:
+    found = find_box(data, (b"moov", b"mvex", b"trex"))
+    if found is None:
+        return 0
+    start, _, header = found
+    # version/flags, track_ID, default_sample_description_index
+    return struct.unpack(">I", data[start + header + 12:start + header + 16])[0]
+
+
+def _fragment_duration(data: bytearray, moof_start: int, moof_end: int, default_duration: int) -> int:
+    """Sum of the sample durations of the (single track) fragment."""
+    traf_start, traf_end, traf_header = _box(data, (b"traf",), moof_start + 8, moof_end)
+    tfhd_start, _, tfhd_header = _box(data, (b"tfhd",), traf_start + traf_header, traf_end)
+    flags = struct.unpack(">I", data[tfhd_start + tfhd_header:tfhd_start + tfhd_header + 4])[0] & 0xFFFFFF
+    position = tfhd_start + tfhd_header + 8 # version/flags and track_ID
+    if flags & 0x01:
+        position += 8 # base_data_offset
+    if flags & 0x02:
+        position += 4 # sample_description_index
+    if flags & 0x08:
+        default_duration = struct.unpack(">I", data[position:position + 4])[0]
+
+    total = 0
+    for box_type, start, _, header in iter_boxes(data, traf_start + traf_header, traf_end):
+        if box_type != b"trun":
+            continue
+        flags = struct.unpack(">I", data[start + header:start + header + 4])[0] & 0xFFFFFF
+        count = struct.unpack(">I", data[start + header + 4:start + header + 8])[0]
+        position = start + header + 8
+        if flags & 0x001:
+            position += 4 # data_offset
+        if flags & 0x004:
+            position += 4 # first_sample_flags
+        if not flags & 0x100:
+            total += count * default_duration
+            continue
+        # per sample fields in order: duration, size, flags, composition offset
+        stride = 4 * sum(1 for bit in (0x100, 0x200, 0x400, 0x800) if flags & bit)
+        for i in range(count):
+            total += struct.unpack(">I", data[position + i * stride:position + i * stride + 4])[0]
+    return total
+
+
+def _decode_time_field(data: bytes, moof_start: int, moof_end: int) -> Tuple[int, str]:
+    """offset and struct format of the base decode time of a fragment"""
+    tfdt_start, _, tfdt_header = _box(data, (b"traf", b"tfdt"), moof_start + 8, moof_end)
+    version = data[tfdt_start + tfdt_header]
+    return tfdt_start + tfdt_header + 4, ">Q" if version == 1 else ">I"
+
+
+class Fragment(NamedTuple):
+    """a moof and its mdat; with FRAGMENTED_MP4_FLAGS each starts at a keyframe"""
+    decode_time: int # in the track timescale
+    duration: int
+    start: int # file offset of the moof
+    end: int # file offset after the mdat
+
+
+def fragments(data: bytes) -> Tuple[int, List[Fragment]]:
+    """timescale and fragments of a fragmented mp4"""
+    timescale = _timescale(data)
+    default_duration = _default_sample_duration(data)
+    found = []
+    moof = None
+    for box_type, start, end, _ in iter_boxes(data):
+        if box_type == b"moof":
+            moof = (start, end)
+        elif box_type == b"mdat" and moof is not None:
+            offset, fmt = _decode_time_field(data, *moof)
+            found.append(Fragment(struct.unpack_from(fmt, data, offset)[0],
+                                  _fragment_duration(data, moof[0], moof[1], default_duration), moof[0], end))
+            moof = None
+    if not found:
+        raise ValueError("Not a fragmented mp4")
+    return timescale, found
+
+
+def write_fragments(data: bytes, selected: List[Fragment], output_path: str) -> str:
+    """
+    Write some consecutive fragments of a fragmented mp4 as a part of its
+    own, with its header and the decode times starting at zero, so it can
+    be appended with FragmentedMp4Appender like an encoded part.
+    """
+    with open(output_path, "wb") as f:
+        for box_type, start, end, _ in iter_boxes(data):
+            if box_type in (b"ftyp", b"moov"):
+                f.write(data[start:end])
+        for fragment in selected:
+            chunk = bytearray(data[fragment.start:fragment.end])
+            moof_end = struct.unpack_from(">I", chunk)[0]
+            offset, fmt = _decode_time_field(chunk, 0, moof_end)
+            struct.pack_into(fmt, chunk, offset, fragment.decode_time - selected[0].decode_time)
+            f.write(chunk)
+    return output_path
+
+
+class FragmentedMp4Appender:
+    """
+    Builds one fragmented mp4 out of parts that were each encoded with
+    FRAGMENTED_MP4_FLAGS and the same encoder settings. The first part
+    provides the header; every later part only adds its fragments, with
+    their decode times shifted to follow the previous part and their
+    sequence numbers continued, so appending costs a copy of that part.
+
+    The output is a valid, playable video after every append.
+    """
+    def __init__(self, output_path: str):
+        self.output_path = output_path
+        self._lock = threading.Lock()
+        self._sample_description: Optional[bytes] = None
+        self._default_duration = 0
+        self.timescale = 0
+        self.decode_time = 0
+        self.sequence = 0
+        self.parts = 0
+
+    @property
+    def duration(self) -> float:
+        """seconds of video appended so far"""
+        return self.decode_time / self.timescale if self.timescale else 0.0
+
+    def append(self, part_path: str) -> None:
+        with open(part_path, "rb") as f:
+            data = bytearray(f.read())
+        with self._lock:
+            stsd = _box(data, (b"moov", b"trak", b"mdia", b"minf", b"stbl", b"stsd"))
+            sample_description = bytes(data[stsd[0]:stsd[1]])
+            chunks = []
+            if self._sample_description is None:
+                self._sample_description = sample_description
+                self.timescale = _timescale(data)
+                self._default_duration = _default_sample_duration(data)
+                for box_type, start, end, _ in iter_boxes(data):
+                    if box_type in (b"ftyp", b"moov"):
+                        chunks.append(data[start:end])
+            elif sample_description != self._sample_description:
+                raise ValueError(f"{part_path} was encoded with different settings than the first part")
+
+            part_end = 0
+            for box_type, start, end, header in iter_boxes(data):
+                if box_type == b"moof":
+                    part_end = max(part_end, self._patch_fragment(data, start, end))
+                    chunks.append(data[start:end])
+                elif box_type == b"mdat":
+                    chunks.append(data[start:end])
+                # mfra indexes the part on its own, it would hide the fragments
+                # appended after it
+
+            mode = "wb" if self.parts == 0 else "ab"
+            os.makedirs(os.path.dirname(self.output_path) or ".", exist_ok=True)
+            with open(self.output_path, mode) as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            self.parts += 1
+            # the next part starts where the fragments of this one end
+            self.decode_time += part_end
+
+    def _patch_fragment(self, data: bytearray, moof_start: int, moof_end: int) -> int:
+        """
+        Continue the sequence number and shift the decode time of a
+        fragment, returns where it ends in the part's own time.
+        """
+        self.sequence += 1
+        mfhd_start, _, mfhd_header = _box(data, (b"mfhd",), moof_start + 8, moof_end)
+        struct.pack_into(">I", data, mfhd_start + mfhd_header + 4, self.sequence)
+
+        duration = _fragment_duration(data, moof_start, moof_end, self._default_duration)
+        offset, fmt = _decode_time_field(data, moof_start, moof_end)
+        part_time = struct.unpack_from(fmt, data, offset)[0]
+        struct.pack_into(fmt, data, offset, self.decode_time + part_time)
+        return part_time + duration
@@ -1,19 +1,28 @@
 import typing
+import typing_extensions
 from typing import List, Tuple, Dict
 import uuid
 import requests
 import os
+import subprocess
 import cv2
 import cloudinary 
 import cloudinary.uploader
 import cloudinary.api
 import colorsys
 import numpy as np
-from ..models.schemas import Metadata, Resolution
+from ..models.schemas import Metadata
+from .encoding import INTERMEDIATE, EncodeProfile, encode_profile
+from .fmp4 import FRAGMENTED_MP4_FLAGS
+from .metrics import timed
+from .probe import probe
+from .progress import publish
+from contextlib import contextmanager
 from io import BytesIO
 from PIL import Image
-from moviepy import VideoFileClip, concatenate_videoclips, ImageClip, CompositeVideoClip,TextClip, VideoFileClip
+from moviepy import VideoFileClip, ImageClip, CompositeVideoClip,TextClip
 import moviepy.video.fx as vfx
+from moviepy.config import FFMPEG_BINARY
 cloud_name = os.getenv('CLOUD_NAME')
 api_key = os.getenv('API_KEY')
 api_secret = os.getenv('API_SECRET')
@@ -24,17 +33,17 @@ cloudinary.config(
     api_secret=api_secret
 )
 
+@timed("download_file")
 def download_file(url:str, filename:str) -> str:
     """
     Downloads a file from the given url and saves it with 
     the given filename in the tmp folder in the project 
-    root directory.
+    root directory. The filename may include a sub directory.
     """
     tmp_dir = os.path.abspath("tmp")
-    if not os.path.exists(tmp_dir):
-        os.makedirs(tmp_dir)
-    
     filename = os.path.join(tmp_dir, filename)
+    # the filename can contain a job sub directory
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
     with requests.get(url, stream=True) as r:
         r.raise_for_status()
         with open(filename, "wb") as f:
@@ -42,113 +51,169 @@ def download_file(url:str, filename:str) -> str:
                 f.write(chunk)
     return filename
 
-def get_video_metadata(video_path: str) -> Metadata:
-    """
-    Get video metadata using OpenCV
-    """
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        raise ValueError("Could not open video file")
+# media readers ----------------------------------------------------------
+# every file opened for reading goes through these, so its ffmpeg process or
+# OpenCV handle is released as soon as the block ends, also on errors. A
+# long running worker would otherwise keep one open per request.
 
-    # Get basic video metadata
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    duration = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) / cap.get(cv2.CAP_PROP_FPS))
-    file_size = os.path.getsize(video_path) / (1024 * 1024)  # convert to MBs
+@contextmanager
+def open_video(video_path:str, **kwargs) -> typing.Iterator[VideoFileClip]:
+    """Open a video with moviepy and close its readers when the block ends."""
+    clip = VideoFileClip(video_path, **kwargs)
+    try:
+        yield clip
+    finally:
+        clip.close()
 
-    cap.release()
+@contextmanager
+def open_capture(video_path:str) -> typing.Iterator[cv2.VideoCapture]:
+    """Open a video with OpenCV and release it when the block ends."""
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            raise ValueError("Could not open video file")
+        yield cap
+    finally:
+        cap.release()
 
-    return Metadata(
-        file_size_mb=round(file_size, 2),
-        duration_seconds=duration,
-        resolution=Resolution(width=width, height=height)
-    )
+def video_size(video_path:str) -> Tuple[int, int]:
+    """width and height of a video, without decoding any frame"""
+    with open_capture(video_path) as cap:
+        return int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+@timed("video_metadata")
+def get_video_metadata(video_path: str) -> Metadata:
+    """
+    Get video metadata from the container header, without a decoder
+    """
+    return probe(video_path)
 
 
-def upload_image(image: Image) -> str:
+def upload_image(image: typing.Union[Image.Image, str]) -> str:
+    """upload an image, or an image file as it is, and return its url"""
     try:
-        img_byte_arr = BytesIO()
-        image.save(img_byte_arr, format='PNG') 
-        img_byte_arr.seek(0) 
-        url = cloudinary.uploader.upload(img_byte_arr)
+        if isinstance(image, str):
+            upload = image
+        else:
+            upload = BytesIO()
+            image.save(upload, format='PNG') 
+            upload.seek(0) 
+        with timed("cloudinary_upload", resource="image"):
+            url = cloudinary.uploader.upload(upload)
         return url['secure_url']
     except Exception as e:
         return f"Error uploading the image: {e}"
     
+@timed("last_frame")
 def get_last_frame(video_path: str) -> Image:
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        raise ValueError("Could not open video file")
-
-    cap.set(cv2.CAP_PROP_POS_FRAMES, cap.get(cv2.CAP_PROP_FRAME_COUNT) - 1)
-    ret, frame = cap.read()
+    with open_capture(video_path) as cap:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, cap.get(cv2.CAP_PROP_FRAME_COUNT) - 1)
+        ret, frame = cap.read()
     if not ret:
         raise ValueError("Could not read the video frame")
 
-    cap.release()
-
     return Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
 
-def merge_videos(video_paths:List, output_path:str)->None:
-    try:
-        video_clips = [VideoFileClip(path) for path in video_paths]
-        final_clip = concatenate_videoclips(video_clips)
-        final_clip.write_videofile(output_path)
-        
-        for clip in video_clips:
-            clip.close()
-    except Exception as e:
-        print(f"Error merging videos: {e}")
-
 def upload_and_crop_video(video_path:str, crop_width:int, crop_height:int) -> str:
     try:
+        publish("upload", target="cloudinary", file=os.path.basename(video_path), status="started")
         # Upload with cropping transformation
-        result = cloudinary.uploader.upload(video_path,
-            resource_type = "video",
-            transformation=[
-                {
-                    'width': crop_width, 
-                    'height': crop_height,
-                    'crop': 'fill'  # or 'fill', 'pad', 'scale', etc.
-                }
-            ]
-        )
+        with timed("cloudinary_upload", resource="video"):
+            result = cloudinary.uploader.upload(video_path,
+                resource_type = "video",
+                transformation=[
+                    {
+                        'width': crop_width, 
+                        'height': crop_height,
+                        'crop': 'fill'  # or 'fill', 'pad', 'scale', etc.
+                    }
+                ]
+            )
+        publish("upload", target="cloudinary", file=os.path.basename(video_path), status="finished")
         return result['secure_url']
     except Exception as e:
         print(f"Error: {str(e)}")
         return None
     
-def add_watermark(video_path:str, logo_path:str, output_path:str) -> None:
-    video = VideoFileClip(video_path)
-    
-    logo = ImageClip(logo_path, transparent=True)
-    
-    logo_width = video.w // 8  # w is video width
-    logo = logo.resized(width=logo_width)  # maintains aspect ratio
-    logo = logo.with_opacity(0.7)
-    padding = 20
-    x = video.w - logo.w - padding
-    y = video.h - logo.h - padding
-    
-    logo = logo.with_position((x, y))
-    logo = logo.with_duration(video.duration)
-    
-    final_video = CompositeVideoClip([video, logo])
-    
-    final_video.write_videofile(
-        output_path,
-        codec='libx264',
-        audio_codec='aac'
+# distance of the watermark from the bottom right corner
+WATERMARK_PADDING = 20
+
+def watermark_size(logo_size:Tuple[int, int], video_width:int) -> Tuple[int, int]:
+    """size of the watermark of a logo: an eighth of the video width, keeping the logo's aspect ratio"""
+    logo_width = video_width // 8
+    return logo_width, max(1, round(logo_size[1] * logo_width / logo_size[0]))
+
+def watermark_box(frame_size:Tuple[int, int], logo_size:typing.Optional[Tuple[int, int]]=None) -> Tuple[int, int, int, int]:
+    """(x0, y0, x1, y1) of the watermark in a frame, a square logo when its size isn't known"""
+    width, height = frame_size
+    logo_width, logo_height = watermark_size(logo_size or (1, 1), width)
+    return (width - logo_width - WATERMARK_PADDING, height - logo_height - WATERMARK_PADDING,
+            width - WATERMARK_PADDING, height - WATERMARK_PADDING)
+
+def prepare_watermark(logo_path:str, video_width:int, output_path:str) -> str:
+    """
+    Render the watermark sprite once: the logo resized to an eighth of the
+    video width at 70% opacity, saved as an RGBA png.
+    """
+    logo = Image.open(logo_path).convert("RGBA")
+    logo = logo.resize(watermark_size(logo.size, video_width), Image.LANCZOS)
+    alpha = logo.getchannel("A").point(lambda a: int(a * 0.7))
+    logo.putalpha(alpha)
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    logo.save(output_path)
+    return output_path
+
+def _watermark_clip(video:VideoFileClip, sprite_path:str) -> CompositeVideoClip:
+    logo = ImageClip(sprite_path, transparent=True)
+    x = video.w - logo.w - WATERMARK_PADDING
+    y = video.h - logo.h - WATERMARK_PADDING
+    logo = logo.with_position((x, y)).with_duration(video.duration)
+    return CompositeVideoClip([video, logo])
+
+def add_watermark(video_path:str, logo_path:str, output_path:str, profile:typing.Optional[EncodeProfile]=None) -> None:
+    profile = profile or encode_profile()
+    with open_video(video_path) as video:
+        sprite_path = prepare_watermark(logo_path, video.w, os.path.splitext(output_path)[0] + "_logo.png")
+        with _watermark_clip(video, sprite_path) as final_video:
+            with timed("moviepy_encode", step="watermark", profile=profile.name):
+                final_video.write_videofile(output_path, **profile.write_options())
+
+def encode_segment_part(segment_path:str, sprite_path:str, size:Tuple[int, int], output_path:str,
+                        profile:typing.Optional[EncodeProfile]=None, ffmpeg_params:typing.Sequence[str]=()) -> str:
+    """
+    Watermark one segment and encode it as a fragmented mp4 part with the
+    given frame size and profile (the intermediate one by default), so the
+    parts of a video can be appended to each other without re-encoding.
+    Kling segments have no audio, so neither do the parts.
+    """
+    profile = profile or INTERMEDIATE
+    with open_video(segment_path, audio=False) as video:
+        frames = video if tuple(video.size) == tuple(size) else video.resized(size)
+        with _watermark_clip(frames, sprite_path) as part:
+            with timed("moviepy_encode", step="segment_part", profile=profile.name):
+                part.write_videofile(output_path, **profile.write_options(*FRAGMENTED_MP4_FLAGS, *ffmpeg_params, audio=False))
+    return output_path
+
+@timed("ffmpeg_remux", step="concat")
+def concat_parts(part_paths:List[str], output_path:str) -> str:
+    """Join parts written by encode_segment_part into one mp4 by copying the streams, no re-encode."""
+    list_path = os.path.splitext(output_path)[0] + "_parts.txt"
+    with open(list_path, "w") as f:
+        for path in part_paths:
+            f.write(f"file '{os.path.abspath(path)}'\n")
+    subprocess.run(
+        [FFMPEG_BINARY, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_path,
+         "-c", "copy", "-movflags", "+faststart", output_path],
+        check=True, capture_output=True,
     )
-    
-    video.close()
-    final_video.close()
+    os.remove(list_path)
+    return output_path
 
 def create_dynamic_scoring_td(criteria_names: list[str]):
     justification_fields = {
         criterion: str for criterion in criteria_names
     }
-    DynamicJustifications = typing.TypedDict('Justifications', justification_fields)
+    DynamicJustifications = typing_extensions.TypedDict('Justifications', justification_fields)
     
     # Create Scoring TypedDict
     scoring_fields = {
@@ -159,7 +224,7 @@ def create_dynamic_scoring_td(criteria_names: list[str]):
         'justifications': DynamicJustifications
     })
     
-    DynamicScoringDict = typing.TypedDict('ScoringTypedDict', scoring_fields)
+    DynamicScoringDict = typing_extensions.TypedDict('ScoringTypedDict', scoring_fields)
     
     return DynamicScoringDict
 
@@ -170,30 +235,31 @@ def get_stroke_color(rgb:Tuple)->Tuple:
     new_r, new_g, new_b = colorsys.hls_to_rgb(h, new_l, s)
     return tuple(round(x * 255) for x in (new_r, new_g, new_b))
 
+# pixel sizes and font files of the text overlays
+FONT_SIZES = {
+    "small": 30,
+    "medium": 60,
+    "large": 100
+}
+FONTS = {
+    "normal": "resources/inter.ttf",
+    "bold": "resources/bebas.ttf",
+    "stylish": "resources/playfair.ttf"
+}
+
 def fade_in_text(video_path:str, duration:Dict, content:str, size:str, position:Dict, color:str, font:str,aspect_ratio:str) -> None:
-    font_sizes = {
-        "small": 30,
-        "medium": 60,
-        "large": 100
-    }
     #get rgb in tuple
     colors = color.split("(")[1].split(")")[0].split(",")
     color = tuple(map(int, colors))
     total_duration = duration["end"] - duration["start"]
-    orignalClip = VideoFileClip(video_path)
-    width, height = orignalClip.size
+    width, height = video_size(video_path)
 
     size = size.strip().lower()
     font = font.strip().lower()
-    fonts_dict = {
-        "normal": "resources/inter.ttf",
-        "bold": "resources/bebas.ttf",
-        "stylish": "resources/playfair.ttf"
-    }
     if aspect_ratio == "landscape":
-        txt_clip = TextClip(fonts_dict[font],content, margin=(10,10),font_size=font_sizes[size], color=color, method="label",stroke_color=get_stroke_color(color),stroke_width=2).with_duration(total_duration).with_start(duration["start"])
+        txt_clip = TextClip(FONTS[font],content, margin=(10,10),font_size=FONT_SIZES[size], color=color, method="label",stroke_color=get_stroke_color(color),stroke_width=2).with_duration(total_duration).with_start(duration["start"])
     else:
-        txt_clip = TextClip(fonts_dict[font],content, margin=(10,10),font_size=font_sizes[size], color=color, method="caption",stroke_color=get_stroke_color(color),stroke_width=2).with_duration(total_duration).with_start(duration["start"], size=(width - 10, None))
+        txt_clip = TextClip(FONTS[font],content, margin=(10,10),font_size=FONT_SIZES[size], color=color, method="caption",stroke_color=get_stroke_color(color),stroke_width=2).with_duration(total_duration).with_start(duration["start"], size=(width - 10, None))
     textclip_width, textclip_height = txt_clip.size
 
     # calculate the position
@@ -203,16 +269,19 @@ def fade_in_text(video_path:str, duration:Dict, content:str, size:str, position:
     txt_clip = txt_clip.with_position((x, y)).with_effects([vfx.CrossFadeIn(fade_duration), vfx.CrossFadeOut(fade_duration)])
     return txt_clip
 
-def embed_text_clips(video_path:str, text_clips:List[TextClip], output_path:str) -> None:
+def embed_text_clips(video_path:str, text_clips:List[TextClip], output_path:str, profile:typing.Optional[EncodeProfile]=None) -> None:
+    profile = profile or encode_profile()
     try:
-        composite = CompositeVideoClip([VideoFileClip(video_path), *text_clips] )
-        composite.write_videofile(output_path, codec='libx264', audio_codec='aac')
-        composite.close()
+        # the composite doesn't close the clips it is made of
+        with open_video(video_path) as video, CompositeVideoClip([video, *text_clips]) as composite:
+            with timed("moviepy_encode", step="text_overlay", profile=profile.name):
+                composite.write_videofile(output_path, **profile.write_options())
     except Exception as e:
         print(f"Error embedding text clips: {e}")
         raise e
     
 
+@timed("mailgun_send")
 def send_email(sender_name:str, reciever:str, subject:str, message:str)->requests.Response:
     MAILGUN_API_KEY = os.getenv('MAILGUN_API_KEY')
     MAIL_DOMAIN = os.getenv('MAIL_DOMAIN')
@@ -226,6 +295,9 @@ def send_email(sender_name:str, reciever:str, subject:str, message:str)->request
 
 def convert_xml_string_to_float(data:Dict)->Dict:
     texts = data['texts']['text']
+    # xmltodict only makes a list out of repeated elements
+    if isinstance(texts, dict):
+        texts = data['texts']['text'] = [texts]
     
     for text in texts:
         text['position']['x'] = float(text['position']['x'])
@@ -0,0 +1,167 @@
+import os
+import sqlite3
+import time
+from typing import Dict, NamedTuple, Optional, Type
+
+from . import db_helpers
+from .metrics import timed
+
+# "sqlite" hands jobs to worker processes (python -m src.worker) through the
+# shared database, unset runs them inside the API process like before
+JOB_QUEUE = os.environ.get("JOB_QUEUE")
+# a claimed job goes back to the queue if its worker stops heartbeating for
+# this many seconds, e.g. because the worker or its node died
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "120"))
+# attempts before a job whose workers keep dying is marked failed
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+
+
+class QueuedJob(NamedTuple):
+    job_id: str
+    fingerprint: str
+    request_data: str # the VideoRequest as json
+    owner: Optional[str] # email of the requester who started the job
+    status: str # queued, running, completed or failed
+    worker_id: Optional[str]
+    attempts: int
+    identifier: Optional[str] # of the stored response, once completed
+    error: Optional[str]
+
+
+class JobQueue:
+    """
+    Durable queue shared by the API, which enqueues jobs, and any number of
+    worker processes, which claim them. A claim is a lease: the worker has
+    to heartbeat before it expires, or the job is handed to another worker.
+    """
+    def enqueue(self, job_id: str, fingerprint: str, request_data: str, owner: Optional[str] = None) -> None:
+        raise NotImplementedError
+
+    def claim(self, worker_id: str, lease_seconds: float = JOB_LEASE_SECONDS) -> Optional[QueuedJob]:
+        """The oldest claimable job, leased to the worker, or None."""
+        raise NotImplementedError
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float = JOB_LEASE_SECONDS) -> bool:
+        """Extend the lease, returns False if the worker no longer holds it."""
+        raise NotImplementedError
+
+    def complete(self, job_id: str, worker_id: str, identifier: str) -> bool:
+        raise NotImplementedError
+
+    def fail(self, job_id: str, worker_id: str, error: str) -> bool:
+        raise NotImplementedError
+
+    def get(self, job_id: str) -> Optional[QueuedJob]:
+        raise NotImplementedError
+
+    def find_active(self, fingerprint: str) -> Optional[QueuedJob]:
+        """A queued or running job for the request fingerprint, if any."""
+        raise NotImplementedError
+
+
+_COLUMNS = "job_id, fingerprint, request_data, owner, status, worker_id, attempts, identifier, error"
+
+
+class SqliteJobQueue(JobQueue):
+    """
+    JobQueue in the job_queue table of the shared sqlite database. Claims
+    run in an immediate transaction, so two workers never get the same job.
+    The database has to be on a disk every worker can lock, the same node
+    or a shared volume with working file locks.
+    """
+    def __init__(self, max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.max_attempts = max_attempts
+
+    def _connect(self) -> sqlite3.Connection:
+        # several processes write here, wait for each other's locks
+        conn = sqlite3.connect(db_helpers.DB_PATH, timeout=30, isolation_level=None)
+        conn.execute("BEGIN IMMEDIATE")
+        return conn
+
+    def _update(self, query: str, args: tuple) -> bool:
+        conn = self._connect()
+        try:
+            changed = conn.execute(query, args).rowcount
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return changed > 0
+
+    @timed("sqlite_write", table="job_queue")
+    def enqueue(self, job_id: str, fingerprint: str, request_data: str, owner: Optional[str] = None) -> None:
+        now = time.time()
+        # a failed job is enqueued again under its id to resume it
+        self._update(f'INSERT OR REPLACE INTO job_queue ({_COLUMNS}, lease_expires, enqueued_at, updated_at) '
+                     "VALUES (?, ?, ?, ?, 'queued', NULL, 0, NULL, NULL, NULL, ?, ?)",
+                     (job_id, fingerprint, request_data, owner, now, now))
+
+    @timed("sqlite_write", table="job_queue")
+    def claim(self, worker_id: str, lease_seconds: float = JOB_LEASE_SECONDS) -> Optional[QueuedJob]:
+        conn = self._connect()
+        try:
+            now = time.time()
+            # leases that ran out too often mean the job kills its workers
+            conn.execute("UPDATE job_queue SET status = 'failed', error = 'lease expired too often', worker_id = NULL, updated_at = ? "
+                         "WHERE status = 'running' AND lease_expires < ? AND attempts >= ?",
+                         (now, now, self.max_attempts))
+            row = conn.execute(f"SELECT {_COLUMNS} FROM job_queue "
+                               "WHERE status = 'queued' OR (status = 'running' AND lease_expires < ?) "
+                               "ORDER BY enqueued_at LIMIT 1", (now,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE job_queue SET status = 'running', worker_id = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? "
+                             "WHERE job_id = ?", (worker_id, now + lease_seconds, now, row[0]))
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        job = QueuedJob(*row)
+        return job._replace(status="running", worker_id=worker_id, attempts=job.attempts + 1)
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float = JOB_LEASE_SECONDS) -> bool:
+        now = time.time()
+        return self._update("UPDATE job_queue SET lease_expires = ?, updated_at = ? "
+                            "WHERE job_id = ? AND worker_id = ? AND status = 'running'",
+                            (now + lease_seconds, now, job_id, worker_id))
+
+    @timed("sqlite_write", table="job_queue")
+    def complete(self, job_id: str, worker_id: str, identifier: str) -> bool:
+        return self._update("UPDATE job_queue SET status = 'completed', identifier = ?, updated_at = ? "
+                            "WHERE job_id = ? AND worker_id = ? AND status = 'running'",
+                            (identifier, time.time(), job_id, worker_id))
+
+    @timed("sqlite_write", table="job_queue")
+    def fail(self, job_id: str, worker_id: str, error: str) -> bool:
+        return self._update("UPDATE job_queue SET status = 'failed', error = ?, updated_at = ? "
+                            "WHERE job_id = ? AND worker_id = ? AND status = 'running'",
+                            (error, time.time(), job_id, worker_id))
+
+    def _select(self, where: str, args: tuple) -> Optional[QueuedJob]:
+        conn = sqlite3.connect(db_helpers.DB_PATH, timeout=30)
+        try:
+            row = conn.execute(f"SELECT {_COLUMNS} FROM job_queue WHERE {where}", args).fetchone()
+        finally:
+            conn.close()
+        return QueuedJob(*row) if row else None
+
+    def get(self, job_id: str) -> Optional[QueuedJob]:
+        return self._select("job_id = ?", (job_id,))
+
+    def find_active(self, fingerprint: str) -> Optional[QueuedJob]:
+        return self._select("fingerprint = ? AND status IN ('queued', 'running') ORDER BY enqueued_at DESC LIMIT 1",
+                            (fingerprint,))
+
+
+# implementations selectable with JOB_QUEUE
+QUEUES: Dict[str, Type[JobQueue]] = {
+    "sqlite": SqliteJobQueue,
+}
+
+
+def get_job_queue(kind: Optional[str] = JOB_QUEUE) -> Optional[JobQueue]:
+    """The configured queue, or None when jobs run inside the API process."""
+    if not kind:
+        return None
+    if kind not in QUEUES:
+        raise ValueError(f"JOB_QUEUE must be one of {', '.join(QUEUES)}, not {kind}")
+    return QUEUES[kind]()
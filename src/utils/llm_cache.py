@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from pydantic import TypeAdapter
+
+from .metrics import REGISTRY, Counter
+
+# memoize the structured-extraction calls (json and xml writers), they
+# turn the same text into the same structure every time
+LLM_CACHE = os.environ.get("LLM_CACHE", "1") == "1"
+# its own sqlite file, so it can be bounded and removed independently
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", "llm_cache.db")
+# the least recently used outputs are evicted above this size
+LLM_CACHE_MAX_MB = float(os.environ.get("LLM_CACHE_MAX_MB", "64"))
+# outputs older than this are called again
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+
+hits = REGISTRY.register(Counter(
+    "video_api_llm_cache_hits_total",
+    "Extraction calls answered from the disk cache",
+))
+misses = REGISTRY.register(Counter(
+    "video_api_llm_cache_misses_total",
+    "Extraction calls that had to be sent to Gemini",
+))
+
+
+def _stable(value: Any) -> Any:
+    # a pydantic model or TypedDict schema is keyed by its fields, not its name
+    if isinstance(value, type):
+        try:
+            return TypeAdapter(value).json_schema()
+        except Exception:
+            pass
+    return str(value)
+
+
+def cache_key(model, content: str) -> str:
+    """
+    Key of a generate_content call: the model, its system instruction, its
+    generation config including the response schema, and the input text.
+    """
+    config = {name: _stable(value) for name, value in (model._generation_config or {}).items()}
+    return hashlib.sha256(json.dumps({
+        "model": model.model_name,
+        "system_instruction": str(model._system_instruction),
+        "generation_config": config,
+        "content": content,
+    }, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class LlmCache:
+    """
+    Size-bounded store of validated LLM outputs on disk. Entries expire
+    after `ttl` seconds, and the least recently used ones are evicted once
+    the outputs exceed `max_mb`.
+    """
+    def __init__(self, path: str = LLM_CACHE_PATH, max_mb: float = LLM_CACHE_MAX_MB, ttl: float = LLM_CACHE_TTL, enabled: bool = LLM_CACHE,
+                 clock: Callable[[], float] = time.time):
+        self.path = path
+        self.max_bytes = int(max_mb * 2**20)
+        self.ttl = ttl
+        self.enabled = enabled
+        self.clock = clock
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS llm_outputs
+            (cache_key TEXT PRIMARY KEY,
+             output TEXT,
+             size INTEGER,
+             created_at REAL,
+             used_at REAL)
+        ''')
+        return conn
+
+    def get(self, key: str, step: str = "") -> Optional[str]:
+        """the stored output for a key, if there is one that hasn't expired"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            conn = self._connect()
+            try:
+                row = conn.execute('SELECT output FROM llm_outputs WHERE cache_key = ? AND created_at >= ?',
+                                   (key, self.clock() - self.ttl)).fetchone()
+                if row is not None:
+                    conn.execute('UPDATE llm_outputs SET used_at = ? WHERE cache_key = ?', (self.clock(), key))
+                    conn.commit()
+            finally:
+                conn.close()
+        (hits if row is not None else misses).inc(step=step)
+        return row[0] if row is not None else None
+
+    def put(self, key: str, output: str) -> None:
+        if not self.enabled:
+            return
+        size = len(output.encode())
+        now = self.clock()
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute('INSERT OR REPLACE INTO llm_outputs (cache_key, output, size, created_at, used_at) VALUES (?, ?, ?, ?, ?)',
+                             (key, output, size, now, now))
+                conn.execute('DELETE FROM llm_outputs WHERE created_at < ?', (now - self.ttl,))
+                total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM llm_outputs').fetchone()[0]
+                if total > self.max_bytes:
+                    # keep the most recently used entries that fit
+                    kept = 0
+                    for cached_key, cached_size in conn.execute('SELECT cache_key, size FROM llm_outputs ORDER BY used_at DESC').fetchall():
+                        kept += cached_size
+                        if kept > self.max_bytes:
+                            conn.execute('DELETE FROM llm_outputs WHERE cache_key = ?', (cached_key,))
+                conn.commit()
+            finally:
+                conn.close()
+
+
+llm_cache = LlmCache()
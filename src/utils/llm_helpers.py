@@ -1,18 +1,49 @@
 import google.generativeai as genai
 import os
 import time
+from .metrics import REGISTRY, Histogram, timed
+from .progress import publish
+from .rate_limit import rate_limiter
 
 genai.configure(api_key=os.environ["GEMINI_API_KEY"])
 
+prompt_tokens = REGISTRY.register(Histogram(
+    "video_api_prompt_tokens",
+    "Prompt tokens Gemini counted per call, chat history included",
+    buckets=(500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000, 256000),
+))
+cached_prompt_tokens = REGISTRY.register(Histogram(
+    "video_api_cached_prompt_tokens",
+    "Prompt tokens per call that were served from a context cache",
+    buckets=(0, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000),
+))
+
+def record_usage(operation, model_name, response, seconds):
+  """Records the prompt size Gemini reported for a call and publishes it with its latency."""
+  usage = getattr(response, "usage_metadata", None)
+  tokens = getattr(usage, "prompt_token_count", None)
+  if tokens is None:
+    return
+  # tokens served from a context cache are part of the prompt but billed at a discount
+  cached = getattr(usage, "cached_content_token_count", None) or 0
+  prompt_tokens.observe(tokens, operation=operation, model=model_name)
+  cached_prompt_tokens.observe(cached, operation=operation, model=model_name)
+  publish("llm_usage", operation=operation, model=model_name, prompt_tokens=tokens, cached_tokens=cached,
+          output_tokens=getattr(usage, "candidates_token_count", None), seconds=round(seconds, 3))
+
+@timed("upload_to_gemini")
 def upload_to_gemini(path, mime_type=None):
   """Uploads the given file to Gemini.
 
   See https://ai.google.dev/gemini-api/docs/prompting_with_media
   """
-  file = genai.upload_file(path, mime_type=mime_type)
+  publish("upload", target="gemini", file=os.path.basename(str(path)), status="started")
+  file = rate_limiter.call("gemini", "files", genai.upload_file, path, mime_type=mime_type)
   print(f"Uploaded file '{file.display_name}' as: {file.uri}")
+  publish("upload", target="gemini", file=os.path.basename(str(path)), status="finished")
   return file
 
+@timed("wait_for_files_active")
 def wait_for_files_active(files):
   """Waits for the given files to be active.
 
@@ -22,16 +53,39 @@ def wait_for_files_active(files):
   """
   print("Waiting for file processing...")
   for name in (file.name for file in files):
-    file = genai.get_file(name)
+    file = rate_limiter.call("gemini", "files", genai.get_file, name)
     while file.state.name == "PROCESSING":
       print(".", end="", flush=True)
       time.sleep(10)
-      file = genai.get_file(name)
+      file = rate_limiter.call("gemini", "files", genai.get_file, name)
     if file.state.name != "ACTIVE":
       raise Exception(f"File {file.name} failed to process")
   print("...all files ready")
   print()
 
+def upload_files(paths):
+  """Uploads the given files to Gemini and waits until they can be used."""
+  files = [upload_to_gemini(path) for path in paths]
+  wait_for_files_active(files)
+  return files
+
+def send_message(chat_sess, content, **kwargs):
+  """Sends a message in the given chat session and times the call."""
+  model_name = chat_sess.model.model_name
+  started = time.perf_counter()
+  with timed("gemini_send_message", model=model_name):
+    response = rate_limiter.call("gemini", model_name, chat_sess.send_message, content, **kwargs)
+  record_usage("send_message", model_name, response, time.perf_counter() - started)
+  return response
+
+def generate_content(model, content, **kwargs):
+  """Calls generate_content on the given model and times the call."""
+  started = time.perf_counter()
+  with timed("gemini_generate_content", model=model.model_name):
+    response = rate_limiter.call("gemini", model.model_name, model.generate_content, content, **kwargs)
+  record_usage("generate_content", model.model_name, response, time.perf_counter() - started)
+  return response
+
 safety_settings = [
     {
         "category": "HARM_CATEGORY_DANGEROUS",
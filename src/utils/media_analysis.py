@@ -0,0 +1,248 @@
+"""
+Single-pass media analysis. A video is decoded once, and every frame is
+handed to the registered consumers, so metadata, the tail frame,
+thumbnails, a scoring proxy and palette stats don't each open and decode
+the file again. Consumers keep only what they need (a frame, a few
+thumbnails, a histogram), so memory doesn't grow with the video's length.
+
+    results = analyze(path, [VideoInfo(path), TailFrame(), ContactSheet()])
+    results["tail_frame"].save("last.png")
+"""
+import math
+import os
+from contextlib import closing
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import cv2
+import imageio_ffmpeg
+import numpy as np
+from PIL import Image
+from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
+
+from ..models.schemas import Metadata, Resolution
+from .encoding import PROFILES
+from .metrics import timed
+
+
+class StreamInfo(NamedTuple):
+    """what the container header says, before any frame is decoded"""
+    width: int
+    height: int
+    fps: float
+    duration: float # may be off, VideoInfo counts the decoded frames
+
+
+class FrameConsumer:
+    """Receives every decoded frame of an analysis, in order."""
+    name = "consumer"
+
+    def start(self, info: StreamInfo) -> None:
+        self.info = info
+
+    def consume(self, index: int, t: float, frame: np.ndarray) -> None:
+        """frame is an RGB uint8 array of the full size, only valid during the call"""
+        raise NotImplementedError
+
+    def finish(self) -> Any:
+        raise NotImplementedError
+
+
+class _Sampler(FrameConsumer):
+    """consumer that only looks at `rate` frames per second"""
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._next = 0.0
+
+    def consume(self, index: int, t: float, frame: np.ndarray) -> None:
+        if t + 1e-6 >= self._next:
+            self._next = t + 1 / self.rate
+            self.sample(t, frame)
+
+    def sample(self, t: float, frame: np.ndarray) -> None:
+        raise NotImplementedError
+
+
+class VideoInfo(FrameConsumer):
+    """Metadata from the decoded frames, not the header's estimate."""
+    name = "metadata"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.frames = 0
+
+    def consume(self, index: int, t: float, frame: np.ndarray) -> None:
+        self.frames += 1
+
+    def finish(self) -> Metadata:
+        fps = self.info.fps or 1
+        return Metadata(
+            file_size_mb=round(os.path.getsize(self.path) / (1024 * 1024), 2),
+            duration_seconds=round(self.frames / fps),
+            resolution=Resolution(width=self.info.width, height=self.info.height),
+            duration=round(self.frames / fps, 6),
+            fps=self.info.fps or None,
+            frame_count=self.frames,
+        )
+
+
+class TailFrame(FrameConsumer):
+    """The last frame of the video, as an image."""
+    name = "tail_frame"
+
+    def __init__(self):
+        self.frame: Optional[np.ndarray] = None
+
+    def consume(self, index: int, t: float, frame: np.ndarray) -> None:
+        self.frame = frame
+
+    def finish(self) -> Image.Image:
+        if self.frame is None:
+            raise ValueError("Could not read the video frame")
+        return Image.fromarray(self.frame.copy())
+
+
+class ContactSheet(FrameConsumer):
+    """Evenly spaced thumbnails tiled into one image."""
+    name = "contact_sheet"
+
+    def __init__(self, columns: int = 4, rows: int = 3, thumb_width: int = 240):
+        self.columns = columns
+        self.rows = rows
+        self.thumb_width = thumb_width
+        self.thumbs: List[np.ndarray] = []
+
+    def start(self, info: StreamInfo) -> None:
+        super().start(info)
+        count = self.columns * self.rows
+        self.times = [(i + 0.5) * info.duration / count for i in range(count)]
+        self.thumb_size = (self.thumb_width, max(1, round(info.height * self.thumb_width / info.width)))
+
+    def consume(self, index: int, t: float, frame: np.ndarray) -> None:
+        if len(self.thumbs) < len(self.times) and t + 1e-6 >= self.times[len(self.thumbs)]:
+            self.thumbs.append(cv2.resize(frame, self.thumb_size, interpolation=cv2.INTER_AREA))
+
+    def finish(self) -> Image.Image:
+        width, height = self.thumb_size
+        sheet = np.zeros((height * self.rows, width * self.columns, 3), dtype=np.uint8)
+        for i, thumb in enumerate(self.thumbs):
+            row, column = divmod(i, self.columns)
+            sheet[row * height:(row + 1) * height, column * width:(column + 1) * width] = thumb
+        return Image.fromarray(sheet)
+
+
+class Poster(_Sampler):
+    """The sharpest, most contrasted sampled frame, for a poster image."""
+    name = "poster"
+
+    def __init__(self, rate: float = 2.0):
+        super().__init__(rate)
+        self.best: Optional[np.ndarray] = None
+        self.best_score = -math.inf
+
+    def sample(self, t: float, frame: np.ndarray) -> None:
+        gray = cv2.cvtColor(cv2.resize(frame, (320, max(1, frame.shape[0] * 320 // frame.shape[1]))), cv2.COLOR_RGB2GRAY)
+        # sharpness times contrast, so blurry transitions and flat frames lose
+        score = cv2.Laplacian(gray, cv2.CV_64F).var() * gray.std()
+        if score > self.best_score:
+            self.best_score = score
+            self.best = frame.copy()
+
+    def finish(self) -> Image.Image:
+        if self.best is None:
+            raise ValueError("Could not read the video frame")
+        return Image.fromarray(self.best)
+
+
+class PaletteStats(_Sampler):
+    """The dominant colours of the video and its mean brightness."""
+    name = "palette"
+
+    def __init__(self, colors: int = 5, rate: float = 1.0):
+        super().__init__(rate)
+        self.colors = colors
+        # 4 bits per channel
+        self.histogram = np.zeros(4096, dtype=np.int64)
+        self.brightness: List[float] = []
+
+    def sample(self, t: float, frame: np.ndarray) -> None:
+        small = cv2.resize(frame, (64, max(1, frame.shape[0] * 64 // frame.shape[1])), interpolation=cv2.INTER_AREA)
+        bins = (small >> 4).astype(np.int64)
+        self.histogram += np.bincount((bins[..., 0] << 8 | bins[..., 1] << 4 | bins[..., 2]).ravel(), minlength=4096)
+        self.brightness.append(float(small.mean()))
+
+    def finish(self) -> Dict:
+        total = self.histogram.sum() or 1
+        top = np.argsort(self.histogram)[::-1][:self.colors]
+        palette = []
+        for index in top:
+            if not self.histogram[index]:
+                break
+            # centre of the bin
+            rgb = [((index >> shift) & 15) * 16 + 8 for shift in (8, 4, 0)]
+            palette.append({"color": "#{:02x}{:02x}{:02x}".format(*rgb), "share": round(float(self.histogram[index] / total), 4)})
+        return {
+            "palette": palette,
+            "mean_brightness": round(float(np.mean(self.brightness)), 2) if self.brightness else None,
+        }
+
+
+class ScoringProxy(_Sampler):
+    """A small, low frame rate copy of the video, enough for a model to score."""
+    name = "proxy"
+
+    def __init__(self, output_path: str, width: int = 480, rate: float = 8.0):
+        super().__init__(rate)
+        self.output_path = output_path
+        self.width = width
+        self.writer: Optional[FFMPEG_VideoWriter] = None
+
+    def start(self, info: StreamInfo) -> None:
+        super().start(info)
+        # h264 with yuv420p needs even dimensions
+        width = min(self.width, info.width) // 2 * 2
+        self.size = (width, max(2, round(info.height * width / info.width) // 2 * 2))
+        profile = PROFILES["fast-preview"]
+        self.writer = FFMPEG_VideoWriter(self.output_path, self.size, self.rate, codec="libx264", preset=profile.preset,
+                                         ffmpeg_params=profile.video_params(), pixel_format="yuv420p")
+
+    def sample(self, t: float, frame: np.ndarray) -> None:
+        self.writer.write_frame(cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA))
+
+    def finish(self) -> str:
+        self.writer.close()
+        return self.output_path
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+
+
+def _stream_info(meta: Dict) -> StreamInfo:
+    width, height = meta["size"]
+    return StreamInfo(width=width, height=height, fps=float(meta.get("fps") or 0), duration=float(meta.get("duration") or 0))
+
+
+@timed("media_analysis")
+def analyze(path: str, consumers: List[FrameConsumer]) -> Dict[str, Any]:
+    """
+    Decode the video once and feed every frame to the consumers. Returns
+    what each consumer's finish() returned, keyed by its name.
+    """
+    with closing(imageio_ffmpeg.read_frames(path, pix_fmt="rgb24")) as frames:
+        info = _stream_info(next(frames))
+        shape: Tuple[int, int, int] = (info.height, info.width, 3)
+        try:
+            for consumer in consumers:
+                consumer.start(info)
+            for index, data in enumerate(frames):
+                # a view on the decoder's buffer, consumers copy what they keep
+                frame = np.frombuffer(data, dtype=np.uint8).reshape(shape)
+                t = index / info.fps if info.fps else 0.0
+                for consumer in consumers:
+                    consumer.consume(index, t, frame)
+            return {consumer.name: consumer.finish() for consumer in consumers}
+        except BaseException:
+            for consumer in consumers:
+                if hasattr(consumer, "close"):
+                    consumer.close()
+            raise
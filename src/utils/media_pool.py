@@ -0,0 +1,224 @@
+"""
+Process pool for the CPU-bound media work. Encodes, decodes and PNG
+encoding hold the GIL for long stretches, and the API serves its requests
+from the same process, so a render running there slows every request.
+The media work runs in worker processes instead, as typed tasks:
+
+    metadata = media_pool.run(ProbeTask(path))
+    media_pool.run(WatermarkTask(segment, sprite, (1280, 720), part))
+
+A task is a NamedTuple of paths and small settings, its `run` does the
+work in the worker. Frames never cross the process boundary: a task reads
+its input from files and writes its output to files, and returns their
+paths with small results (metadata, stats).
+
+The timed operations of a task are recorded in the caller's metrics and
+job timeline as if they had run there. The pool has MEDIA_POOL_WORKERS_PER_CORE
+workers per core, at least one; 0 runs the tasks in the calling thread.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from ..models.schemas import Metadata
+from .brand_analytics import BrandAnalytics
+from .encoding import EncodeProfile
+from .helpers import (add_watermark, concat_parts, embed_text_clips, encode_segment_part, fade_in_text,
+                      get_video_metadata)
+from .media_analysis import ContactSheet, PaletteStats, Poster, TailFrame, VideoInfo, analyze
+from .metrics import job_timeline, record_span, timed
+from .segment_quality import SegmentQuality
+from .smart_render import smart_render
+from .text_placement import BackgroundStats
+
+# worker processes per core, the media work of a job mostly runs one task
+# at a time and ffmpeg encodes on several threads of its own
+MEDIA_POOL_WORKERS_PER_CORE = float(os.environ.get("MEDIA_POOL_WORKERS_PER_CORE", "0.5"))
+
+
+def pool_size(per_core: Optional[float] = None) -> int:
+    """worker processes for a number per core, 0 when the pool is off"""
+    per_core = MEDIA_POOL_WORKERS_PER_CORE if per_core is None else per_core
+    if per_core <= 0:
+        return 0
+    return max(1, round((os.cpu_count() or 1) * per_core))
+
+
+class MergeTask(NamedTuple):
+    """Join fragmented parts into one mp4, without re-encoding."""
+    part_paths: List[str]
+    output_path: str
+
+    def run(self) -> str:
+        return concat_parts(self.part_paths, self.output_path)
+
+
+class WatermarkTask(NamedTuple):
+    """Watermark a segment into a fragmented part."""
+    segment_path: str
+    sprite_path: str
+    size: Tuple[int, int]
+    output_path: str
+    profile: Optional[EncodeProfile] = None
+    ffmpeg_params: Sequence[str] = ()
+
+    def run(self) -> str:
+        return encode_segment_part(self.segment_path, self.sprite_path, self.size, self.output_path,
+                                   self.profile, self.ffmpeg_params)
+
+
+class WatermarkVideoTask(NamedTuple):
+    """Watermark a whole video with a logo, in the final profile."""
+    video_path: str
+    logo_path: str
+    output_path: str
+    profile: Optional[EncodeProfile] = None
+
+    def run(self) -> str:
+        add_watermark(self.video_path, self.logo_path, self.output_path, self.profile)
+        return self.output_path
+
+
+class OverlayTask(NamedTuple):
+    """
+    Burn text overlays (the texts of a TextOverlays) into a video. With
+    smart set, only the keyframe spans under the texts are encoded again
+    when the video allows it; the result is then the seconds encoded again
+    and copied, None when the whole video was encoded.
+    """
+    video_path: str
+    texts: List[Dict]
+    output_path: str
+    profile: EncodeProfile
+    aspect_ratio: str = "landscape"
+    smart: bool = False
+
+    def run(self) -> Optional[Dict[str, float]]:
+        text_clips = [fade_in_text(self.video_path, text["text_duration"], text["text"], text["font_size"],
+                                   text["position"], text["color"], text["font"], self.aspect_ratio)
+                      for text in self.texts]
+        print(f"succesfully generated {len(text_clips)} text clips")
+        if self.smart:
+            try:
+                return smart_render(self.video_path, text_clips, self.output_path, self.profile)
+            except ValueError as e:
+                print(f"Error splicing the text overlays, encoding the whole video: {e}")
+        embed_text_clips(self.video_path, text_clips, self.output_path, self.profile)
+        return None
+
+
+class LastFrameTask(NamedTuple):
+    """
+    The last frame of a segment, saved as a png, with the decoded metadata
+    and the samples of the segment quality check, from one decode.
+    """
+    video_path: str
+    frame_path: str
+
+    def run(self) -> Dict[str, Any]:
+        results = analyze(self.video_path, [VideoInfo(self.video_path), TailFrame(), SegmentQuality()])
+        results.pop("tail_frame").save(self.frame_path)
+        results["last_frame"] = self.frame_path
+        return results
+
+
+class AnalysisTask(NamedTuple):
+    """
+    The poster, contact sheet, palette and brand analytics of a watermarked
+    render, from one decode. The images are saved to the given paths, the
+    result has the palette and brand analytics.
+    """
+    video_path: str
+    poster_path: str
+    contact_sheet_path: str
+    brand_palette: List[str]
+    logo_path: Optional[str] = None
+
+    def run(self) -> Dict[str, Any]:
+        results = analyze(self.video_path, [Poster(), ContactSheet(), PaletteStats(),
+                                            BrandAnalytics(self.brand_palette, self.logo_path, watermarked=True)])
+        results.pop("poster").save(self.poster_path)
+        results.pop("contact_sheet").save(self.contact_sheet_path)
+        return results
+
+
+class BackgroundStatsTask(NamedTuple):
+    """The background of a video over time, for placing its text overlays."""
+    video_path: str
+
+    def run(self) -> Dict[str, Any]:
+        return analyze(self.video_path, [BackgroundStats()])["background"]
+
+
+class ProbeTask(NamedTuple):
+    """Metadata of a video from its container header."""
+    path: str
+
+    def run(self) -> Metadata:
+        return get_video_metadata(self.path)
+
+
+MediaTask = Union[MergeTask, WatermarkTask, WatermarkVideoTask, OverlayTask, LastFrameTask, AnalysisTask,
+                  BackgroundStatsTask, ProbeTask]
+
+
+def _execute(task: MediaTask, cwd: str) -> Tuple[Any, List[Tuple]]:
+    """run a task in a worker, with the spans it timed"""
+    # the tasks may have relative paths, a worker outlives the caller's directory
+    os.chdir(cwd)
+    with job_timeline() as timeline:
+        result = task.run()
+    spans = [(span.operation, timeline.started + span.start, timeline.started + span.start + span.duration,
+              span.labels, span.error) for span in timeline.to_list()]
+    return result, spans
+
+
+class MediaPool:
+    """
+    Worker processes for media tasks, started with the first task. Callers
+    block in their own thread until their task is done, like they would
+    running it themselves.
+    """
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = pool_size() if workers is None else workers
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawned rather than forked: the API process has threads,
+                # and a fork copies the locks they hold
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def run(self, task: MediaTask) -> Any:
+        """run a task in a worker process and return its result, or raise its exception"""
+        with timed("media_task", task=type(task).__name__):
+            if not self.workers:
+                return task.run()
+            pool = self._pool()
+            try:
+                result, spans = pool.submit(_execute, task, os.getcwd()).result()
+            except BrokenProcessPool:
+                # a worker died (killed for its memory, a crash in a native
+                # library), the next task starts a new pool
+                with self._lock:
+                    if self._executor is pool:
+                        self._executor = None
+                raise
+        for span in spans:
+            record_span(*span)
+        return result
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+media_pool = MediaPool()
@@ -0,0 +1,207 @@
+import threading
+import time
+from contextlib import ContextDecorator, contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from ..models.schemas import TimelineSpan
+
+# seconds, chosen to cover everything from a sqlite write to a Kling render
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200)
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: Optional[Dict[str, str]] = None) -> str:
+    items = list(labels) + list((extra or {}).items())
+    if not items:
+        return ""
+    escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in items]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+class Histogram:
+    """
+    Minimal Prometheus style histogram with labels.
+    """
+    def __init__(self, name: str, description: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # label set -> (bucket counts, sum, count)
+        self._series: Dict[Tuple[Tuple[str, str], ...], List] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_format_labels(key, {'le': repr(float(bound))})} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, {'le': '+Inf'})} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class Gauge:
+    """
+    Minimal Prometheus style gauge with labels.
+    """
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: str) -> float:
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Counter(Gauge):
+    """
+    Minimal Prometheus style counter with labels, it only goes up.
+    """
+    def set(self, value: float, **labels: str) -> None:
+        raise TypeError("counters can only be incremented")
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        raise TypeError("counters can only be incremented")
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} counter"
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+operation_seconds = REGISTRY.register(Histogram(
+    "video_api_operation_seconds",
+    "Time spent in external calls and local processing steps",
+))
+
+
+class JobTimeline:
+    """
+    Collects the spans recorded while a single job runs.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.spans: List[TimelineSpan] = []
+
+    def add(self, operation: str, start: float, end: float, labels: Dict[str, str], error: Optional[str]) -> None:
+        span = TimelineSpan(
+            operation=operation,
+            labels=labels,
+            start=round(start - self.started, 3),
+            duration=round(end - start, 3),
+            error=error,
+        )
+        with self._lock:
+            self.spans.append(span)
+
+    def to_list(self) -> List[TimelineSpan]:
+        with self._lock:
+            return sorted(self.spans, key=lambda span: span.start)
+
+
+_current_timeline: ContextVar[Optional[JobTimeline]] = ContextVar("current_timeline", default=None)
+
+
+@contextmanager
+def job_timeline() -> Iterator[JobTimeline]:
+    """
+    Start a timeline for the current job. Every `timed` block that runs in
+    this context (including threads started with a copy of it) is recorded.
+    """
+    timeline = JobTimeline()
+    token = _current_timeline.set(timeline)
+    try:
+        yield timeline
+    finally:
+        _current_timeline.reset(token)
+
+
+class timed(ContextDecorator):
+    """
+    Time a block or function call, usable both as a context manager and as
+    a decorator. The duration goes to the operation histogram and to the
+    timeline of the running job, if there is one.
+    """
+    def __init__(self, operation: str, **labels: str):
+        self.operation = operation
+        self.labels = {k: str(v) for k, v in labels.items()}
+        self._starts = threading.local()
+
+    def __enter__(self):
+        self._starts.__dict__.setdefault("stack", []).append(time.perf_counter())
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        start = self._starts.stack.pop()
+        record_span(self.operation, start, end, self.labels, repr(exc) if exc is not None else None)
+        return False
+
+
+def record_span(operation: str, start: float, end: float, labels: Dict[str, str], error: Optional[str] = None) -> None:
+    """
+    Record a timed operation like `timed` does. perf_counter times, also
+    those measured in another process on the same machine.
+    """
+    operation_seconds.observe(end - start, operation=operation, **labels)
+    timeline = _current_timeline.get()
+    if timeline is not None:
+        timeline.add(operation, start, end, labels, error)
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,99 @@
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Iterable, List
+
+from ..models.schemas import StageTiming
+from .metrics import timed
+from .progress import publish
+
+
+class Stage:
+    def __init__(self, name: str, fn: Callable[..., Any], deps: Iterable[str] = ()):
+        self.name = name
+        self.fn = fn
+        self.deps = list(deps)
+
+
+class Pipeline:
+    """
+    Runs a set of stages as a dependency graph. A stage starts as soon as
+    all of its dependencies have finished, so independent stages run
+    concurrently. Each stage function receives the results of its
+    dependencies as keyword arguments named after those stages.
+    """
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max_workers
+        self.stages: Dict[str, Stage] = {}
+        self.results: Dict[str, Any] = {}
+        self.timings: Dict[str, StageTiming] = {}
+
+    def add_stage(self, name: str, fn: Callable[..., Any], deps: Iterable[str] = ()) -> "Pipeline":
+        if name in self.stages:
+            raise ValueError(f"Stage {name} already exists")
+        self.stages[name] = Stage(name, fn, deps)
+        return self
+
+    def _check_graph(self) -> None:
+        for stage in self.stages.values():
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError(f"Stage {stage.name} depends on unknown stage {dep}")
+        # detect cycles with a simple topological sort
+        remaining = {name: set(stage.deps) for name, stage in self.stages.items()}
+        while remaining:
+            ready = [name for name, deps in remaining.items() if not deps]
+            if not ready:
+                raise ValueError(f"Pipeline has a dependency cycle between {sorted(remaining)}")
+            for name in ready:
+                del remaining[name]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+
+    def _run_stage(self, stage: Stage, started: float) -> Any:
+        start = time.perf_counter()
+        publish("stage", stage=stage.name, status="started")
+        status = "failed"
+        try:
+            with timed("pipeline_stage", stage=stage.name):
+                result = stage.fn(**{dep: self.results[dep] for dep in stage.deps})
+            status = "finished"
+            return result
+        finally:
+            end = time.perf_counter()
+            self.timings[stage.name] = StageTiming(
+                start=round(start - started, 3),
+                end=round(end - started, 3),
+                duration=round(end - start, 3),
+            )
+            print(f"stage {stage.name} {status} in {end - start:.2f}s")
+            publish("stage", stage=stage.name, status=status, duration=round(end - start, 3))
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Run every stage and return the results keyed by stage name.
+        The first failing stage cancels everything that has not started yet
+        and its exception is re-raised.
+        """
+        self._check_graph()
+        started = time.perf_counter()
+        pending: List[Stage] = list(self.stages.values())
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                for stage in [s for s in pending if all(d in self.results for d in s.deps)]:
+                    pending.remove(stage)
+                    # each stage runs in a copy of the caller's context so the
+                    # job timeline follows it into the worker thread
+                    context = contextvars.copy_context()
+                    running[executor.submit(context.run, self._run_stage, stage, started)] = stage
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        for other in running:
+                            other.cancel()
+                        raise error
+                    self.results[stage.name] = future.result()
+        return self.results
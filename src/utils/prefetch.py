@@ -0,0 +1,89 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+from .metrics import REGISTRY, Histogram, timed
+from .progress import publish
+
+hidden_seconds = REGISTRY.register(Histogram(
+    "video_api_hidden_seconds",
+    "Local work done in the background while a remote render was running",
+))
+
+
+def _overlap(start: float, end: float, intervals: List[Tuple[float, float]]) -> float:
+    return sum(max(0.0, min(end, e) - max(start, s)) for s, e in intervals)
+
+
+class Prefetcher:
+    """
+    Runs local work for a job in the background, in submission order, so it
+    overlaps the remote renders instead of waiting for them to finish.
+
+    Remote waits are marked with `remote_wait()`. Every background task
+    records how much of its run fell inside one, which is the time it hid
+    from the job's wall time.
+    """
+    def __init__(self, max_workers: int = 1):
+        # one worker keeps the encodes from competing with each other, the
+        # main thread is idle while it waits on fal anyway
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._waits: List[Tuple[float, float]] = []
+        self._tasks: List[Dict[str, Any]] = []
+
+    @contextmanager
+    def remote_wait(self) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._waits.append((start, time.perf_counter()))
+
+    def submit(self, task: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        """Run fn in the background, in the caller's context so its timings reach the job timeline."""
+        context = contextvars.copy_context()
+        return self._executor.submit(context.run, self._run, task, fn, *args, **kwargs)
+
+    def _run(self, task: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        start = time.perf_counter()
+        try:
+            with timed("prefetch", task=task):
+                return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._tasks.append({"task": task, "start": start, "end": time.perf_counter()})
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        """
+        Total and hidden seconds per task. A task is only hidden while a
+        remote wait that has already ended overlapped it, so call this once
+        the renders are done.
+        """
+        with self._lock:
+            waits = list(self._waits)
+            tasks = list(self._tasks)
+        report: Dict[str, Dict[str, float]] = {}
+        for entry in tasks:
+            stats = report.setdefault(entry["task"], {"count": 0, "seconds": 0.0, "hidden_seconds": 0.0})
+            stats["count"] += 1
+            stats["seconds"] += entry["end"] - entry["start"]
+            stats["hidden_seconds"] += _overlap(entry["start"], entry["end"], waits)
+        for stats in report.values():
+            stats["seconds"] = round(stats["seconds"], 3)
+            stats["hidden_seconds"] = round(stats["hidden_seconds"], 3)
+        return report
+
+    def close(self) -> Dict[str, Dict[str, float]]:
+        """Wait for the background work, publish and return the report."""
+        self._executor.shutdown(wait=True)
+        report = self.report()
+        for task, stats in report.items():
+            hidden_seconds.observe(stats["hidden_seconds"], task=task)
+            print(f"prefetch {task}: {stats['count']} runs, {stats['seconds']:.2f}s, {stats['hidden_seconds']:.2f}s hidden")
+            publish("prefetch", task=task, **stats)
+        return report
@@ -0,0 +1,279 @@
+"""
+Video metadata from the container header, without starting a decoder.
+
+MP4 and MOV files are probed by reading their `moov` box: the movie and
+track headers give the exact duration, dimensions and rotation, the sample
+description the codec, and the sample table the frame count. Anything
+else (or a fragmented MP4 whose duration is only in its fragments) goes
+to ffprobe when it is installed, or else to `ffmpeg -i` through moviepy.
+"""
+import hashlib
+import json
+import math
+import os
+import shutil
+import struct
+import subprocess
+import threading
+from collections import OrderedDict
+from typing import BinaryIO, Dict, Iterator, Optional, Tuple
+
+from ..models.schemas import Metadata, Resolution
+from .metrics import timed
+
+# boxes that only hold other boxes
+CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"edts", b"mvex"}
+# sample entry formats under the codec names ffmpeg reports
+CODECS = {"avc1": "h264", "avc3": "h264", "hvc1": "hevc", "hev1": "hevc", "vp09": "vp9", "av01": "av1", "mp4v": "mpeg4"}
+# a moov box bigger than this is not a header we want to read into memory
+MAX_MOOV_BYTES = 64 * 2**20
+# bytes from each end of the file that go into the cache key
+HASH_BYTES = 64 * 2**10
+
+
+class ProbeError(ValueError):
+    pass
+
+
+def _boxes(data: bytes, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[bytes, int, int]]:
+    """type, payload start and payload end of each box in data[start:end]"""
+    end = len(data) if end is None else end
+    while start + 8 <= end:
+        size, kind = struct.unpack_from(">I4s", data, start)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, start + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - start
+        if size < header or start + size > end:
+            raise ProbeError(f"truncated {kind!r} box")
+        yield kind, start + header, start + size
+        start += size
+
+
+def _read_moov(f: BinaryIO) -> bytes:
+    """find the top level moov box by seeking over the others, mdat included"""
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    offset = 0
+    while offset + 8 <= file_size:
+        f.seek(offset)
+        header = f.read(16)
+        size, kind = struct.unpack_from(">I4s", header)
+        header_size = 8
+        if size == 1:
+            size, header_size = struct.unpack_from(">Q", header, 8)[0], 16
+        elif size == 0:
+            size = file_size - offset
+        if size < header_size:
+            raise ProbeError(f"invalid {kind!r} box")
+        if kind == b"moov":
+            if size > MAX_MOOV_BYTES:
+                raise ProbeError("moov box is too large")
+            f.seek(offset + header_size)
+            return f.read(size - header_size)
+        offset += size
+    raise ProbeError("no moov box")
+
+
+def _full_box(data: bytes, start: int) -> Tuple[int, int]:
+    """version of a full box and where its fields start"""
+    return data[start], start + 4
+
+
+def _parse_track(data: bytes, start: int, end: int) -> Dict:
+    track: Dict = {}
+
+    def walk(start: int, end: int) -> None:
+        for kind, box_start, box_end in _boxes(data, start, end):
+            if kind in CONTAINERS:
+                walk(box_start, box_end)
+            elif kind == b"tkhd":
+                version, fields = _full_box(data, box_start)
+                # skip times, track id, reserved and duration, then
+                # reserved, layer, alternate group, volume and reserved
+                fields += (32 if version == 1 else 20) + 16
+                matrix = struct.unpack_from(">9i", data, fields)
+                track["rotation"] = round(math.degrees(math.atan2(matrix[1], matrix[0]))) % 360
+            elif kind == b"mdhd":
+                version, fields = _full_box(data, box_start)
+                if version == 1:
+                    track["timescale"], track["duration"] = struct.unpack_from(">IQ", data, fields + 16)
+                else:
+                    track["timescale"], track["duration"] = struct.unpack_from(">II", data, fields + 8)
+            elif kind == b"hdlr":
+                track["handler"] = data[box_start + 8:box_start + 12]
+            elif kind == b"stsd":
+                entries = list(_boxes(data, box_start + 8, box_end))
+                if entries:
+                    codec, entry_start, _ = entries[0]
+                    codec = codec.decode("latin-1").strip()
+                    track["codec"] = CODECS.get(codec, codec)
+                    if track.get("handler") == b"vide":
+                        # visual sample entry: reserved, data reference and
+                        # pre-defined fields come before the coded size
+                        track["width"], track["height"] = struct.unpack_from(">HH", data, entry_start + 24)
+            elif kind == b"stts":
+                count = struct.unpack_from(">I", data, box_start + 4)[0]
+                runs = [struct.unpack_from(">II", data, box_start + 8 + 8 * i) for i in range(count)]
+                track["frames"] = sum(samples for samples, _ in runs)
+                track["vfr"] = len({delta for _, delta in runs}) > 1
+
+    walk(start, end)
+    return track
+
+
+def parse_moov(data: bytes) -> Dict:
+    """movie timescale and duration, fragment duration and the tracks of a moov payload"""
+    movie: Dict = {"tracks": []}
+    for kind, start, end in _boxes(data):
+        if kind == b"mvhd":
+            version, fields = _full_box(data, start)
+            if version == 1:
+                movie["timescale"], movie["duration"] = struct.unpack_from(">IQ", data, fields + 16)
+            else:
+                movie["timescale"], movie["duration"] = struct.unpack_from(">II", data, fields + 8)
+        elif kind == b"trak":
+            movie["tracks"].append(_parse_track(data, start, end))
+        elif kind == b"mvex":
+            for child, child_start, _ in _boxes(data, start, end):
+                if child == b"mehd":
+                    version, fields = _full_box(data, child_start)
+                    movie["fragment_duration"] = struct.unpack_from(">Q" if version == 1 else ">I", data, fields)[0]
+    return movie
+
+
+def probe_mp4(path: str) -> Metadata:
+    """metadata from the moov box of an MP4 or MOV file"""
+    with open(path, "rb") as f:
+        movie = parse_moov(_read_moov(f))
+    video = next((track for track in movie["tracks"] if track.get("handler") == b"vide"), None)
+    if video is None or "width" not in video:
+        raise ProbeError("no video track")
+    if video.get("duration") and video.get("timescale"):
+        duration = video["duration"] / video["timescale"]
+    elif movie.get("duration") and movie.get("timescale"):
+        duration = movie["duration"] / movie["timescale"]
+    elif movie.get("fragment_duration") and movie.get("timescale"):
+        duration = movie["fragment_duration"] / movie["timescale"]
+    else:
+        # the samples are in the fragments, their durations too
+        raise ProbeError("duration is only in the fragments")
+    frames = video.get("frames") or None
+    return _metadata(path, duration, video["width"], video["height"], fps=frames / duration if frames else None,
+                     frame_count=frames, codec=video.get("codec"), rotation=video.get("rotation", 0),
+                     variable_frame_rate=video.get("vfr"))
+
+
+def _metadata(path: str, duration: float, width: int, height: int, **fields) -> Metadata:
+    file_size = os.path.getsize(path)
+    if duration <= 0:
+        raise ProbeError("no duration")
+    fps = fields.pop("fps", None)
+    return Metadata(
+        file_size_mb=round(file_size / (1024 * 1024), 2),
+        duration_seconds=round(duration),
+        resolution=Resolution(width=width, height=height),
+        duration=round(duration, 6),
+        fps=round(fps, 3) if fps else None,
+        bitrate_kbps=round(file_size * 8 / duration / 1000, 1),
+        **fields,
+    )
+
+
+def probe_ffprobe(path: str) -> Metadata:
+    result = subprocess.run(["ffprobe", "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path],
+                            check=True, capture_output=True, text=True)
+    info = json.loads(result.stdout)
+    video = next((stream for stream in info["streams"] if stream.get("codec_type") == "video"), None)
+    if video is None:
+        raise ProbeError("no video stream")
+    numerator, _, denominator = video.get("avg_frame_rate", "0/1").partition("/")
+    fps = float(numerator) / float(denominator or 1) if float(denominator or 1) else None
+    rotation = int(video.get("tags", {}).get("rotate", 0))
+    for side_data in video.get("side_data_list", []):
+        # the display matrix angle is counterclockwise
+        rotation = -int(side_data.get("rotation", -rotation))
+    frames = int(video["nb_frames"]) if video.get("nb_frames", "").isdigit() else None
+    return _metadata(path, float(video.get("duration") or info["format"]["duration"]), video["width"], video["height"],
+                     fps=fps or None, frame_count=frames, codec=video.get("codec_name"), rotation=rotation % 360)
+
+
+def probe_ffmpeg(path: str) -> Metadata:
+    """header of any file ffmpeg reads, from the output of `ffmpeg -i`"""
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+    info = ffmpeg_parse_infos(path)
+    if not info.get("video_found"):
+        raise ProbeError("no video stream")
+    width, height = info["video_size"]
+    return _metadata(path, float(info.get("video_duration") or info["duration"]), width, height,
+                     fps=info.get("video_fps"), frame_count=info.get("video_n_frames"),
+                     codec=info.get("video_codec_name"), rotation=int(info.get("video_rotation", 0)) % 360)
+
+
+def file_digest(path: str) -> str:
+    """
+    Cache key of a file's content: its size and the bytes at either end,
+    where the header boxes are. Hashing the whole file would cost more
+    than probing it.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        digest.update(str(size).encode())
+        f.seek(0)
+        digest.update(f.read(HASH_BYTES))
+        f.seek(max(0, size - HASH_BYTES))
+        digest.update(f.read(HASH_BYTES))
+    return digest.hexdigest()
+
+
+class _ProbeCache:
+    def __init__(self, size: int = 256):
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Metadata]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Metadata]:
+        with self._lock:
+            metadata = self._entries.get(key)
+            if metadata is not None:
+                self._entries.move_to_end(key)
+            return metadata
+
+    def put(self, key: str, metadata: Metadata) -> None:
+        with self._lock:
+            self._entries[key] = metadata
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
+_cache = _ProbeCache()
+
+
+@timed("video_probe")
+def probe(path: str) -> Metadata:
+    """
+    Metadata of a video from its container header, cached per file
+    content. The moov box is tried first, then ffprobe, then ffmpeg.
+    """
+    key = file_digest(path)
+    cached = _cache.get(key)
+    if cached is not None:
+        # a copy, callers adjust the resolution they report
+        return cached.model_copy(deep=True)
+    probes = [probe_mp4, probe_ffprobe, probe_ffmpeg] if shutil.which("ffprobe") else [probe_mp4, probe_ffmpeg]
+    errors = []
+    for fn in probes:
+        try:
+            metadata = fn(path)
+            break
+        except Exception as e:
+            errors.append(f"{fn.__name__}: {e}")
+    else:
+        raise ValueError(f"Could not probe {path}: {'; '.join(errors)}")
+    _cache.put(key, metadata)
+    return metadata.model_copy(deep=True)
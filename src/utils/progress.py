@@ -0,0 +1,137 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from typing import AsyncIterator, Dict, List, Optional, Set
+
+from ..models.schemas import ProgressEvent
+
+# events that end a job's stream
+TERMINAL_EVENTS = ("completed", "failed")
+
+# the job whose progress is being reported in the current context
+current_job_id: ContextVar[Optional[str]] = ContextVar("current_job_id", default=None)
+
+
+class ProgressBroker:
+    """
+    In-process pub/sub for job progress events.
+
+    Publishing is thread safe and costs one loop callback per event no
+    matter how many watchers there are; the callback fans the event out to
+    the subscriber queues on the event loop. The last events of every job
+    are kept so late subscribers can catch up.
+    """
+    def __init__(self, history_size: int = 200, max_jobs: int = 1000, queue_size: int = 256):
+        self.history_size = history_size
+        self.max_jobs = max_jobs
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._history: "OrderedDict[str, deque]" = OrderedDict()
+        self._sequence: Dict[str, int] = {}
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def publish(self, job_id: str, event: str, **data) -> ProgressEvent:
+        with self._lock:
+            sequence = self._sequence.get(job_id, 0) + 1
+            self._sequence[job_id] = sequence
+            progress_event = ProgressEvent(id=sequence, job_id=job_id, event=event, data=data, time=time.time())
+            history = self._history.get(job_id)
+            if history is None:
+                history = self._history[job_id] = deque(maxlen=self.history_size)
+                # forget the oldest jobs
+                while len(self._history) > self.max_jobs:
+                    old_job, _ = self._history.popitem(last=False)
+                    self._sequence.pop(old_job, None)
+            history.append(progress_event)
+            loop = self._loop if self._subscribers.get(job_id) else None
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._deliver, job_id, progress_event)
+        return progress_event
+
+    def _deliver(self, job_id: str, progress_event: ProgressEvent) -> None:
+        for queue in list(self._subscribers.get(job_id, ())):
+            try:
+                queue.put_nowait(progress_event)
+            except asyncio.QueueFull:
+                # slow watcher, it can recover the state from the status
+                # endpoint; but the event that ends its stream must arrive,
+                # in place of the oldest one it hasn't read
+                if progress_event.event in TERMINAL_EVENTS:
+                    queue.get_nowait()
+                    queue.put_nowait(progress_event)
+
+    def clear(self, job_id: str) -> None:
+        """
+        Forget the events of a job before it runs again under the same id.
+        Event ids keep counting up so Last-Event-ID stays meaningful.
+        """
+        with self._lock:
+            self._history.pop(job_id, None)
+
+    def history(self, job_id: str) -> List[ProgressEvent]:
+        with self._lock:
+            return list(self._history.get(job_id, ()))
+
+    def latest(self, job_id: str) -> Optional[ProgressEvent]:
+        with self._lock:
+            history = self._history.get(job_id)
+            return history[-1] if history else None
+
+    async def subscribe(self, job_id: str, last_event_id: int = 0, heartbeat: float = 15.0) -> AsyncIterator[Optional[ProgressEvent]]:
+        """
+        Yield the events of a job, starting after last_event_id, until the
+        job completes or fails. None is yielded every `heartbeat` seconds
+        without events so the caller can keep the connection alive.
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._loop = asyncio.get_running_loop()
+            self._subscribers.setdefault(job_id, set()).add(queue)
+            backlog = list(self._history.get(job_id, ()))
+        try:
+            for progress_event in backlog:
+                if progress_event.id > last_event_id:
+                    last_event_id = progress_event.id
+                    yield progress_event
+                    if progress_event.event in TERMINAL_EVENTS:
+                        return
+            while True:
+                try:
+                    progress_event = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if progress_event.id <= last_event_id:
+                    continue
+                last_event_id = progress_event.id
+                yield progress_event
+                if progress_event.event in TERMINAL_EVENTS:
+                    return
+        finally:
+            with self._lock:
+                subscribers = self._subscribers.get(job_id)
+                if subscribers is not None:
+                    subscribers.discard(queue)
+                    if not subscribers:
+                        del self._subscribers[job_id]
+
+
+broker = ProgressBroker()
+
+
+def publish(event: str, **data) -> Optional[ProgressEvent]:
+    """Publish an event for the job running in the current context, if any."""
+    job_id = current_job_id.get()
+    if job_id is None:
+        return None
+    return broker.publish(job_id, event, **data)
+
+
+def format_sse(progress_event: Optional[ProgressEvent]) -> str:
+    """Server-sent events framing, None gives a heartbeat comment."""
+    if progress_event is None:
+        return ": heartbeat\n\n"
+    return f"id: {progress_event.id}\nevent: {progress_event.event}\ndata: {progress_event.model_dump_json()}\n\n"
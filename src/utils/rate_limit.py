@@ -0,0 +1,180 @@
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+from .metrics import REGISTRY, Gauge, Histogram
+
+wait_seconds = REGISTRY.register(Histogram(
+    "video_api_rate_limit_wait_seconds",
+    "Time a call waited for its provider's rate limit before it was sent",
+))
+backoff_seconds = REGISTRY.register(Histogram(
+    "video_api_rate_limit_backoff_seconds",
+    "Backoff after a provider answered 429, one observation per throttled call",
+))
+queue_depth = REGISTRY.register(Gauge(
+    "video_api_rate_limit_queue_depth",
+    "Calls waiting for a token or a concurrency slot",
+))
+current_rate = REGISTRY.register(Gauge(
+    "video_api_rate_limit_requests_per_second",
+    "Current request rate allowed by the adaptive limiter",
+))
+
+
+class ProviderLimit(NamedTuple):
+    rpm: float # sustained requests per minute
+    burst: int # requests that may be sent at once after an idle period
+    concurrency: int = 0 # calls in flight at once, 0 for no limit
+
+
+# per provider, or per "provider/model" to override one model. fal's
+# concurrency covers whole renders, they hold their slot until done
+DEFAULT_LIMITS = {
+    "gemini": ProviderLimit(rpm=300, burst=20),
+    "fal": ProviderLimit(rpm=60, burst=10),
+}
+# e.g. {"gemini/gemini-1.5-flash": {"rpm": 15, "burst": 5}, "fal": {"rpm": 30, "burst": 5, "concurrency": 4}}
+RATE_LIMITS = {key: ProviderLimit(**{"burst": 1, **value}) for key, value in json.loads(os.environ.get("RATE_LIMITS", "{}")).items()}
+# times a call is sent again after a 429 before the error is raised
+RATE_LIMIT_RETRIES = int(os.environ.get("RATE_LIMIT_RETRIES", "4"))
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """whether a provider error is a 429, from google.api_core, httpx or anything with a status"""
+    for value in (getattr(error, "code", None), getattr(error, "status_code", None),
+                  getattr(getattr(error, "response", None), "status_code", None)):
+        if value == 429:
+            return True
+    return type(error).__name__ in ("ResourceExhausted", "TooManyRequests")
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """seconds the provider asked us to wait, if it said so"""
+    value = getattr(error, "retry_after", None)
+    if value is None:
+        headers = getattr(getattr(error, "response", None), "headers", None) or {}
+        value = headers.get("Retry-After") if hasattr(headers, "get") else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None # an http date, fall back to our own backoff
+
+
+class TokenBucket:
+    """
+    Token bucket whose rate adapts to the provider: it is halved on every
+    429 (down to a tenth of the configured rate) and creeps back up by a
+    tenth on every successful call. Waiting callers reserve their token up
+    front, so they are served in arrival order.
+    """
+    def __init__(self, rpm: float, burst: int, clock: Callable[[], float] = time.monotonic):
+        self.max_rate = rpm / 60
+        self.rate = self.max_rate
+        self.burst = max(burst, 1)
+        self.clock = clock
+        self.tokens = float(self.burst)
+        self.updated = clock()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        """take a token, returns how many seconds the caller has to wait before using it"""
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    def throttle(self, delay: Optional[float], attempt: int) -> float:
+        """back off after a 429, returns the delay before the next call"""
+        with self._lock:
+            self.rate = max(self.rate / 2, self.max_rate / 10)
+            if delay is None:
+                # exponential with full jitter, so throttled callers spread out
+                delay = random.uniform(0, min(60.0, 2.0 ** attempt))
+            self.blocked_until = max(self.blocked_until, self.clock() + delay)
+            return delay
+
+    def recover(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+
+class _Limiter:
+    def __init__(self, limit: ProviderLimit):
+        self.bucket = TokenBucket(limit.rpm, limit.burst)
+        self.slots = threading.BoundedSemaphore(limit.concurrency) if limit.concurrency else None
+
+
+class RateLimiter:
+    """
+    Shared limiter for every call to an external provider, with a token
+    bucket (and optionally a concurrency limit) per provider and model. A
+    call that gets a 429 slows the bucket down, waits for the provider's
+    Retry-After or an exponential backoff, and is sent again.
+    """
+    def __init__(self, limits: Optional[Dict[str, ProviderLimit]] = None, retries: int = RATE_LIMIT_RETRIES):
+        self.limits = {**DEFAULT_LIMITS, **RATE_LIMITS} if limits is None else limits
+        self.retries = retries
+        self._limiters: Dict[Tuple[str, str], _Limiter] = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, provider: str, model: str) -> _Limiter:
+        with self._lock:
+            limiter = self._limiters.get((provider, model))
+            if limiter is None:
+                limit = self.limits.get(f"{provider}/{model}") or self.limits.get(provider)
+                if limit is None:
+                    raise ValueError(f"No rate limit configured for {provider}")
+                limiter = self._limiters[(provider, model)] = _Limiter(limit)
+            return limiter
+
+    def _acquire(self, limiter: _Limiter, labels: Dict[str, str]) -> None:
+        queue_depth.inc(**labels)
+        started = time.perf_counter()
+        try:
+            delay = limiter.bucket.reserve()
+            if delay > 0:
+                time.sleep(delay)
+            if limiter.slots is not None:
+                limiter.slots.acquire()
+        finally:
+            queue_depth.dec(**labels)
+        wait_seconds.observe(time.perf_counter() - started, **labels)
+
+    def call(self, provider: str, model: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Call fn once the limit allows it, retrying it after 429s."""
+        limiter = self.limiter(provider, model)
+        labels = {"provider": provider, "model": model}
+        attempt = 0
+        while True:
+            self._acquire(limiter, labels)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                if not is_rate_limited(e) or attempt >= self.retries:
+                    raise
+                delay = limiter.bucket.throttle(retry_after(e), attempt)
+                backoff_seconds.observe(delay, **labels)
+                print(f"{provider} {model} is rate limited, retrying in {delay:.1f}s")
+                attempt += 1
+                continue
+            else:
+                limiter.bucket.recover()
+                return result
+            finally:
+                if limiter.slots is not None:
+                    limiter.slots.release()
+                current_rate.set(round(limiter.bucket.rate, 4), **labels)
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,141 @@
+"""
+Quality gate for rendered segments. Kling sometimes returns a clip that is
+frozen, black, glitched or cut short, and the next segment starts from its
+last frame, so a bad segment spoils every one after it. Each segment is
+checked as soon as it is downloaded, in the same decode that takes its
+last frame, and rendered again when it fails.
+
+Sampled frames are reduced to 64-bit difference hashes (dHash): a frame
+shrunk to 9x8 gray pixels, one bit per horizontal neighbour pair. Hashes
+of similar frames differ in a few bits, so the Hamming distances between
+them tell a frozen clip (no change) from a glitch (one sudden jump) from
+normal motion, for all the samples at once.
+
+    results = analyze(path, [VideoInfo(path), TailFrame(), SegmentQuality()])
+    report = check_segment(results["segment_quality"], results["metadata"], expected_duration=5)
+"""
+import os
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from ..models.schemas import Metadata
+from .media_analysis import _Sampler
+
+# renders per segment, the first included, until one passes
+SEGMENT_ATTEMPTS = int(os.environ.get("SEGMENT_ATTEMPTS", "2"))
+# seconds a Kling render lasts
+SEGMENT_SECONDS = float(os.environ.get("SEGMENT_SECONDS", "5"))
+# a segment this much shorter or longer was cut or padded
+DURATION_TOLERANCE = 0.5
+# mean luma (0 to 1) under which, with little contrast, a frame is black
+BLACK_LUMA = 0.06
+BLACK_CONTRAST = 0.03
+MAX_BLACK_SHARE = 0.25
+# hashes this close are the same picture; a freeze longer than this share
+# of the segment fails it
+FROZEN_DISTANCE = 2
+MAX_FROZEN_SHARE = 0.5
+# mean distance between all pairs of samples under which the whole segment
+# is near-duplicate frames
+MIN_DIVERSITY = 3.0
+# a jump between samples counts as a glitch when it is this large and this
+# many times the segment's typical change
+GLITCH_DISTANCE = 20
+GLITCH_RATIO = 4.0
+
+
+class SegmentReport(NamedTuple):
+    passed: bool
+    problems: List[str]
+    stats: Dict
+
+
+def dhash(gray: np.ndarray) -> np.ndarray:
+    """64-bit difference hashes of a stack of 8x9 gray images, as uint64"""
+    bits = gray[:, :, 1:] > gray[:, :, :-1]
+    return np.packbits(bits.reshape(len(gray), 64), axis=1).view(">u8").ravel().astype(np.uint64)
+
+
+def hamming(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """bits that differ between hashes, broadcast"""
+    xor = np.bitwise_xor(a, b)
+    return np.unpackbits(xor[..., None].view(np.uint8), axis=-1).sum(axis=-1)
+
+
+class SegmentQuality(_Sampler):
+    """Hashes and brightness of the sampled frames of a segment."""
+    name = "segment_quality"
+
+    def __init__(self, rate: float = 8.0):
+        super().__init__(rate)
+        self.thumbs: List[np.ndarray] = []
+        self.luma: List[Tuple[float, float]] = []
+
+    def sample(self, t: float, frame: np.ndarray) -> None:
+        small = cv2.cvtColor(cv2.resize(frame, (64, max(1, frame.shape[0] * 64 // frame.shape[1])),
+                                        interpolation=cv2.INTER_AREA), cv2.COLOR_RGB2GRAY)
+        self.luma.append((small.mean() / 255, small.std() / 255))
+        self.thumbs.append(cv2.resize(small, (9, 8), interpolation=cv2.INTER_AREA))
+
+    def finish(self) -> Dict[str, np.ndarray]:
+        return {
+            "hashes": dhash(np.stack(self.thumbs)) if self.thumbs else np.zeros(0, dtype=np.uint64),
+            "luma": np.array(self.luma, dtype=np.float32).reshape(-1, 2),
+        }
+
+
+def _longest_run(flags: np.ndarray) -> int:
+    """length of the longest run of True"""
+    if not flags.any():
+        return 0
+    # starts and ends of the runs, from the edges of the padded array
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], flags.astype(np.int8), [0]])))
+    return int((edges[1::2] - edges[::2]).max())
+
+
+def check_segment(samples: Dict[str, np.ndarray], metadata: Metadata, expected_duration: Optional[float] = None,
+                  expected_size: Optional[Tuple[int, int]] = None) -> SegmentReport:
+    """the problems of a segment, from its sampled frames and decoded metadata"""
+    expected_duration = SEGMENT_SECONDS if expected_duration is None else expected_duration
+    problems = []
+    hashes, luma = samples["hashes"], samples["luma"]
+    count = len(hashes)
+    steps = hamming(hashes[1:], hashes[:-1])
+    pairs = hamming(hashes[:, None], hashes[None, :])
+    diversity = float(pairs.sum() / max(1, count * (count - 1)))
+    black = (luma[:, 0] <= BLACK_LUMA) & (luma[:, 1] <= BLACK_CONTRAST)
+    frozen_run = _longest_run(steps <= FROZEN_DISTANCE)
+    typical = float(np.median(steps)) if len(steps) else 0.0
+    glitches = int(((steps >= GLITCH_DISTANCE) & (steps >= GLITCH_RATIO * max(typical, 1))).sum())
+    duration = metadata.duration if metadata.duration is not None else metadata.duration_seconds
+    size = (metadata.resolution.width, metadata.resolution.height)
+
+    if count < 2:
+        problems.append(f"only {count} frames could be decoded")
+    if abs(duration - expected_duration) > DURATION_TOLERANCE:
+        problems.append(f"lasts {duration:.2f}s instead of {expected_duration:g}s")
+    if expected_size is not None and size != tuple(expected_size):
+        problems.append(f"is {size[0]}x{size[1]} instead of {expected_size[0]}x{expected_size[1]}")
+    if count and black.mean() > MAX_BLACK_SHARE:
+        problems.append(f"{black.mean():.0%} of its frames are black")
+    if len(steps) and frozen_run / len(steps) > MAX_FROZEN_SHARE:
+        problems.append(f"is frozen for {frozen_run / len(steps):.0%} of its length")
+    elif count > 1 and diversity < MIN_DIVERSITY:
+        problems.append(f"its frames are near duplicates (mean hash distance {diversity:.1f} bits)")
+    if glitches:
+        problems.append(f"has {glitches} sudden jumps between frames")
+    return SegmentReport(
+        passed=not problems,
+        problems=problems,
+        stats={
+            "duration": round(float(duration), 3),
+            "resolution": list(size),
+            "samples": count,
+            "black_share": round(float(black.mean()), 3) if count else None,
+            "frozen_share": round(frozen_run / len(steps), 3) if len(steps) else None,
+            "diversity": round(diversity, 2),
+            "glitches": glitches,
+        },
+    )
@@ -0,0 +1,110 @@
+"""
+Smart rendering of the text overlays. The watermarked video is a fragmented
+mp4 with one fragment per keyframe, so only the fragments a text is on
+screen in have to be decoded and encoded again; the others are copied into
+the output as they are, and the two kinds are spliced at keyframes with the
+same appender that joins the parts.
+
+For the splice to work the parts must be encoded with the final profile
+(the copied fragments end up in the output) and with a keyframe every
+SMART_RENDER_GOP_SECONDS, which bounds how much is encoded again around
+each text:
+
+    encode_segment_part(segment, sprite, size, part, profile, keyframe_params())
+    stats = smart_render(watermarked, text_clips, output, profile)
+
+smart_render raises ValueError when the video can't be spliced (it is not
+fragmented, or its fragments were encoded with other settings), the caller
+then encodes the whole video.
+"""
+import os
+import shutil
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from moviepy import CompositeVideoClip, TextClip
+
+from .encoding import EncodeProfile
+from .fmp4 import FRAGMENTED_MP4_FLAGS, FragmentedMp4Appender, Fragment, fragments, write_fragments
+from .helpers import concat_parts, open_video
+from .metrics import timed
+
+# "1" encodes the parts with the final profile and regular keyframes and
+# re-encodes only the text overlay ranges
+SMART_RENDER = os.environ.get("SMART_RENDER", "0") == "1"
+# seconds between the keyframes of the parts, the granularity of the ranges
+# that are encoded again
+SMART_RENDER_GOP_SECONDS = float(os.environ.get("SMART_RENDER_GOP_SECONDS", "1"))
+
+
+def keyframe_params(seconds: Optional[float] = None) -> List[str]:
+    """ffmpeg options for a keyframe at every multiple of the GOP length"""
+    seconds = SMART_RENDER_GOP_SECONDS if seconds is None else seconds
+    return ["-force_key_frames", f"expr:gte(t,n_forced*{seconds:g})"]
+
+
+def touched_ranges(clips: Sequence[TextClip], duration: float) -> List[Tuple[float, float]]:
+    """the merged (start, end) ranges in which one of the clips is on screen"""
+    ranges = []
+    for start, end in sorted((max(clip.start, 0), min(clip.end, duration)) for clip in clips):
+        if end <= start:
+            continue
+        if ranges and start <= ranges[-1][1]:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end))
+        else:
+            ranges.append((start, end))
+    return ranges
+
+
+def _spans(found: List[Fragment], timescale: int, ranges: List[Tuple[float, float]]) -> List[Tuple[bool, List[Fragment]]]:
+    """consecutive fragments grouped into (touched, fragments) spans"""
+    spans: List[Tuple[bool, List[Fragment]]] = []
+    for fragment in found:
+        start = (fragment.decode_time - found[0].decode_time) / timescale
+        end = start + fragment.duration / timescale
+        touched = any(a < end and start < b for a, b in ranges)
+        if spans and spans[-1][0] == touched:
+            spans[-1][1].append(fragment)
+        else:
+            spans.append((touched, [fragment]))
+    return spans
+
+
+def smart_render(video_path: str, text_clips: List[TextClip], output_path: str, profile: EncodeProfile) -> Dict:
+    """
+    Burn the text clips into a fragmented mp4, encoding only the keyframe
+    spans they appear in. Returns the seconds encoded again and copied.
+    """
+    with open(video_path, "rb") as f:
+        data = f.read()
+    timescale, found = fragments(data)
+    duration = (found[-1].decode_time + found[-1].duration - found[0].decode_time) / timescale
+    spans = _spans(found, timescale, touched_ranges(text_clips, duration))
+
+    work_dir = os.path.splitext(output_path)[0] + "_spans"
+    os.makedirs(work_dir, exist_ok=True)
+    appender = FragmentedMp4Appender(os.path.join(work_dir, "spliced.mp4"))
+    seconds = {"reencoded": 0.0, "copied": 0.0}
+    try:
+        with open_video(video_path, audio=False) as video:
+            for index, (touched, selected) in enumerate(spans):
+                span_path = os.path.join(work_dir, f"span_{index}.mp4")
+                start = (selected[0].decode_time - found[0].decode_time) / timescale
+                end = start + sum(fragment.duration for fragment in selected) / timescale
+                if touched:
+                    shown = [clip.with_start(clip.start - start) for clip in text_clips if clip.start < end and start < clip.end]
+                    # the composite doesn't close the clips it is made of
+                    with CompositeVideoClip([video.subclipped(start, end), *shown]) as composite:
+                        with timed("moviepy_encode", step="text_span", profile=profile.name):
+                            composite.write_videofile(span_path, **profile.write_options(
+                                *FRAGMENTED_MP4_FLAGS, *keyframe_params(), audio=False))
+                else:
+                    with timed("fmp4_copy"):
+                        write_fragments(data, selected, span_path)
+                # a re-encoded span with other settings than the copied ones raises here
+                appender.append(span_path)
+                seconds["reencoded" if touched else "copied"] += end - start
+        # the spliced file is fragmented, remux it to a plain mp4 like the full encode writes
+        concat_parts([appender.output_path], output_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {key: round(value, 3) for key, value in seconds.items()}
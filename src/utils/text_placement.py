@@ -0,0 +1,201 @@
+"""
+Local placement of text overlays. Instead of uploading the final video to
+Gemini and asking where the texts should go, the model only writes the
+copy and timing, and the position and colour of each text are chosen here
+from the video itself.
+
+One sampled pass measures, for a small grid of pixels over time, the
+motion energy (the change from the previous sample) and the background
+colour. Every candidate position of a text is then scored at once with
+summed area tables: calm areas whose colour contrasts with one of the
+candidate text colours throughout the text's time on screen win. Texts on
+screen at the same time don't overlap, and none covers the watermark.
+
+    stats = analyze(path, [BackgroundStats()])["background"]
+    overlays = place_texts(stats, copies, (1280, 720), palette)
+"""
+import math
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+from PIL import ImageFont
+
+from .brand_analytics import hex_to_rgb
+from .helpers import FONT_SIZES, FONTS, watermark_box
+from .media_analysis import StreamInfo, _Sampler
+
+# "model" uploads the final video for Gemini to place the texts, "local"
+# places them with place_texts
+DEFAULT_TEXT_PLANNER = os.environ.get("TEXT_PLANNER", "model")
+# centres tried for each text, in percent of the frame
+CANDIDATE_X = (20.0, 35.0, 50.0, 65.0, 80.0)
+CANDIDATE_Y = tuple(float(y) for y in range(10, 95, 5))
+# how much a unit of motion (mean change of luma, 0 to 1) and of background
+# busyness (luma standard deviation) cost against a unit of contrast,
+# where contrast is scored up to 7:1
+MOTION_WEIGHT = 4.0
+BUSY_WEIGHT = 2.0
+# the centre of the frame reads first, a small pull towards it breaks ties
+CENTRE_WEIGHT = 0.1
+# WCAG AA contrast for text, a brand colour that reaches it is used
+READABLE_CONTRAST = 4.5
+# text colours tried after the brand palette
+NEUTRAL_COLORS = ((255, 255, 255), (20, 20, 20))
+# the stats grid is this many pixels wide
+GRID_WIDTH = 96
+
+
+class BackgroundStats(_Sampler):
+    """Luma, colour and motion of a small grid over the sampled frames."""
+    name = "background"
+
+    def __init__(self, rate: float = 4.0):
+        super().__init__(rate)
+        self.times: List[float] = []
+        self.colors: List[np.ndarray] = []
+
+    def start(self, info: StreamInfo) -> None:
+        super().start(info)
+        self.size = (GRID_WIDTH, max(1, round(info.height * GRID_WIDTH / info.width)))
+
+    def sample(self, t: float, frame: np.ndarray) -> None:
+        self.times.append(t)
+        self.colors.append(cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA))
+
+    def finish(self) -> Dict[str, np.ndarray]:
+        colors = np.stack(self.colors).astype(np.float32) / 255
+        luma = colors @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+        motion = np.zeros_like(luma)
+        motion[1:] = np.abs(np.diff(luma, axis=0))
+        # the first sample has no predecessor, it moves like the second
+        if len(motion) > 1:
+            motion[0] = motion[1]
+        return {"times": np.array(self.times), "colors": colors, "luma": luma, "motion": motion}
+
+
+def _integral(values: np.ndarray) -> np.ndarray:
+    """summed area table over the two axes after the first, padded with a leading zero row and column"""
+    table = values.cumsum(axis=1).cumsum(axis=2)
+    pad = [(0, 0), (1, 0), (1, 0)] + [(0, 0)] * (values.ndim - 3)
+    return np.pad(table, pad)
+
+
+def _box_means(table: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """mean of every (x0, y0, x1, y1) box at every time, shape (times, boxes, ...)"""
+    x0, y0, x1, y1 = boxes.T
+    total = table[:, y1, x1] - table[:, y0, x1] - table[:, y1, x0] + table[:, y0, x0]
+    area = ((x1 - x0) * (y1 - y0)).astype(np.float32)
+    return total / area.reshape((1, -1) + (1,) * (total.ndim - 2))
+
+
+def relative_luminance(rgb: np.ndarray) -> np.ndarray:
+    """WCAG relative luminance of sRGB values in 0..1, shape (..., 3)"""
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    return linear @ np.array([0.2126, 0.7152, 0.0722], dtype=np.float32)
+
+
+def contrast_ratio(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """WCAG contrast ratio between relative luminances, broadcast"""
+    return (np.maximum(a, b) + 0.05) / (np.minimum(a, b) + 0.05)
+
+
+def text_size(text: str, font: str, font_size: str, frame_width: int, portrait: bool = False) -> Tuple[int, int]:
+    """pixel size of a rendered text overlay, like fade_in_text lays it out"""
+    pixels = FONT_SIZES[font_size.strip().lower()]
+    try:
+        left, top, right, bottom = ImageFont.truetype(FONTS[font.strip().lower()], pixels).getbbox(text)
+        width, height = right - left, bottom - top
+    except OSError:
+        # the fonts are missing, an average glyph is a bit over half an em
+        width, height = round(len(text) * pixels * 0.55), pixels
+    # the clips have a 10 pixel margin and a stroke
+    width, height = width + 24, height + 24
+    if portrait:
+        # captions wrap at the frame width
+        lines = math.ceil(width / max(1, frame_width - 10))
+        width, height = min(width, frame_width - 10), height * lines
+    return width, height
+
+
+def _overlaps(box: Sequence[float], boxes: np.ndarray) -> np.ndarray:
+    return ((boxes[:, 0] < box[2]) & (box[0] < boxes[:, 2]) & (boxes[:, 1] < box[3]) & (box[1] < boxes[:, 3]))
+
+
+def place_texts(stats: Dict[str, np.ndarray], copies: List[Dict], frame_size: Tuple[int, int],
+                palette: Sequence[str] = (), portrait: bool = False,
+                logo_size: Optional[Tuple[int, int]] = None) -> Dict:
+    """
+    Text overlays for the given copies (text, text_duration, font, font_size),
+    each with the calm, contrasted position and the colour chosen for it.
+    logo_size is the size of the logo image, for the shape of the watermark.
+    The result has the schema of TextOverlays.
+    """
+    width, height = frame_size
+    grid_height, grid_width = stats["luma"].shape[1:]
+    scale = np.array([grid_width / width, grid_height / height] * 2)
+    luma, colors, motion, times = stats["luma"], stats["colors"], stats["motion"], stats["times"]
+    luma_table, square_table = _integral(luma), _integral(luma ** 2)
+    color_table, motion_table = _integral(colors), _integral(motion)
+    text_colors = [hex_to_rgb(color) for color in palette] + list(NEUTRAL_COLORS)
+    text_luminance = relative_luminance(np.array(text_colors, dtype=np.float32) / 255)
+
+    centres = np.array([(x, y) for y in CANDIDATE_Y for x in CANDIDATE_X])
+    watermark = watermark_box(frame_size, logo_size)
+    placed: List[Tuple[Tuple[float, float, float, float], float, float]] = []
+    overlays = []
+    for copy in copies:
+        start, end = copy["text_duration"]["start"], copy["text_duration"]["end"]
+        box_width, box_height = text_size(copy["text"], copy["font"], copy["font_size"], width, portrait)
+        # fade_in_text centres the clip on the position, without going off the top or left edge
+        x0 = np.maximum(centres[:, 0] * width / 100 - box_width / 2, 0)
+        y0 = np.maximum(centres[:, 1] * height / 100 - box_height / 2, 0)
+        boxes = np.stack([x0, y0, x0 + box_width, y0 + box_height], axis=1)
+        free = np.ones(len(boxes), dtype=bool)
+        for other, other_start, other_end in placed:
+            if other_start < end and start < other_end:
+                free &= ~_overlaps(other, boxes)
+        allowed = free & (boxes[:, 2] <= width) & (boxes[:, 3] <= height) & ~_overlaps(watermark, boxes)
+        # a text too big for the frame still avoids the others if it can
+        for fallback in (free, np.ones_like(free)):
+            if allowed.any():
+                break
+            allowed = fallback
+        # the boxes on the stats grid, at least one cell each
+        low = np.clip(np.floor(boxes[:, :2] * scale[:2]), 0, [grid_width - 1, grid_height - 1])
+        high = np.clip(np.ceil(boxes[:, 2:] * scale[2:]), low + 1, [grid_width, grid_height])
+        grid_boxes = np.concatenate([low, high], axis=1).astype(int)
+
+        # the samples while the text is on screen, at least the nearest one
+        during = (times >= start) & (times <= end)
+        if not during.any():
+            during[np.abs(times - (start + end) / 2).argmin()] = True
+        index = np.nonzero(during)[0]
+        box_luma = _box_means(luma_table[index], grid_boxes)
+        busy = np.sqrt(np.maximum(_box_means(square_table[index], grid_boxes) - box_luma ** 2, 0)).mean(axis=0)
+        box_motion = _box_means(motion_table[index], grid_boxes).mean(axis=0)
+        background = relative_luminance(np.clip(_box_means(color_table[index], grid_boxes), 0, 1))
+        # the worst moment decides how readable a colour is: (boxes, colors)
+        contrast = contrast_ratio(background[..., None], text_luminance).min(axis=0)
+        # the first colour that is readable enough, so brand colours come
+        # before the neutral ones; a position is scored with the colour it
+        # would be drawn in
+        best_color = np.minimum(contrast, READABLE_CONTRAST).argmax(axis=1)
+        best_contrast = np.minimum(contrast[np.arange(len(contrast)), best_color], 7) / 7
+        off_centre = np.abs(centres - 50).sum(axis=1) / 100
+        score = best_contrast - MOTION_WEIGHT * box_motion - BUSY_WEIGHT * busy - CENTRE_WEIGHT * off_centre
+        score[~allowed] = -np.inf
+        choice = int(score.argmax())
+
+        placed.append((tuple(boxes[choice]), start, end))
+        r, g, b = text_colors[best_color[choice]]
+        overlays.append({
+            "text": copy["text"],
+            "text_duration": {"start": start, "end": end},
+            "position": {"x": float(centres[choice, 0]), "y": float(centres[choice, 1])},
+            "font_size": copy["font_size"],
+            "font": copy["font"],
+            "color": f"rgb({r},{g},{b})",
+        })
+    return {"texts": overlays}
@@ -0,0 +1,101 @@
+"""
+Worker process of a queue deployment. The API enqueues jobs when JOB_QUEUE
+is set, and every worker started with the same JOB_QUEUE and VIDEO_DB_PATH
+claims them one at a time and runs the video pipeline:
+
+    JOB_QUEUE=sqlite VIDEO_DB_PATH=/shared/video_responses.db python -m src.worker
+
+The data/ and tmp/ directories under the working directory must be the
+API's too, on a shared volume like the database, for the previews and for
+resuming another worker's jobs from their files.
+"""
+import argparse
+import os
+import signal
+import socket
+import threading
+import uuid
+from typing import Optional
+
+from .models.schemas import VideoRequest
+from .services.video_pipeline import run_video_pipeline
+from .utils.db_helpers import init_db, set_job_status, set_cached_response_id
+from .utils.job_queue import JOB_LEASE_SECONDS, JOB_QUEUE, JobQueue, QueuedJob, get_job_queue
+
+
+class Worker:
+    def __init__(self, queue: JobQueue, worker_id: Optional[str] = None, lease_seconds: float = JOB_LEASE_SECONDS, poll_interval: float = 2.0):
+        self.queue = queue
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.stopping = threading.Event()
+
+    def run(self) -> None:
+        """Claim and run jobs until stop() is called, finishing the current one first."""
+        print(f"Worker {self.worker_id} waiting for jobs")
+        while not self.stopping.is_set():
+            if not self.run_once():
+                self.stopping.wait(self.poll_interval)
+        print(f"Worker {self.worker_id} stopped")
+
+    def stop(self, *_) -> None:
+        self.stopping.set()
+
+    def run_once(self) -> bool:
+        """Run the next job if there is one, returns whether there was."""
+        job = self.queue.claim(self.worker_id, self.lease_seconds)
+        if job is None:
+            return False
+        print(f"Worker {self.worker_id} claimed job {job.job_id} (attempt {job.attempts})")
+        finished = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job, finished), name="job-heartbeat", daemon=True)
+        heartbeat.start()
+        try:
+            self._process(job)
+        finally:
+            finished.set()
+            heartbeat.join()
+        return True
+
+    def _heartbeat(self, job: QueuedJob, finished: threading.Event) -> None:
+        while not finished.wait(self.lease_seconds / 3):
+            if not self.queue.heartbeat(job.job_id, self.worker_id, self.lease_seconds):
+                # the pipeline can't be interrupted, it keeps going and its
+                # result is dropped by complete()
+                print(f"Worker {self.worker_id} lost the lease of job {job.job_id}")
+                return
+
+    def _process(self, job: QueuedJob) -> None:
+        set_job_status(job.job_id, job.fingerprint, "running")
+        try:
+            request = VideoRequest.model_validate_json(job.request_data)
+            response = run_video_pipeline(request, job.job_id)
+        except Exception as e:
+            print(f"Job {job.job_id} failed: {e}")
+            set_job_status(job.job_id, job.fingerprint, "failed")
+            self.queue.fail(job.job_id, self.worker_id, str(e))
+            return
+        set_job_status(job.job_id, job.fingerprint, "completed")
+        set_cached_response_id(job.fingerprint, response.identifier)
+        if not self.queue.complete(job.job_id, self.worker_id, response.identifier):
+            print(f"Job {job.job_id} finished after its lease was taken over")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queue", default=JOB_QUEUE or "sqlite", help="queue implementation (default: JOB_QUEUE or sqlite)")
+    parser.add_argument("--worker-id", help="defaults to host, pid and a random suffix")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="seconds between claims while the queue is empty")
+    args = parser.parse_args()
+
+    init_db()
+    worker = Worker(get_job_queue(args.queue), args.worker_id, poll_interval=args.poll_interval)
+    # finish the running job on a normal shutdown, its lease covers a crash
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run()
+
+
+if __name__ == "__main__":
+    main()
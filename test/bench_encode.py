@@ -0,0 +1,79 @@
+"""
+Encode time against file size for every encode profile.
+
+A synthetic clip is encoded once per profile the same way the final video
+is written (moviepy write_videofile with the profile's options), and the
+wall time and output size are printed as a table and a text chart.
+
+    python test/bench_encode.py --width 1280 --height 720 --duration 10
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from replay import synthesize_video
+
+
+def encode(source, output_path, profile):
+    from src.utils.helpers import open_video
+
+    started = time.perf_counter()
+    with open_video(source) as clip:
+        clip.write_videofile(output_path, logger=None, **profile.write_options(audio=False))
+    return time.perf_counter() - started
+
+
+def bar(value, largest, width=30):
+    return "#" * max(1, round(width * value / largest)) if largest else ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--workdir", help="scratch directory (defaults to a temporary directory)")
+    parser.add_argument("--json", action="store_true", help="print the results as json")
+    args = parser.parse_args()
+
+    from src.utils.encoding import INTERMEDIATE, PROFILES
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_encode_")
+    source = synthesize_video(os.path.join(workdir, "source.mp4"), args.width, args.height, args.duration, seed=7)
+
+    results = []
+    for profile in (*PROFILES.values(), INTERMEDIATE):
+        output_path = os.path.join(workdir, f"{profile.name}.mp4")
+        seconds = encode(source, output_path, profile)
+        results.append({
+            "profile": profile.name,
+            "preset": profile.preset,
+            "crf": profile.crf,
+            "encode_s": round(seconds, 3),
+            "size_mb": round(os.path.getsize(output_path) / 2**20, 3),
+        })
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.width}x{args.height}, {args.duration:g}s, {os.cpu_count()} cpus")
+    print()
+    print(f"{'profile':<14} {'preset':<10} {'crf':>4} {'encode s':>9} {'size MB':>9}")
+    for result in results:
+        print(f"{result['profile']:<14} {result['preset']:<10} {result['crf']:>4} {result['encode_s']:>9.2f} {result['size_mb']:>9.2f}")
+    longest = max(result["encode_s"] for result in results)
+    largest = max(result["size_mb"] for result in results)
+    print()
+    print(f"{'':<14} {'encode time':<31} size")
+    for result in results:
+        print(f"{result['profile']:<14} {bar(result['encode_s'], longest):<31} {bar(result['size_mb'], largest)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+One decode pass against opening the video once per output.
+
+A synthetic clip is analyzed for metadata, the tail frame, a contact sheet,
+a poster, palette stats and a scoring proxy. The analyzer decodes it once
+for all of them. The baseline opens it separately for each output, the
+way the helpers do (OpenCV for metadata and the tail frame, moviepy for
+the rest).
+
+    python test/bench_media_analysis.py --duration 60
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from replay import synthesize_video
+
+
+def separate_opens(path, workdir):
+    import cv2
+    from src.utils.helpers import get_last_frame, get_video_metadata, open_video
+    from src.utils.media_analysis import PaletteStats, Poster
+
+    timings = {}
+
+    def timed(name, fn):
+        started = time.perf_counter()
+        fn()
+        timings[name] = time.perf_counter() - started
+
+    def contact_sheet():
+        with open_video(path, audio=False) as clip:
+            for i in range(12):
+                cv2.resize(clip.get_frame((i + 0.5) * clip.duration / 12), (240, 135))
+
+    def sampled(consumer):
+        def run():
+            with open_video(path, audio=False) as clip:
+                for frame in clip.iter_frames(fps=consumer.rate, dtype="uint8"):
+                    consumer.sample(0.0, frame)
+        return run
+
+    def proxy():
+        with open_video(path, audio=False) as clip:
+            clip.resized(width=480).write_videofile(os.path.join(workdir, "proxy_baseline.mp4"), fps=8, preset="veryfast",
+                                                   audio=False, logger=None)
+
+    timed("metadata", lambda: get_video_metadata(path))
+    timed("tail_frame", lambda: get_last_frame(path))
+    timed("contact_sheet", contact_sheet)
+    timed("poster", sampled(Poster()))
+    timed("palette", sampled(PaletteStats()))
+    timed("proxy", proxy)
+    return timings
+
+
+def single_pass(path, workdir):
+    from src.utils.media_analysis import ContactSheet, PaletteStats, Poster, ScoringProxy, TailFrame, VideoInfo, analyze
+
+    started = time.perf_counter()
+    analyze(path, [VideoInfo(path), TailFrame(), ContactSheet(), Poster(), PaletteStats(),
+                   ScoringProxy(os.path.join(workdir, "proxy.mp4"))])
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--duration", type=float, default=60.0)
+    parser.add_argument("--workdir", help="scratch directory (defaults to a temporary directory)")
+    parser.add_argument("--json", action="store_true", help="print the results as json")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_media_analysis_")
+    source = synthesize_video(os.path.join(workdir, "source.mp4"), args.width, args.height, args.duration, seed=7)
+
+    baseline = separate_opens(source, workdir)
+    analyzer = single_pass(source, workdir)
+    results = {
+        "separate_opens_s": {name: round(seconds, 3) for name, seconds in baseline.items()},
+        "separate_opens_total_s": round(sum(baseline.values()), 3),
+        "single_pass_s": round(analyzer, 3),
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.width}x{args.height}, {args.duration:g}s, {os.cpu_count()} cpus")
+    print()
+    for name, seconds in baseline.items():
+        print(f"{name:<16} {seconds:>8.2f}s")
+    print(f"{'separate opens':<16} {results['separate_opens_total_s']:>8.2f}s")
+    print(f"{'single pass':<16} {results['single_pass_s']:>8.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+API latency while media work runs, in the API process or in the media pool.
+
+The API is served by uvicorn in this process, like `python -m src.main`.
+A client in a separate process requests /metrics in a loop and records
+the latencies. Meanwhile threads watermark synthetic segments, the way the
+pipeline's threads do, once in the calling thread (MEDIA_POOL_WORKERS_PER_CORE=0)
+and once through the media pool. A run without renders gives the baseline.
+
+    python test/bench_media_pool.py --renders 2 --seconds 20
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from replay import synthesize_logo, synthesize_video
+
+
+def client(url, seconds):
+    """request url for some seconds, print the latencies in ms as json"""
+    import requests
+
+    latencies = []
+    session = requests.Session()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        session.get(url).raise_for_status()
+        latencies.append((time.perf_counter() - started) * 1000)
+        time.sleep(0.01)
+    print(json.dumps(latencies))
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def measure(url, seconds, renders, pool, task):
+    """latencies of the API while `renders` threads run the task through the pool"""
+    stop = threading.Event()
+
+    def render():
+        while not stop.is_set():
+            pool.run(task)
+
+    if pool.workers:
+        # start the workers before measuring
+        pool.run(task)
+    threads = [threading.Thread(target=render, daemon=True) for _ in range(renders)]
+    for thread in threads:
+        thread.start()
+    try:
+        output = subprocess.run([sys.executable, __file__, "--client", url, "--seconds", str(seconds)],
+                                check=True, capture_output=True, text=True).stdout
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    latencies = json.loads(output)
+    return {
+        "requests": len(latencies),
+        "p50_ms": round(percentile(latencies, 0.5), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+        "max_ms": round(max(latencies), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--renders", type=int, default=2, help="threads rendering at once")
+    parser.add_argument("--seconds", type=float, default=20.0, help="seconds of requests per run")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workdir", help="scratch directory (defaults to a temporary directory)")
+    parser.add_argument("--json", action="store_true", help="print the results as json")
+    parser.add_argument("--client", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.client:
+        return client(args.client, args.seconds)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_media_pool_")
+    os.environ.setdefault("VIDEO_DB_PATH", os.path.join(workdir, "video_responses.db"))
+    import uvicorn
+    from src.main import app
+    from src.utils.helpers import prepare_watermark
+    from src.utils.media_pool import MediaPool, WatermarkTask, pool_size
+
+    segment = synthesize_video(os.path.join(workdir, "segment.mp4"), args.width, args.height, 5.0)
+    sprite = prepare_watermark(synthesize_logo(os.path.join(workdir, "logo.png")), args.width,
+                               os.path.join(workdir, "sprite.png"))
+    task = WatermarkTask(segment, sprite, (args.width, args.height), os.path.join(workdir, "part.mp4"))
+
+    server = uvicorn.Server(uvicorn.Config(app, port=args.port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    url = f"http://127.0.0.1:{args.port}/metrics"
+
+    pool = MediaPool(pool_size())
+    results = {
+        "baseline": measure(url, args.seconds, 0, pool, task),
+        "in_process": measure(url, args.seconds, args.renders, MediaPool(0), task),
+        "media_pool": measure(url, args.seconds, args.renders, pool, task),
+    }
+    pool.shutdown()
+    server.should_exit = True
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.width}x{args.height}, {args.renders} renders, {pool.workers} workers, {os.cpu_count()} cpus")
+    print()
+    print(f"{'':<12} {'requests':>8} {'p50':>9} {'p99':>9} {'max':>9}")
+    for name, stats in results.items():
+        print(f"{name:<12} {stats['requests']:>8} {stats['p50_ms']:>7.1f}ms {stats['p99_ms']:>7.1f}ms {stats['max_ms']:>7.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+End-to-end offline benchmark of the request pipeline.
+
+By default the production stage graph (render -> upload/score/metadata ->
+persist -> notify) is run and timed per stage. With --mode direct,
+VideoGenerator.generate_video and VideoScorer.score_video are run one
+after the other instead, as before the stage graph existed.
+
+All external services are faked by test/replay.py, so only the local media
+pipeline (downloads from disk, moviepy encodes, frame extraction) does real
+work. Remote latency can be injected with --latency-scale.
+
+    python test/bench_pipeline.py --duration 10 --latency-scale 0
+    python test/bench_pipeline.py --cassette cassettes/run1   # replay a recording
+
+Memory: `peak_rss_mb` is ru_maxrss, the peak of the whole process lifetime
+so far (it never goes down between phases). Pass --trace-memory for the
+peak Python/NumPy heap of each phase, measured with tracemalloc (slower).
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from replay import OfflineServices, Replayer, offline_request, sample_request
+
+
+def _usage():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "cpu_s": own.ru_utime + own.ru_stime,
+        "child_cpu_s": children.ru_utime + children.ru_stime,
+        # ru_maxrss is reported in KiB on linux, and is a lifetime peak
+        "peak_rss_mb": own.ru_maxrss / 1024,
+        "child_peak_rss_mb": children.ru_maxrss / 1024,
+    }
+
+
+def measure(name, fn, report):
+    before = _usage()
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    started = time.perf_counter()
+    result = fn()
+    after = _usage()
+    report[name] = {
+        "wall_s": round(time.perf_counter() - started, 3),
+        "cpu_s": round(after["cpu_s"] - before["cpu_s"], 3),
+        "child_cpu_s": round(after["child_cpu_s"] - before["child_cpu_s"], 3),
+        "peak_rss_mb": round(after["peak_rss_mb"], 1),
+        "child_peak_rss_mb": round(after["child_peak_rss_mb"], 1),
+        # None unless --trace-memory, only then is there a per phase peak
+        "heap_peak_mb": round(tracemalloc.get_traced_memory()[1] / 2**20, 1) if tracemalloc.is_tracing() else None,
+    }
+    return result
+
+
+def summarize_timeline(spans):
+    totals = defaultdict(lambda: {"count": 0, "wall_s": 0.0})
+    for span in spans:
+        key = span.operation
+        if span.labels:
+            key += "{" + ",".join(f"{k}={v}" for k, v in sorted(span.labels.items())) + "}"
+        totals[key]["count"] += 1
+        totals[key]["wall_s"] = round(totals[key]["wall_s"] + span.duration, 3)
+    return dict(sorted(totals.items(), key=lambda item: -item[1]["wall_s"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=int, default=10, help="requested video duration in seconds")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--segment-width", type=int, default=640)
+    parser.add_argument("--segment-height", type=int, default=360)
+    parser.add_argument("--latency-scale", type=float, default=0.0, help="multiplier for the injected remote latency")
+    parser.add_argument("--mode", choices=("pipeline", "direct"), default="pipeline",
+                        help="run the stage graph, or generate_video then score_video")
+    parser.add_argument("--trace-memory", action="store_true", help="report the peak heap of each phase with tracemalloc")
+    parser.add_argument("--cassette", help="replay a cassette recorded with replay.Recorder instead of the fakes")
+    parser.add_argument("--workdir", help="scratch directory (defaults to a temporary directory)")
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_pipeline_")
+    if args.cassette:
+        services = Replayer(args.cassette, workdir, latency_scale=args.latency_scale)
+        # the recorded downloads are keyed by the urls of the recorded request
+        request = services.request or sample_request(args.duration, args.width, args.height)
+    else:
+        services = OfflineServices(workdir, segment_size=(args.segment_width, args.segment_height), latency_scale=args.latency_scale)
+        request = offline_request(services, duration=args.duration, width=args.width, height=args.height)
+
+    # run inside the scratch directory so tmp/ and data/ don't pollute the repo
+    repo_root = Path(__file__).parent.parent.resolve()
+    os.makedirs(os.path.join(workdir, "resources"), exist_ok=True)
+    for font in (repo_root / "resources").glob("*.ttf"):
+        target = Path(workdir) / "resources" / font.name
+        if not target.exists():
+            target.symlink_to(font)
+    os.chdir(workdir)
+
+    from src.services.video_generator import VideoGenerator
+    from src.services.video_pipeline import build_video_pipeline
+    from src.services.video_scorer import VideoScorer
+    from src.utils.db_helpers import init_db
+    from src.utils.metrics import job_timeline
+
+    init_db()
+    if args.trace_memory:
+        tracemalloc.start()
+    report = {}
+    with services.install(), job_timeline() as timeline:
+        if args.mode == "pipeline":
+            pipeline = build_video_pipeline(request, timeline=timeline)
+            measure("pipeline", pipeline.run, report)
+            report["stages"] = {name: timing.model_dump() for name, timing in pipeline.timings.items()}
+        else:
+            generator = VideoGenerator(request)
+            video_path, video_url = measure("generate_video", generator.generate_video, report)
+            scorer = VideoScorer(request, video_path, job_id=generator.job_id)
+            measure("score_video", scorer.score_video, report)
+    phases = ["pipeline"] if args.mode == "pipeline" else ["generate_video", "score_video"]
+
+    report["operations"] = summarize_timeline(timeline.to_list())
+    report["remote_calls"] = dict(services.calls)
+    report["workdir"] = workdir
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    for phase in phases:
+        stats = report[phase]
+        heap = f"  heap peak {stats['heap_peak_mb']:>7.1f}MB" if stats["heap_peak_mb"] is not None else ""
+        print(f"{phase:<16} wall {stats['wall_s']:>8.2f}s  cpu {stats['cpu_s']:>7.2f}s  "
+              f"ffmpeg cpu {stats['child_cpu_s']:>7.2f}s{heap}")
+    # lifetime peaks, not per phase
+    stats = report[phases[-1]]
+    print(f"process peak rss {stats['peak_rss_mb']:.1f}MB  ffmpeg peak rss {stats['child_peak_rss_mb']:.1f}MB (lifetime)")
+    if "stages" in report:
+        print()
+        print(f"{'stage':<12} {'start s':>9} {'end s':>9} {'wall s':>9}")
+        for name, timing in report["stages"].items():
+            print(f"{name:<12} {timing['start']:>9.3f} {timing['end']:>9.3f} {timing['duration']:>9.3f}")
+    print()
+    print(f"{'operation':<60} {'count':>5} {'wall s':>9}")
+    for name, stats in report["operations"].items():
+        print(f"{name:<60} {stats['count']:>5} {stats['wall_s']:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Latency of reading a video's metadata without decoding it.
+
+Compares the OpenCV capture get_video_metadata used to open, the moov box
+probe, `ffmpeg -i` and a cached probe, on a synthetic clip with its moov
+box at the end (how moviepy writes it) and at the start (faststart).
+
+    python test/bench_probe.py --duration 30 --repeat 50
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from replay import synthesize_video
+
+
+def opencv_metadata(path):
+    import cv2
+    from src.utils.helpers import open_capture
+
+    with open_capture(path) as cap:
+        return (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                int(cap.get(cv2.CAP_PROP_FRAME_COUNT) / cap.get(cv2.CAP_PROP_FPS)))
+
+
+def measure(fn, path, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn(path)
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--workdir", help="scratch directory (defaults to a temporary directory)")
+    parser.add_argument("--json", action="store_true", help="print the results as json")
+    args = parser.parse_args()
+
+    import imageio_ffmpeg
+    from src.utils import probe as probe_module
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_probe_")
+    moov_at_end = synthesize_video(os.path.join(workdir, "source.mp4"), args.width, args.height, args.duration, seed=7)
+    faststart = os.path.join(workdir, "faststart.mp4")
+    subprocess.run([imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-loglevel", "error", "-i", moov_at_end, "-c", "copy",
+                    "-movflags", "+faststart", faststart], check=True)
+
+    def uncached(path):
+        probe_module._cache = probe_module._ProbeCache()
+        return probe_module.probe(path)
+
+    probes = {
+        "opencv": opencv_metadata,
+        "moov": probe_module.probe_mp4,
+        "ffmpeg -i": probe_module.probe_ffmpeg,
+        "probe, uncached": uncached,
+        "probe, cached": probe_module.probe,
+    }
+    results = {
+        name: {layout: round(measure(fn, path, args.repeat), 3) for layout, path in (("moov at end", moov_at_end), ("faststart", faststart))}
+        for name, fn in probes.items()
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.width}x{args.height}, {args.duration:g}s, mean of {args.repeat} runs in ms")
+    print()
+    print(f"{'':<18} {'moov at end':>12} {'faststart':>12}")
+    for name, timings in results.items():
+        print(f"{name:<18} {timings['moov at end']:>12.3f} {timings['faststart']:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Text overlay by smart rendering against encoding the whole video.
+
+Synthetic segments are watermarked into fragmented parts with the final
+profile and a keyframe every SMART_RENDER_GOP_SECONDS, and appended into
+one video, the way the generator does with SMART_RENDER=1. Two texts like
+the ones Gemini places (a headline and a call to action) are then burnt in
+once by encoding the whole video and once by encoding only the keyframe
+spans under them.
+
+    python test/bench_smart_render.py --segments 6 --profile balanced
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from replay import synthesize_logo, synthesize_video
+
+
+def watermarked_video(args, workdir):
+    from src.utils.encoding import encode_profile
+    from src.utils.fmp4 import FragmentedMp4Appender
+    from src.utils.helpers import encode_segment_part, prepare_watermark
+    from src.utils.smart_render import keyframe_params
+
+    sprite = prepare_watermark(synthesize_logo(os.path.join(workdir, "logo.png")), args.width,
+                               os.path.join(workdir, "sprite.png"))
+    appender = FragmentedMp4Appender(os.path.join(workdir, "watermarked.mp4"))
+    for i in range(args.segments):
+        segment = synthesize_video(os.path.join(workdir, f"segment_{i}.mp4"), args.width, args.height,
+                                   args.segment_duration, seed=i)
+        appender.append(encode_segment_part(segment, sprite, (args.width, args.height),
+                                            os.path.join(workdir, f"part_{i}.mp4"), encode_profile(args.profile),
+                                            keyframe_params(args.gop)))
+    return appender.output_path
+
+
+def text_clips(path):
+    from src.utils.helpers import fade_in_text
+
+    return [
+        fade_in_text(path, {"start": 0.5, "end": 2.5}, "HEADLINE", "large", {"x": 50, "y": 20},
+                     "rgb(255,255,255)", "Bold", "landscape"),
+        fade_in_text(path, {"start": 3.0, "end": 4.5}, "Call to action", "medium", {"x": 50, "y": 85},
+                     "rgb(230,230,230)", "Normal", "landscape"),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--segments", type=int, default=6)
+    parser.add_argument("--segment-duration", type=float, default=5.0)
+    parser.add_argument("--profile", default="balanced")
+    parser.add_argument("--gop", type=float, default=1.0, help="seconds between the keyframes of the parts")
+    parser.add_argument("--workdir", help="scratch directory (defaults to a temporary directory)")
+    parser.add_argument("--json", action="store_true", help="print the results as json")
+    args = parser.parse_args()
+
+    from src.utils.encoding import encode_profile
+    from src.utils.helpers import embed_text_clips
+    from src.utils.smart_render import smart_render
+
+    # fade_in_text loads the fonts from resources/
+    os.chdir(Path(__file__).parent.parent)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_smart_render_")
+    source = watermarked_video(args, workdir)
+    profile = encode_profile(args.profile)
+
+    started = time.perf_counter()
+    embed_text_clips(source, text_clips(source), os.path.join(workdir, "full.mp4"), profile)
+    full = time.perf_counter() - started
+    started = time.perf_counter()
+    seconds = smart_render(source, text_clips(source), os.path.join(workdir, "smart.mp4"), profile)
+    smart = time.perf_counter() - started
+    results = {
+        "full_encode_s": round(full, 3),
+        "smart_render_s": round(smart, 3),
+        "reencoded_video_s": seconds["reencoded"],
+        "copied_video_s": seconds["copied"],
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.width}x{args.height}, {args.segments} x {args.segment_duration:g}s, {args.profile}, "
+          f"keyframe every {args.gop:g}s, {os.cpu_count()} cpus")
+    print()
+    print(f"{'full encode':<14} {full:>8.2f}s")
+    print(f"{'smart render':<14} {smart:>8.2f}s  ({seconds['reencoded']:g}s encoded, {seconds['copied']:g}s copied)")
+
+
+if __name__ == "__main__":
+    main()
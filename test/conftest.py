@@ -0,0 +1,34 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+os.environ.setdefault("GEMINI_API_KEY", "offline")
+
+# bench_pipeline.py and the manual scripts are not test modules
+collect_ignore = ["bench_pipeline.py", "test.py", "text.py"]
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Run every test in a fresh directory so the sqlite db and scratch files start empty."""
+    from src.utils.db_helpers import init_db
+
+    monkeypatch.chdir(tmp_path)
+    init_db()
+    return tmp_path
+
+
+@pytest.fixture
+def offline(workdir):
+    """Fakes for every external service with tiny media and no latency, plus the fonts the renderer loads."""
+    from replay import OfflineServices
+
+    (workdir / "resources").mkdir()
+    for font in (Path(__file__).parent.parent / "resources").glob("*.ttf"):
+        (workdir / "resources" / font.name).symlink_to(font)
+    services = OfflineServices(str(workdir / "offline"), segment_size=(160, 90), segment_duration=1.0, latency={})
+    with services.install():
+        yield services
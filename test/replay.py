@@ -0,0 +1,676 @@
+"""
+Record/replay layer for the external services used by the pipeline.
+
+Three modes are available, all installed with `with harness.install(): ...`:
+
+- OfflineServices: synthetic fakes for genai, fal_client, Cloudinary and
+  Mailgun. Generated segments and keyframes are synthesized locally.
+- Recorder: calls the real services and writes every response (and every
+  downloaded file) into a cassette directory. Call `record_request(request)`
+  so the cassette also holds the request it was recorded for.
+- Replayer: serves a recorded cassette without any network access. Its
+  `request` attribute is the recorded request, replaying only works for it
+  since the downloads are keyed by url.
+
+Every fake call sleeps for an injectable latency so remote waits can be
+simulated, e.g. `OfflineServices(workdir, latency={"fal_subscribe": 2.0})`.
+"""
+import datetime
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import typing
+from collections import defaultdict, deque
+from contextlib import contextmanager, ExitStack
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, Optional
+from unittest import mock
+
+sys.path.append(str(Path(__file__).parent.parent))
+os.environ.setdefault("GEMINI_API_KEY", "offline")
+
+import numpy as np
+import requests
+import cloudinary.uploader
+import fal_client
+import google.generativeai as genai
+from pydantic import BaseModel
+
+# keep references to the real implementations before anything is patched
+_real_requests_get = requests.get
+_real_requests_post = requests.post
+
+# seconds of simulated latency per operation, roughly what production sees
+# divided by 100 so a benchmark run stays short
+DEFAULT_LATENCY = {
+    "upload_file": 0.05,
+    "get_file": 0.02,
+    "send_message": 0.1,
+    "generate_content": 0.05,
+    "fal_subscribe": 2.2,
+    "cloudinary_upload": 0.1,
+    "download": 0.02,
+    "mailgun": 0.02,
+}
+
+
+class _Response:
+    """Stand-in for requests.Response serving a local file or bytes."""
+    def __init__(self, content: bytes = b"", status_code: int = 200, text: Optional[str] = None):
+        self.content = content
+        self.status_code = status_code
+        self.text = text if text is not None else content.decode("utf-8", "ignore")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error")
+
+    def iter_content(self, chunk_size: int = 8192):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+
+class _Harness:
+    def __init__(self, latency: Optional[Dict[str, float]] = None, latency_scale: float = 1.0):
+        self.latency = dict(DEFAULT_LATENCY if latency is None else latency)
+        self.latency_scale = latency_scale
+        self.calls = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def wait(self, op: str, seconds: Optional[float] = None) -> None:
+        with self._lock:
+            self.calls[op] += 1
+        delay = (self.latency.get(op, 0.0) if seconds is None else seconds) * self.latency_scale
+        if delay > 0:
+            time.sleep(delay)
+
+    def patches(self) -> Dict:
+        raise NotImplementedError
+
+    @contextmanager
+    def install(self):
+        with ExitStack() as stack:
+            for target, replacement in self.patches().items():
+                stack.enter_context(mock.patch(target, replacement))
+            yield self
+
+
+# ---------------------------------------------------------------------------
+# synthetic media
+
+def synthesize_video(path: str, width: int = 640, height: int = 360, duration: float = 5.0, fps: int = 24, seed: int = 0) -> str:
+    """Write an h264 clip with a moving gradient and a bouncing box."""
+    from moviepy import VideoClip
+    rng = np.random.default_rng(seed)
+    base = rng.integers(0, 255, size=3)
+    xs = np.linspace(0, 1, width, dtype=np.float32)[None, :, None]
+    ys = np.linspace(0, 1, height, dtype=np.float32)[:, None, None]
+
+    def make_frame(t):
+        phase = t / duration
+        frame = (base * (0.5 + 0.5 * np.sin(2 * np.pi * (xs + ys + phase)))).astype(np.uint8)
+        frame = np.broadcast_to(frame, (height, width, 3)).copy()
+        box = height // 4
+        x = int((width - box) * phase)
+        y = int((height - box) * abs(np.sin(np.pi * phase * 2)))
+        frame[y:y + box, x:x + box] = 255 - base
+        return frame
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    clip = VideoClip(make_frame, duration=duration).with_fps(fps)
+    clip.write_videofile(path, codec="libx264", audio=False, logger=None, preset="ultrafast")
+    clip.close()
+    return path
+
+
+def synthesize_image(path: str, width: int = 640, height: int = 360, seed: int = 0) -> str:
+    from PIL import Image
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 255, size=(height, width, 3), dtype=np.uint8)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    Image.fromarray(pixels).save(path)
+    return path
+
+
+def synthesize_logo(path: str, size: int = 256) -> str:
+    from PIL import Image, ImageDraw
+    image = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((8, 8, size - 8, size - 8), fill=(240, 180, 20, 255))
+    draw.rectangle((size // 3, size // 3, 2 * size // 3, 2 * size // 3), fill=(20, 20, 20, 255))
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    image.save(path)
+    return path
+
+
+# ---------------------------------------------------------------------------
+# structured output for the fake extraction models
+
+_FIELD_VALUES = {
+    "font_size": "medium",
+    "font": "Bold",
+    "color": "rgb(255,255,255)",
+    "x": 50.0,
+    "y": 50.0,
+    "start": 0.5,
+    "end": 2.5,
+    "text": "OFFLINE TEXT",
+}
+
+
+def fake_from_schema(schema, field: str = ""):
+    """Build a value that satisfies a pydantic model or TypedDict schema."""
+    if field in _FIELD_VALUES:
+        return _FIELD_VALUES[field]
+    if isinstance(schema, type) and issubclass(schema, BaseModel):
+        return {name: fake_from_schema(info.annotation, name) for name, info in schema.model_fields.items()}
+    if isinstance(schema, type) and issubclass(schema, dict) and hasattr(schema, "__annotations__"):
+        return {name: fake_from_schema(annotation, name) for name, annotation in typing.get_type_hints(schema).items()}
+    origin = typing.get_origin(schema)
+    if origin in (list, typing.List):
+        (item,) = typing.get_args(schema)
+        return [fake_from_schema(item, field) for _ in range(2)]
+    if schema is float:
+        return 7.0
+    if schema is int:
+        return 7
+    return f"offline {field or 'value'}"
+
+
+FAKE_TEXTS_XML = """<texts>
+  <text><color>rgb(255,255,255)</color><font>Bold</font><font_size>large</font_size>
+    <position><x>50</x><y>20</y></position><content>OFFLINE HEADLINE</content>
+    <text_duration><start>0.5</start><end>2.5</end></text_duration></text>
+  <text><color>rgb(230,230,230)</color><font>Normal</font><font_size>medium</font_size>
+    <position><x>50</x><y>85</y></position><content>Offline call to action</content>
+    <text_duration><start>3.0</start><end>4.5</end></text_duration></text>
+</texts>"""
+
+
+# ---------------------------------------------------------------------------
+# synthetic fakes
+
+class _FakeChat:
+    def __init__(self, model, history):
+        self.model = model
+        self.history = list(history or [])
+
+    def send_message(self, content, **kwargs):
+        from src.utils.chat_history import estimate_part_tokens, estimate_tokens
+        response = self.model._respond("send_message", content)
+        if response.usage_metadata is not None:
+            # like Gemini, the system instruction, cached prefix and whole
+            # history are part of the prompt
+            cached = self.model._cached_tokens()
+            response.usage_metadata.prompt_token_count = (cached + len(self.model._system_instruction) // 4
+                                                          + estimate_tokens(self.history) + estimate_part_tokens(content))
+            response.usage_metadata.cached_content_token_count = cached
+        self.history.append({"role": "user", "parts": [content]})
+        self.history.append({"role": "model", "parts": [response.text]})
+        return response
+
+
+class OfflineServices(_Harness):
+    """
+    Synthetic fakes for every external service. Remote media (keyframes,
+    segments, uploads) is served from files under `workdir`.
+    """
+    def __init__(self, workdir: str, segment_size=(640, 360), segment_duration: float = 5.0, webhook_handler=None, **kwargs):
+        super().__init__(**kwargs)
+        self.workdir = os.path.abspath(workdir)
+        self.segment_size = segment_size
+        self.segment_duration = segment_duration
+        # called with the webhook payload when a queued fal request finishes
+        # and the submit asked for a webhook, e.g. fal_helpers.handle_fal_webhook
+        self.webhook_handler = webhook_handler
+        self.urls: Dict[str, str] = {}
+        self.queue: Dict[str, Dict] = {}
+        # context caches by name
+        self.caches: Dict[str, object] = {}
+        self._queue_lock = threading.Lock()
+        self._counter = 0
+        os.makedirs(self.workdir, exist_ok=True)
+
+    def _next(self) -> int:
+        with self._lock:
+            self._counter += 1
+            return self._counter
+
+    def register(self, path: str) -> str:
+        """Serve a local file under a fake url."""
+        url = f"https://offline.invalid/{self._next()}/{os.path.basename(path)}"
+        self.urls[url] = path
+        return url
+
+    # genai ----------------------------------------------------------------
+    def _model_factory(self):
+        harness = self
+
+        class FakeModel:
+            def __init__(self, model_name="gemini-offline", generation_config=None, system_instruction=None, **kwargs):
+                self.model_name = model_name if model_name.startswith("models/") else f"models/{model_name}"
+                self._generation_config = dict(generation_config or {})
+                self._system_instruction = str(system_instruction or "")
+                self._safety_settings = kwargs.get("safety_settings")
+                self._cached_content = None
+
+            @classmethod
+            def from_cached_content(cls, cached_content, generation_config=None, safety_settings=None):
+                if isinstance(cached_content, str):
+                    cached_content = harness.caches[cached_content]
+                model = cls(cached_content.model, generation_config=generation_config)
+                model._cached_content = cached_content.name
+                return model
+
+            def _cached_tokens(self):
+                from src.utils.chat_history import estimate_tokens
+                cached = harness.caches.get(self._cached_content)
+                if cached is None:
+                    return 0
+                return len(str(cached.system_instruction or "")) // 4 + estimate_tokens(cached.contents)
+
+            def start_chat(self, history=None, **kwargs):
+                return _FakeChat(self, history)
+
+            def generate_content(self, content, **kwargs):
+                return self._respond("generate_content", content)
+
+            def count_tokens(self, contents):
+                return SimpleNamespace(total_tokens=len(str(contents)) // 4)
+
+            def _respond(self, op, content):
+                harness.wait(op)
+                schema = self._generation_config.get("response_schema")
+                if schema is not None:
+                    text = json.dumps(fake_from_schema(schema))
+                elif "xml" in self._system_instruction.lower():
+                    text = FAKE_TEXTS_XML
+                else:
+                    text = f"Offline response to: {str(content)[:200]}"
+                return SimpleNamespace(text=text, usage_metadata=SimpleNamespace(
+                    prompt_token_count=len(str(content)) // 4, candidates_token_count=len(text) // 4))
+
+        return FakeModel
+
+    def _cached_content_class(self):
+        harness = self
+
+        class FakeCachedContent:
+            def __init__(self, model, system_instruction, contents, ttl):
+                self.name = f"cachedContents/offline-{harness._next()}"
+                self.model = model
+                self.system_instruction = system_instruction
+                self.contents = list(contents or [])
+                self.update(ttl=ttl)
+
+            @classmethod
+            def create(cls, model, *, system_instruction=None, contents=None, ttl=None, **kwargs):
+                harness.wait("cache_create")
+                cached = cls(model, system_instruction, contents, ttl)
+                harness.caches[cached.name] = cached
+                return cached
+
+            @classmethod
+            def get(cls, name):
+                harness.wait("cache_get")
+                cached = harness.caches.get(name)
+                if cached is None or cached.expire_time <= datetime.datetime.now(datetime.timezone.utc):
+                    raise LookupError(f"{name} not found")
+                return cached
+
+            def update(self, *, ttl=None, **kwargs):
+                self.expire_time = datetime.datetime.now(datetime.timezone.utc) + (ttl or datetime.timedelta(hours=1))
+
+        return FakeCachedContent
+
+    def upload_file(self, path, mime_type=None, **kwargs):
+        self.wait("upload_file")
+        name = f"files/offline-{self._next()}"
+        return SimpleNamespace(name=name, display_name=os.path.basename(str(path)), uri=f"https://offline.invalid/{name}",
+                               state=SimpleNamespace(name="ACTIVE"))
+
+    def get_file(self, name):
+        self.wait("get_file")
+        return SimpleNamespace(name=name, state=SimpleNamespace(name="ACTIVE"))
+
+    # fal ------------------------------------------------------------------
+    def subscribe(self, application, arguments=None, with_logs=False, on_queue_update=None, **kwargs):
+        if on_queue_update is not None:
+            on_queue_update(fal_client.InProgress(logs=[{"message": f"offline render of {application} started"}]))
+        self.wait("fal_subscribe")
+        return self._render(application)
+
+    def submit(self, application, arguments=None, webhook_url=None, **kwargs):
+        """Fake fal queue: the render finishes after the fal_subscribe latency."""
+        with self._lock:
+            self.calls["fal_submit"] += 1
+        request_id = f"offline-request-{self._next()}"
+        delay = self.latency.get("fal_subscribe", 0.0) * self.latency_scale
+        self.queue[request_id] = {"application": application, "ready_at": time.monotonic() + delay,
+                                  "webhook_url": webhook_url, "result": None}
+        if webhook_url and self.webhook_handler is not None:
+            def deliver():
+                self.webhook_handler({"request_id": request_id, "status": "OK", "payload": self.result(application, request_id)})
+            timer = threading.Timer(delay, deliver)
+            timer.daemon = True
+            timer.start()
+        return SimpleNamespace(request_id=request_id)
+
+    def status(self, application, request_id, with_logs=False):
+        with self._lock:
+            self.calls["fal_status"] += 1
+        job = self.queue[request_id]
+        if time.monotonic() < job["ready_at"]:
+            return fal_client.InProgress(logs=[{"message": f"offline render of {application} in progress"}])
+        return fal_client.Completed(logs=[], metrics={})
+
+    def result(self, application, request_id):
+        job = self.queue[request_id]
+        with self._queue_lock:
+            if job["result"] is None:
+                job["result"] = self._render(application)
+            return job["result"]
+
+    def _render(self, application):
+        index = self._next()
+        width, height = self.segment_size
+        if "kling" in application:
+            path = os.path.join(self.workdir, "fal", f"segment_{index}.mp4")
+            synthesize_video(path, width, height, self.segment_duration, seed=index)
+            return {"video": {"url": self.register(path)}}
+        path = os.path.join(self.workdir, "fal", f"image_{index}.png")
+        synthesize_image(path, width, height, seed=index)
+        return {"images": [{"url": self.register(path)}]}
+
+    # cloudinary -----------------------------------------------------------
+    def cloudinary_upload(self, file, **kwargs):
+        self.wait("cloudinary_upload")
+        if hasattr(file, "read"):
+            path = os.path.join(self.workdir, "cloudinary", f"upload_{self._next()}.png")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(file.read())
+        else:
+            path = str(file)
+        return {"secure_url": self.register(path)}
+
+    # http -----------------------------------------------------------------
+    def get(self, url, *args, **kwargs):
+        url = str(url)
+        if url not in self.urls:
+            raise requests.ConnectionError(f"offline harness has no file for {url}")
+        self.wait("download")
+        with open(self.urls[url], "rb") as f:
+            return _Response(f.read())
+
+    def post(self, url, *args, **kwargs):
+        self.wait("mailgun")
+        return _Response(b'{"message": "Queued. Thank you."}')
+
+    def patches(self) -> Dict:
+        return {
+            "google.generativeai.GenerativeModel": self._model_factory(),
+            "google.generativeai.upload_file": self.upload_file,
+            "google.generativeai.get_file": self.get_file,
+            "google.generativeai.caching.CachedContent": self._cached_content_class(),
+            "fal_client.subscribe": self.subscribe,
+            "fal_client.submit": self.submit,
+            "fal_client.status": self.status,
+            "fal_client.result": self.result,
+            "cloudinary.uploader.upload": self.cloudinary_upload,
+            "requests.get": self.get,
+            "requests.post": self.post,
+            # the fake renders are shorter than Kling's
+            "src.utils.segment_quality.SEGMENT_SECONDS": self.segment_duration,
+        }
+
+
+# ---------------------------------------------------------------------------
+# recording and replaying real traffic
+
+class Recorder(_Harness):
+    """
+    Passes every call through to the real service and stores the responses
+    in `cassette_dir` so the run can later be replayed offline.
+    """
+    def __init__(self, cassette_dir: str):
+        super().__init__(latency={})
+        self.cassette_dir = os.path.abspath(cassette_dir)
+        os.makedirs(os.path.join(self.cassette_dir, "files"), exist_ok=True)
+        self.cassette = {"request": None, "calls": [], "files": {}}
+        self._real_model = genai.GenerativeModel
+        self._real_upload_file = genai.upload_file
+        self._real_get_file = genai.get_file
+        self._real_subscribe = fal_client.subscribe
+        self._real_result = fal_client.result
+        self._real_cloudinary_upload = cloudinary.uploader.upload
+
+    def _record(self, op: str, started: float, result) -> None:
+        with self._lock:
+            self.cassette["calls"].append({"op": op, "latency": round(time.perf_counter() - started, 3), "result": result})
+
+    def record_request(self, request) -> None:
+        """Store the request being run, the recorded urls only replay for it."""
+        self.cassette["request"] = request.model_dump(mode="json")
+
+    def save(self) -> str:
+        path = os.path.join(self.cassette_dir, "cassette.json")
+        with open(path, "w") as f:
+            json.dump(self.cassette, f, indent=2)
+        return path
+
+    def _model_factory(self):
+        recorder = self
+        real_model = self._real_model
+
+        class RecordingChat:
+            def __init__(self, model, chat):
+                self.model = model
+                self._chat = chat
+
+            @property
+            def history(self):
+                return self._chat.history
+
+            @history.setter
+            def history(self, history):
+                self._chat.history = history
+
+            def send_message(self, content, **kwargs):
+                started = time.perf_counter()
+                response = self._chat.send_message(content, **kwargs)
+                recorder._record("send_message", started, {"text": response.text})
+                return response
+
+        class RecordingModel(real_model):
+            def start_chat(self, *args, **kwargs):
+                return RecordingChat(self, super().start_chat(*args, **kwargs))
+
+            def generate_content(self, *args, **kwargs):
+                started = time.perf_counter()
+                response = super().generate_content(*args, **kwargs)
+                recorder._record("generate_content", started, {"text": response.text})
+                return response
+
+        return RecordingModel
+
+    def upload_file(self, *args, **kwargs):
+        started = time.perf_counter()
+        file = self._real_upload_file(*args, **kwargs)
+        self._record("upload_file", started, {"name": file.name, "display_name": file.display_name, "uri": file.uri})
+        return file
+
+    def get_file(self, name):
+        started = time.perf_counter()
+        file = self._real_get_file(name)
+        self._record("get_file", started, {"name": file.name, "state": file.state.name})
+        return file
+
+    def subscribe(self, *args, **kwargs):
+        started = time.perf_counter()
+        result = self._real_subscribe(*args, **kwargs)
+        self._record("fal_subscribe", started, result)
+        return result
+
+    def result(self, *args, **kwargs):
+        # queued renders are stored like subscribe calls so cassettes replay
+        # with either fal backend
+        started = time.perf_counter()
+        result = self._real_result(*args, **kwargs)
+        self._record("fal_subscribe", started, result)
+        return result
+
+    def cloudinary_upload(self, *args, **kwargs):
+        started = time.perf_counter()
+        result = self._real_cloudinary_upload(*args, **kwargs)
+        self._record("cloudinary_upload", started, {"secure_url": result["secure_url"]})
+        return result
+
+    def get(self, url, *args, **kwargs):
+        kwargs.pop("stream", None)
+        response = _real_requests_get(url, *args, **kwargs)
+        response.raise_for_status()
+        content = response.content
+        name = hashlib.sha256(str(url).encode()).hexdigest()[:16]
+        with open(os.path.join(self.cassette_dir, "files", name), "wb") as f:
+            f.write(content)
+        with self._lock:
+            self.cassette["files"][str(url)] = name
+        return _Response(content, response.status_code)
+
+    def post(self, url, *args, **kwargs):
+        started = time.perf_counter()
+        response = _real_requests_post(url, *args, **kwargs)
+        self._record("mailgun", started, {"status_code": response.status_code, "text": response.text})
+        return response
+
+    def patches(self) -> Dict:
+        return {
+            "google.generativeai.GenerativeModel": self._model_factory(),
+            "google.generativeai.upload_file": self.upload_file,
+            "google.generativeai.get_file": self.get_file,
+            "fal_client.subscribe": self.subscribe,
+            "fal_client.result": self.result,
+            "cloudinary.uploader.upload": self.cloudinary_upload,
+            "requests.get": self.get,
+            "requests.post": self.post,
+        }
+
+    @contextmanager
+    def install(self):
+        with super().install():
+            try:
+                yield self
+            finally:
+                self.save()
+
+
+class Replayer(OfflineServices):
+    """
+    Serves a cassette written by Recorder. Responses are returned in the
+    order they were recorded for each operation and the recorded latency
+    is replayed, multiplied by `latency_scale` (0 disables it).
+    """
+    def __init__(self, cassette_dir: str, workdir: str, latency_scale: float = 1.0):
+        super().__init__(workdir, latency_scale=latency_scale)
+        self.cassette_dir = os.path.abspath(cassette_dir)
+        with open(os.path.join(self.cassette_dir, "cassette.json")) as f:
+            cassette = json.load(f)
+        # the request the cassette was recorded for, None for old cassettes
+        self.request = None
+        if cassette.get("request") is not None:
+            from src.models.schemas import VideoRequest
+            self.request = VideoRequest.model_validate(cassette["request"])
+        self.queues = defaultdict(deque)
+        for call in cassette["calls"]:
+            self.queues[call["op"]].append(call)
+        for url, name in cassette["files"].items():
+            self.urls[url] = os.path.join(self.cassette_dir, "files", name)
+
+    def _pop(self, op: str):
+        with self._lock:
+            if not self.queues[op]:
+                raise RuntimeError(f"cassette has no more recorded {op} calls")
+            call = self.queues[op].popleft()
+        self.wait(op, call["latency"])
+        return call["result"]
+
+    def _model_factory(self):
+        harness = self
+        base = super()._model_factory()
+
+        class ReplayModel(base):
+            def _respond(self, op, content):
+                return SimpleNamespace(text=harness._pop(op)["text"], usage_metadata=None)
+
+        return ReplayModel
+
+    def upload_file(self, path, mime_type=None, **kwargs):
+        result = self._pop("upload_file")
+        return SimpleNamespace(state=SimpleNamespace(name="ACTIVE"), **result)
+
+    def get_file(self, name):
+        result = self._pop("get_file")
+        return SimpleNamespace(name=result["name"], state=SimpleNamespace(name=result["state"]))
+
+    def subscribe(self, application, arguments=None, with_logs=False, on_queue_update=None, **kwargs):
+        return self._pop("fal_subscribe")
+
+    def _render(self, application):
+        return self._pop("fal_subscribe")
+
+    def cloudinary_upload(self, file, **kwargs):
+        return self._pop("cloudinary_upload")
+
+    def post(self, url, *args, **kwargs):
+        result = self._pop("mailgun")
+        return _Response(result["text"].encode(), result["status_code"])
+
+
+def sample_request(duration: int = 10, width: int = 1280, height: int = 720, logo_url: str = "https://offline.invalid/logo.png",
+                   product_video_url: str = "https://offline.invalid/product.mp4"):
+    from src.models.schemas import VideoRequest
+    return VideoRequest.model_validate({
+        "video_details": {
+            "product_name": "Offline Benchmark Bottle",
+            "tagline": "Measured without a network",
+            "brand_palette": ["#F0B414", "#141414", "#FFFFFF"],
+            "dimensions": {"width": width, "height": height},
+            "duration": duration,
+            "cta_text": "Buy it offline",
+            "logo_url": logo_url,
+            "product_video_url": product_video_url,
+        },
+        "scoring_criteria": {
+            "background_foreground_separation": 20,
+            "brand_guideline_adherence": 20,
+            "creativity_visual_appeal": 20,
+            "product_focus": 15,
+            "call_to_action": 15,
+            "audience_relevance": 10,
+        },
+        "additional_guidelines": "",
+        "video_style": "2D Art",
+        "email": "",
+    })
+
+
+def offline_request(services: OfflineServices, **kwargs):
+    """A sample request whose logo and product video are served by the fakes."""
+    logo = synthesize_logo(os.path.join(services.workdir, "assets", "logo.png"))
+    product = os.path.join(services.workdir, "assets", "product.mp4")
+    if not os.path.exists(product):
+        synthesize_video(product, 640, 360, 3.0, seed=99)
+    services.urls["https://offline.invalid/logo.png"] = logo
+    services.urls["https://offline.invalid/product.mp4"] = product
+    return sample_request(**kwargs)
@@ -0,0 +1,104 @@
+"""
+Soak test of the local media pipeline: runs many synthetic jobs one after
+the other in a single process and samples its resident memory and open file
+descriptors after each one. A clip, reader or capture that is never closed
+shows up as a descriptor count that keeps climbing, or as RSS that grows
+with every job instead of levelling off.
+
+All external services are faked by test/replay.py, the renders, watermark,
+text overlay, scoring frames and metadata probe do real work on tiny media.
+
+    python test/soak_media.py --jobs 100
+"""
+import argparse
+import gc
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from replay import OfflineServices, offline_request
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def sample(collect=True):
+    """
+    (rss in MB, open file descriptors) of this process. Without `collect`
+    whatever only the garbage collector would free is counted too.
+    """
+    if collect:
+        gc.collect()
+    with open("/proc/self/statm") as f:
+        resident_pages = int(f.read().split()[1])
+    return resident_pages * PAGE_SIZE / 2**20, len(os.listdir("/proc/self/fd"))
+
+
+def run_jobs(services, jobs, duration=5, width=320, height=180, collect=True, on_job=None):
+    """
+    Run `jobs` full pipelines in the current directory and return one
+    (rss MB, fds) sample per job, taken after its scratch files are removed.
+    """
+    from src.services.video_pipeline import build_video_pipeline
+
+    request = offline_request(services, duration=duration, width=width, height=height)
+    samples = []
+    for index in range(jobs):
+        job_id = str(uuid.uuid4())
+        build_video_pipeline(request, job_id).run()
+        # keep the disk usage flat too, every job has its own directories
+        for directory in ("tmp", "data"):
+            shutil.rmtree(os.path.join(directory, job_id), ignore_errors=True)
+        samples.append(sample(collect))
+        if on_job is not None:
+            on_job(index, samples[-1])
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=100)
+    parser.add_argument("--duration", type=int, default=5, help="requested video duration in seconds")
+    parser.add_argument("--no-gc", action="store_true", help="don't run the garbage collector before sampling")
+    parser.add_argument("--workdir", help="scratch directory (defaults to a temporary directory)")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="soak_media_")
+    services = OfflineServices(os.path.join(workdir, "offline"), segment_size=(160, 90), segment_duration=1.0, latency={})
+
+    repo_root = Path(__file__).parent.parent.resolve()
+    os.makedirs(os.path.join(workdir, "resources"), exist_ok=True)
+    for font in (repo_root / "resources").glob("*.ttf"):
+        target = Path(workdir) / "resources" / font.name
+        if not target.exists():
+            target.symlink_to(font)
+    os.chdir(workdir)
+
+    from src.utils.db_helpers import init_db
+
+    init_db()
+    rss, fds = sample(not args.no_gc)
+    print(f"{'start':>5} rss {rss:>8.1f}MB  fds {fds:>4}")
+
+    def report(index, job_sample):
+        print(f"{index + 1:>5} rss {job_sample[0]:>8.1f}MB  fds {job_sample[1]:>4}", flush=True)
+
+    with services.install():
+        samples = run_jobs(services, args.jobs, duration=args.duration, collect=not args.no_gc, on_job=report)
+
+    # the first job warms up imports, fonts and ffmpeg, measure from there
+    first_rss, first_fds = samples[0]
+    last_rss, last_fds = samples[-1]
+    print()
+    print(f"after job 1: rss {first_rss:.1f}MB, {first_fds} fds")
+    print(f"after job {len(samples)}: rss {last_rss:.1f}MB, {last_fds} fds")
+    print(f"growth: rss {last_rss - first_rss:+.1f}MB, fds {last_fds - first_fds:+d}, "
+          f"max rss {max(s[0] for s in samples):.1f}MB, max fds {max(s[1] for s in samples)}")
+
+
+if __name__ == "__main__":
+    main()
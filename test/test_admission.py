@@ -0,0 +1,107 @@
+import asyncio
+import threading
+
+import pytest
+
+from src.services import video_pipeline
+from src.utils import admission
+from src.utils.admission import AdmissionController, AdmissionRejected, projected_segments
+from replay import sample_request
+from test_video_pipeline import stored_response
+
+
+def test_limits_per_resource():
+    async def scenario():
+        controller = AdmissionController(max_jobs=3, max_segments=5, max_jobs_per_tenant=1)
+        first = await controller.acquire("a", projected_segments(15))
+        assert projected_segments(15) == 3
+
+        with pytest.raises(AdmissionRejected) as tenant:
+            await controller.acquire("a", 1)
+        with pytest.raises(AdmissionRejected) as segments:
+            await controller.acquire("b", 3)
+        second = await controller.acquire("b", 2)
+        assert controller.utilization()["resources"]["segments"] == {"used": 5, "limit": 5}
+
+        controller.release(first)
+        controller.release(second)
+        # a job bigger than the segment limit still runs on its own
+        await controller.acquire(None, 12)
+        return controller, tenant.value, segments.value
+
+    controller, tenant, segments = asyncio.run(scenario())
+    assert (tenant.resource, segments.resource) == ("tenant_jobs", "segments")
+    assert controller.rejected == {"tenant_jobs": 1, "segments": 1}
+    assert controller.utilization()["tenants"] == 0
+
+
+def test_scratch_disk_limit(workdir):
+    (workdir / "tmp" / "job").mkdir(parents=True)
+    (workdir / "tmp" / "job" / "segment_0.mp4").write_bytes(b"\0" * 2**20)
+    controller = AdmissionController(max_scratch_mb=1, retry_after=30)
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        asyncio.run(controller.acquire(None, 1))
+    assert rejected.value.retry_after == 30
+    assert controller.utilization()["resources"]["scratch_mb"] == {"used": 1.0, "limit": 1}
+
+
+def test_scratch_disk_is_measured_off_the_event_loop(workdir, monkeypatch):
+    walked = []
+
+    def directory_size_mb(*paths):
+        walked.append(threading.current_thread())
+        return 0.0
+
+    monkeypatch.setattr(admission, "directory_size_mb", directory_size_mb)
+    controller = AdmissionController(max_scratch_mb=1)
+
+    asyncio.run(controller.acquire(None, 1))
+    assert walked and threading.main_thread() not in walked
+
+
+def test_excess_jobs_wait_for_room():
+    async def scenario():
+        controller = AdmissionController(max_jobs=1, queue_timeout=5, poll_interval=0.01)
+        first = await controller.acquire(None, 1)
+        waiter = asyncio.ensure_future(controller.acquire(None, 1))
+        await asyncio.sleep(0.05)
+        assert controller.utilization()["waiting"] == 1
+        controller.release(first)
+        await waiter
+        return controller
+
+    controller = asyncio.run(scenario())
+    assert controller.jobs == 1 and controller.waiting == 0
+
+
+def test_api_rejects_jobs_over_the_limit_with_retry_after(monkeypatch):
+    from fastapi.testclient import TestClient
+    from src import main
+
+    release = threading.Event()
+
+    def fake_pipeline(request, job_id):
+        release.wait(5)
+        return stored_response()
+
+    controller = AdmissionController(max_jobs_per_tenant=1, retry_after=42)
+    monkeypatch.setattr(video_pipeline, "admission", controller)
+    monkeypatch.setattr(main, "admission", controller)
+    monkeypatch.setattr(video_pipeline, "run_video_pipeline", fake_pipeline)
+    body = sample_request().model_dump(mode="json")
+    other = {**body, "video_style": "something else"}
+
+    with TestClient(main.app) as client:
+        assert client.post("/jobs", json=body, headers={"X-API-Key": "key"}).status_code == 202
+        # identical requests join the job and don't count
+        assert client.post("/jobs", json=body, headers={"X-API-Key": "key"}).status_code == 202
+        rejected = client.post("/jobs", json=other, headers={"X-API-Key": "key"})
+        assert client.post("/jobs", json=other, headers={"X-API-Key": "other key"}).status_code == 202
+        utilization = client.get("/admission").json()
+        release.set()
+
+    assert rejected.status_code == 429
+    assert rejected.headers["Retry-After"] == "42"
+    assert utilization["resources"]["jobs"]["used"] == 2
+    assert utilization["rejected"] == {"tenant_jobs": 1}
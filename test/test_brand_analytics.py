@@ -0,0 +1,100 @@
+import uuid
+
+import cv2
+import numpy as np
+from moviepy import CompositeVideoClip, ImageClip
+
+from src.services import video_scorer
+from src.services.video_pipeline import run_video_pipeline
+from src.utils.brand_analytics import BrandAnalytics, nearest_palette, preliminary_scores, rgb_to_lab
+from src.utils.helpers import add_watermark, open_video
+from src.utils.media_analysis import StreamInfo, analyze
+from src.utils.progress import broker
+from replay import offline_request, synthesize_logo, synthesize_video
+
+PALETTE = ["#F0B414", "#141414", "#FFFFFF"]
+
+
+def test_lab_matches_opencv():
+    pixels = np.random.default_rng(0).integers(0, 256, size=(1000, 3), dtype=np.uint8)
+    expected = cv2.cvtColor(pixels[None].astype(np.float32) / 255, cv2.COLOR_RGB2Lab)[0]
+
+    assert np.abs(rgb_to_lab(pixels) - expected).max() < 0.5
+
+
+def test_pixels_are_assigned_to_the_nearest_brand_color():
+    palette_lab = rgb_to_lab(np.array([[240, 180, 20], [20, 20, 20]], dtype=np.uint8))
+    index, distance = nearest_palette(rgb_to_lab(np.array([[235, 175, 30], [30, 30, 30], [40, 90, 220]], dtype=np.uint8)),
+                                      palette_lab)
+
+    assert index[:2].tolist() == [0, 1]
+    assert distance[0] < 10 and distance[1] < 10 and distance[2] > 50
+
+
+def test_palette_coverage_over_time():
+    brand = BrandAnalytics(PALETTE, rate=1)
+    brand.start(StreamInfo(width=320, height=180, fps=1, duration=2))
+    frame = np.full((180, 320, 3), (40, 90, 220), dtype=np.uint8)
+    brand.consume(0, 0.0, frame)
+    frame[:, :80] = (240, 180, 20)
+    frame[:, 80:160] = (255, 255, 255)
+    brand.consume(1, 1.0, frame)
+
+    results = brand.finish()
+
+    assert [point["share"] for point in results["coverage_over_time"]] == [0, 0.5]
+    assert [color["share"] for color in results["palette_coverage"]] == [0.125, 0, 0.125]
+    assert results["on_palette_share"] == 0.25 and results["logo_presence"] is None
+
+
+def show_logo(video_path, logo_path, output_path):
+    """the logo on screen in the top left corner, a sixth of the width wide"""
+    with open_video(video_path, audio=False) as video:
+        logo = ImageClip(logo_path, transparent=True).resized(width=video.w // 6)
+        with CompositeVideoClip([video, logo.with_position((40, 40)).with_duration(video.duration)]) as shown:
+            shown.write_videofile(output_path, codec="libx264", audio=False, logger=None, preset="ultrafast")
+    return output_path
+
+
+def test_logo_on_screen_is_found_but_not_the_watermark(workdir):
+    logo = synthesize_logo(str(workdir / "logo.png"))
+    plain = synthesize_video(str(workdir / "plain.mp4"), 640, 360, duration=2.0)
+    watermarked = str(workdir / "watermarked.mp4")
+    add_watermark(plain, logo, watermarked)
+    shown = show_logo(watermarked, logo, str(workdir / "shown.mp4"))
+
+    without = analyze(plain, [BrandAnalytics(PALETTE, logo, watermarked=True)])["brand"]
+    only_watermark = analyze(watermarked, [BrandAnalytics(PALETTE, logo, watermarked=True)])["brand"]
+    with_logo = analyze(shown, [BrandAnalytics(PALETTE, logo, watermarked=True)])["brand"]
+
+    assert without["logo_presence"] == 0 and only_watermark["logo_presence"] == 0
+    assert with_logo["logo_presence"] == 1 and with_logo["frames_sampled"] == 4
+    # without leaving it out, the watermark would count as the logo
+    assert analyze(watermarked, [BrandAnalytics(PALETTE, logo)])["brand"]["logo_presence"] == 1
+    criteria = {"brand_guideline_adherence": 20, "product_focus": 15}
+    assert preliminary_scores(with_logo, criteria).keys() == {"brand_guideline_adherence"}
+    assert preliminary_scores(with_logo, criteria)["brand_guideline_adherence"] > preliminary_scores(only_watermark, criteria)["brand_guideline_adherence"]
+
+
+def test_pipeline_scores_with_the_analytics(offline, monkeypatch):
+    prompts = []
+
+    def send_message(chat_sess, content, **kwargs):
+        prompts.append(content)
+        return chat_sess.send_message(content, **kwargs)
+
+    monkeypatch.setattr(video_scorer, "send_message", send_message)
+    request = offline_request(offline, duration=5, width=320, height=180)
+
+    job_id = str(uuid.uuid4())
+    response = run_video_pipeline(request, job_id)
+
+    analytics = response.brand_analytics
+    # the offline video only shows the logo as the watermark, which would
+    # count on every frame; the round test logo still passes for the big
+    # "O" of the offline text while it is on screen
+    assert analytics["logo_presence"] < 0.5
+    assert set(analytics["preliminary_scores"]) == {"brand_guideline_adherence"}
+    assert f"logo visible in {analytics['logo_presence']:.0%} of the sampled frames" in prompts[0]
+    events = [event.event for event in broker.history(job_id)]
+    assert events.index("preliminary_score") < events.index("completed")
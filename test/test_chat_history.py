@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+
+from src.services.video_generator import VideoGenerator
+from src.utils.chat_history import IMAGE_TOKENS, ChatHistory, estimate_tokens
+from src.utils.progress import broker, current_job_id
+from replay import offline_request
+
+
+def upload(name):
+    return SimpleNamespace(name=f"files/{name}", display_name=name)
+
+
+def chat_with_segments(segments, **kwargs):
+    chat = SimpleNamespace(history=[{"role": "user", "parts": [upload("logo.png")]},
+                                    {"role": "user", "parts": [upload("product.mp4")]}])
+    history = ChatHistory(chat, **kwargs)
+    for i in range(1, segments + 1):
+        history.add_media(i, [upload(f"last_frame_{i}.png"), upload(f"segment_{i}.mp4")], summary=f"segment {i} summary")
+        chat.history.append({"role": "user", "parts": [f"prompt for segment {i + 1}"]})
+        chat.history.append({"role": "model", "parts": ["answer " * 50]})
+    return chat, history
+
+
+def test_older_segments_are_summarized():
+    chat, history = chat_with_segments(4, media_window=1, token_budget=100000)
+    stats = history.compact()
+
+    # the pinned logo and product video, and the last segment's frame and video
+    attached = [entry["parts"][0] for entry in chat.history if not isinstance(entry["parts"][0], str)]
+    assert [part.display_name for part in attached] == ["logo.png", "product.mp4", "last_frame_4.png", "segment_4.mp4"]
+    texts = [entry["parts"][0] for entry in chat.history]
+    assert all(f"segment {i} summary" in texts for i in range(1, 4))
+    assert stats["attached_media"] == 2
+    assert stats["estimated_tokens"] == estimate_tokens(chat.history)
+
+
+def test_budget_replaces_recent_media_and_old_turns():
+    chat, history = chat_with_segments(4, media_window=2, token_budget=1700)
+    stats = history.compact()
+
+    assert stats["estimated_tokens"] <= 1700
+    assert stats["attached_media"] == 0
+    # the pinned entries are kept whatever their size
+    assert chat.history[1]["parts"][0].display_name == "product.mp4"
+    assert "(earlier turn omitted)" in [entry["parts"][0] for entry in chat.history]
+
+
+def test_prompt_tokens_flatten_over_segments(offline):
+    request = offline_request(offline, duration=30, width=320, height=180)
+    token = current_job_id.set("chat-job")
+    try:
+        VideoGenerator(request, job_id="chat-job").render_video()
+    finally:
+        current_job_id.reset(token)
+
+    usage = [event.data for event in broker.history("chat-job")
+             if event.event == "llm_usage" and event.data["operation"] == "send_message"]
+    # one message per segment plus the text overlay plan
+    assert len(usage) == 7
+    tokens = [data["prompt_tokens"] for data in usage[:6]]
+    growth = [later - earlier for earlier, later in zip(tokens[1:], tokens[2:])]
+    # once a segment's media is attached, each message only adds the text
+    # of the previous turn, not another frame and video
+    assert tokens[1] > tokens[0]
+    assert all(0 <= step < IMAGE_TOKENS for step in growth)
+    assert all(data["seconds"] >= 0 for data in usage)
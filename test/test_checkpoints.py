@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+from src.services.video_generator import VideoGenerator
+from src.utils.checkpoints import JobCheckpoint
+from src.utils.db_helpers import get_checkpoints
+from replay import offline_request
+
+
+def test_checkpoint_round_trip(tmp_path):
+    checkpoint = JobCheckpoint("job")
+    checkpoint.save("prompts_0", response="text", prompts={"motion_prompt": "spin"})
+    path = tmp_path / "merged.mp4"
+    path.write_bytes(b"video")
+    checkpoint.save("merge", path=str(path))
+
+    restored = JobCheckpoint("job")
+    assert restored.get("prompts_0") == {"response": "text", "prompts": {"motion_prompt": "spin"}}
+    assert restored.output("merge") == str(path)
+    assert "watermark" not in restored
+    path.unlink()
+    assert restored.output("merge") is None
+
+
+def test_failed_render_resumes_from_last_stage(offline, monkeypatch):
+    request = offline_request(offline, duration=10, width=320, height=180)
+    generator = VideoGenerator(request, job_id="job")
+
+    def broken_overlay(*args, **kwargs):
+        raise RuntimeError("embed_text_clips failed")
+
+    monkeypatch.setattr(generator, "generate_text_overlay", broken_overlay)
+    with pytest.raises(RuntimeError):
+        generator.render_video()
+
+    stages = get_checkpoints("job")
+    assert set(stages) == {"prompts_0", "first_frame", "segment_0", "prompts_1", "segment_1",
+                           "part_0", "part_1", "watermark", "text_plan"}
+    calls = dict(offline.calls)
+
+    output = VideoGenerator(request, job_id="job").render_video()
+
+    # no new renders, prompts or text plans were paid for
+    assert offline.calls["fal_subscribe"] == calls["fal_subscribe"]
+    assert offline.calls["send_message"] == calls["send_message"]
+    assert offline.calls["generate_content"] == calls["generate_content"]
+    assert output.endswith("merged_output_watermarked_text.mp4")
+    assert "text_overlay" in get_checkpoints("job")
+
+
+def test_lost_segment_file_is_downloaded_again(offline):
+    request = offline_request(offline, duration=5, width=320, height=180)
+    VideoGenerator(request, job_id="job").render_video()
+    segment = get_checkpoints("job")["segment_0"]
+
+    os.remove(segment["path"])
+    os.remove(get_checkpoints("job")["text_overlay"]["path"])
+    VideoGenerator(request, job_id="job").render_video()
+
+    assert os.path.exists(segment["path"])
+    assert offline.calls["fal_subscribe"] == 2  # keyframe and one segment, first run only
+
+
+def test_failed_uploads_are_not_checkpointed(offline, monkeypatch):
+    request = offline_request(offline, duration=5, width=320, height=180)
+
+    def broken_upload(*args, **kwargs):
+        raise ConnectionError("cloudinary is down")
+
+    monkeypatch.setattr("cloudinary.uploader.upload", broken_upload)
+    generator = VideoGenerator(request, job_id="job")
+    with pytest.raises(Exception, match="Error uploading the image"):
+        generator.render_video()
+    assert "segment_0" not in get_checkpoints("job")
+
+    with pytest.raises(Exception, match="Error uploading the video"):
+        generator.upload_video("final.mp4")
@@ -0,0 +1,95 @@
+import google.generativeai as genai
+from google.generativeai import caching
+
+from src.utils.context_cache import ContextCache, prefix_key
+from src.utils.db_helpers import get_context_cache
+from src.utils.llm_helpers import send_message, upload_files
+from replay import synthesize_image
+
+
+def brand_assets(workdir):
+    logo = synthesize_image(str(workdir / "logo.png"), 64, 64)
+    product = workdir / "product.mp4"
+    product.write_bytes(b"product video")
+    return [logo, str(product)]
+
+
+def director():
+    return genai.GenerativeModel(model_name="gemini-offline", system_instruction="brief " * 2000)
+
+
+def counting_upload(uploads):
+    def upload(paths):
+        uploads.append(paths)
+        return upload_files(paths)
+    return upload
+
+
+def test_repeat_brand_starts_from_the_cache(offline, workdir):
+    assets = brand_assets(workdir)
+    cache = ContextCache(enabled=True)
+    uploads = []
+
+    first = cache.prefix(director(), assets, counting_upload(uploads))
+    second = cache.prefix(director(), assets, counting_upload(uploads))
+
+    assert first.cached and second.cached
+    assert first.history == second.history == []
+    assert len(uploads) == 1 and offline.calls["cache_create"] == 1
+    assert second.model._cached_content == first.model._cached_content
+
+    # the instruction and assets are billed as cached tokens, only the
+    # message itself is new input
+    uncached = director()
+    plain = send_message(uncached.start_chat(history=[{"role": "user", "parts": [f]} for f in upload_files(assets)]), "hello")
+    response = send_message(second.model.start_chat(history=second.history), "hello")
+    usage = response.usage_metadata
+    assert usage.prompt_token_count == plain.usage_metadata.prompt_token_count
+    assert usage.prompt_token_count - usage.cached_content_token_count < 10
+
+
+def test_expired_cache_is_created_again(offline, workdir):
+    assets = brand_assets(workdir)
+    cache = ContextCache(enabled=True)
+    first = cache.prefix(director(), assets, upload_files)
+    offline.caches.clear()
+
+    second = cache.prefix(director(), assets, upload_files)
+
+    assert second.cached and offline.calls["cache_create"] == 2
+    assert second.model._cached_content != first.model._cached_content
+
+
+def test_cache_close_to_expiry_is_extended(offline, workdir):
+    assets = brand_assets(workdir)
+    cache = ContextCache(enabled=True, ttl=60, refresh=600)
+    first = cache.prefix(director(), assets, upload_files)
+    expires = offline.caches[first.model._cached_content].expire_time
+
+    cache.prefix(director(), assets, upload_files)
+
+    assert offline.caches[first.model._cached_content].expire_time > expires
+    assert offline.calls["cache_create"] == 1
+
+
+def test_falls_back_when_caching_is_not_available(offline, workdir, monkeypatch):
+    assets = brand_assets(workdir)
+    cache = ContextCache(enabled=True)
+    attempts = []
+
+    def too_small(**kwargs):
+        attempts.append(kwargs)
+        raise ValueError("Cached content is too small")
+
+    monkeypatch.setattr(caching.CachedContent, "create", too_small)
+    model = director()
+    first = cache.prefix(model, assets, upload_files)
+    second = cache.prefix(model, assets, upload_files)
+
+    assert not first.cached and not second.cached
+    assert second.model is model
+    assert [entry["parts"][0].display_name for entry in second.history] == ["logo.png", "product.mp4"]
+    # not tried again for every job
+    assert len(attempts) == 1
+    assert get_context_cache(prefix_key(model, assets))["name"] is None
+
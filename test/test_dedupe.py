@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from src.models.schemas import VideoRequest
+from src.utils.dedupe import InFlightJobs, request_fingerprint
+from replay import sample_request
+
+
+def test_fingerprint_ignores_email():
+    request = sample_request()
+    other = VideoRequest.model_validate({**request.model_dump(), "email": "someone@example.com"})
+    assert request_fingerprint(request) == request_fingerprint(other)
+
+    changed = request.model_copy(deep=True)
+    changed.video_details.duration += 5
+    assert request_fingerprint(request) != request_fingerprint(changed)
+
+
+def test_in_flight_jobs_are_shared_until_done():
+    async def scenario():
+        jobs = InFlightJobs()
+        release = asyncio.Event()
+
+        async def job():
+            await release.wait()
+            return "response"
+
+        task = jobs.start("fp", job(), owner="owner@example.com", job_id="run-1")
+        assert jobs.get("fp") == (task, "owner@example.com", "run-1")
+        assert len(jobs) == 1
+        duplicate = job()
+        with pytest.raises(ValueError):
+            jobs.start("fp", duplicate)
+        duplicate.close()
+
+        release.set()
+        assert await task == "response"
+        await asyncio.sleep(0)
+        assert jobs.get("fp") is None
+        assert len(jobs) == 0
+
+    asyncio.run(scenario())
+
+
+def test_failed_job_is_removed_and_reraised():
+    async def scenario():
+        jobs = InFlightJobs()
+
+        async def job():
+            raise RuntimeError("render failed")
+
+        task = jobs.start("fp", job())
+        with pytest.raises(RuntimeError):
+            await task
+        await asyncio.sleep(0)
+        assert len(jobs) == 0
+
+    asyncio.run(scenario())
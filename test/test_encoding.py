@@ -0,0 +1,41 @@
+import typing
+
+import pytest
+from pydantic import ValidationError
+
+from src.models.schemas import VideoRequest
+from src.services.video_generator import VideoGenerator
+from src.utils.encoding import INTERMEDIATE, PROFILES, encode_profile
+from src.utils.helpers import get_video_metadata
+from src.utils.metrics import job_timeline
+from replay import offline_request, sample_request
+
+
+def test_request_accepts_exactly_the_named_profiles():
+    field = VideoRequest.model_fields["encode_profile"].annotation
+    literal = next(arg for arg in typing.get_args(field) if arg is not type(None))
+    assert set(typing.get_args(literal)) == set(PROFILES)
+
+    data = sample_request().model_dump(mode="json")
+    assert VideoRequest.model_validate({**data, "encode_profile": "archive"}).encode_profile == "archive"
+    with pytest.raises(ValidationError):
+        VideoRequest.model_validate({**data, "encode_profile": "lossless"})
+
+
+def test_profile_options():
+    assert encode_profile().name == "balanced"
+    options = encode_profile("archive").write_options("-movflags", "+faststart")
+    assert options["preset"] == "slow"
+    assert options["ffmpeg_params"] == ["-crf", "18", "-tune", "film", "-pix_fmt", "yuv420p", "-movflags", "+faststart"]
+    assert options["audio_bitrate"] == "192k"
+    assert "audio_codec" not in INTERMEDIATE.write_options(audio=False)
+
+
+def test_parts_are_intermediate_and_final_encode_uses_the_request_profile(offline):
+    request = offline_request(offline, duration=5, width=320, height=180).model_copy(update={"encode_profile": "fast-preview"})
+    with job_timeline() as timeline:
+        output = VideoGenerator(request, job_id="job").render_video()
+
+    profiles = {(span.labels["step"], span.labels["profile"]) for span in timeline.to_list() if span.operation == "moviepy_encode"}
+    assert profiles == {("segment_part", "intermediate"), ("text_overlay", "fast-preview")}
+    assert get_video_metadata(output).duration_seconds >= 4
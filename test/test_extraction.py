@@ -0,0 +1,82 @@
+import threading
+import time
+
+import pytest
+
+from src.models.schemas import VideoGenerationPrompts
+from src.services.video_generator import parse_text_overlays_json, parse_text_overlays_xml
+from src.utils import extraction
+from src.utils.extraction import ExtractionFailed, LatencyWindow, extract, json_schema
+from src.utils.progress import current_job_id
+
+
+def answers(*outputs):
+    outputs = list(outputs)
+    return lambda: outputs.pop(0)
+
+
+def test_retries_invalid_output_with_seeded_jitter(monkeypatch):
+    delays = []
+    monkeypatch.setattr(extraction.time, "sleep", delays.append)
+    prompts = '{"hero_prompt": "bottle", "keyframe_prompt": "studio", "motion_prompt": "spin"}'
+    parse = json_schema(VideoGenerationPrompts)
+
+    token = current_job_id.set("job")
+    try:
+        first = extract(answers("not json", '{"hero_prompt": "bottle"}', prompts), parse, step="prompts")
+        first_delays, delays[:] = list(delays), []
+        extract(answers("not json", '{"hero_prompt": "bottle"}', prompts), parse, step="prompts")
+    finally:
+        current_job_id.reset(token)
+
+    assert first == {"hero_prompt": "bottle", "keyframe_prompt": "studio", "motion_prompt": "spin"}
+    assert len(first_delays) == 2 and delays == first_delays
+    assert 0.5 <= first_delays[0] <= 1 and 1 <= first_delays[1] <= 2
+
+
+def test_gives_up_with_the_last_output(monkeypatch):
+    monkeypatch.setattr(extraction.time, "sleep", lambda _: None)
+
+    with pytest.raises(ExtractionFailed) as failed:
+        extract(answers("a", "b"), json_schema(VideoGenerationPrompts), step="prompts", attempts=2)
+    assert failed.value.output == "b"
+    assert len(failed.value.errors) == 2
+
+
+def test_hedged_request_wins_when_the_first_is_slow(monkeypatch):
+    monkeypatch.setattr(extraction, "latencies", LatencyWindow(min_samples=1))
+    extraction.latencies.add("prompts", 0.05)
+    release = threading.Event()
+    calls = []
+
+    def call():
+        calls.append(1)
+        if len(calls) == 1:
+            release.wait(5)
+            return '{"hero_prompt": "slow", "keyframe_prompt": "slow", "motion_prompt": "slow"}'
+        return '{"hero_prompt": "fast", "keyframe_prompt": "fast", "motion_prompt": "fast"}'
+
+    started = time.perf_counter()
+    result = extract(call, json_schema(VideoGenerationPrompts), step="prompts", hedge=True)
+    release.set()
+
+    assert result["hero_prompt"] == "fast"
+    assert len(calls) == 2
+    assert time.perf_counter() - started < 1
+
+
+def test_text_overlay_parsers():
+    single = """Sure! <texts><text><color>rgb(1,2,3)</color><font>Bold</font><font_size>large</font_size>
+        <position><x>50</x><y>20%</y></position><content>HI</content>
+        <text_duration><start>0</start><end>2</end></text_duration></text></texts>"""
+    with pytest.raises(ValueError):
+        parse_text_overlays_xml(single)
+
+    overlays = parse_text_overlays_xml(single.replace("20%", "20"))
+    assert overlays == {"texts": [{"text": "HI", "color": "rgb(1,2,3)", "font": "Bold", "font_size": "large",
+                                   "position": {"x": 50.0, "y": 20.0}, "text_duration": {"start": 0.0, "end": 2.0}}]}
+    with pytest.raises(ValueError):
+        parse_text_overlays_xml("no xml at all")
+    with pytest.raises(ValueError):
+        parse_text_overlays_json('{"texts": [{"text": "HI", "color": "red", "font": "Bold", "font_size": "large", '
+                                 '"position": {"x": 1, "y": 1}, "text_duration": {"start": 0, "end": 1}}]}')
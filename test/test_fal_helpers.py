@@ -0,0 +1,108 @@
+import time
+
+import pytest
+
+from src.utils import fal_helpers
+from src.utils.db_helpers import get_fal_request, set_fal_request
+from src.utils.fal_helpers import FalQueueSupervisor, FalRequestFailed, fal_run, handle_fal_webhook
+from replay import OfflineServices
+
+APPLICATION = "fal-ai/kling-video/v1.6/pro/image-to-video"
+
+
+@pytest.fixture
+def queue(workdir, monkeypatch):
+    monkeypatch.setattr(fal_helpers, "FAL_BACKEND", "queue")
+    monkeypatch.setattr(fal_helpers, "FAL_WEBHOOK_URL", None)
+    monkeypatch.setattr(fal_helpers, "FAL_WEBHOOK_SECRET", None)
+    monkeypatch.setattr(fal_helpers, "fal_supervisor", FalQueueSupervisor(min_interval=0.05, max_interval=0.1))
+    services = OfflineServices(str(workdir / "offline"), segment_size=(64, 36), segment_duration=0.5,
+                               webhook_handler=handle_fal_webhook, latency={"fal_subscribe": 0.3})
+    with services.install():
+        yield services
+
+
+def test_queue_polls_until_completed(queue):
+    updates = []
+    result = fal_run(APPLICATION, {"prompt": "a"}, job_id="job", step="segment_1", on_queue_update=updates.append)
+
+    assert result["video"]["url"] in queue.urls
+    assert queue.calls["fal_submit"] == 1
+    assert queue.calls["fal_status"] >= 2
+    # logs are forwarded once, not on every poll
+    assert len(updates) == 1
+    record = get_fal_request("job", "segment_1")
+    assert record["status"] == "COMPLETED"
+    assert record["result"] == result
+
+
+def test_timed_out_request_is_no_longer_polled(queue):
+    supervisor = fal_helpers.fal_supervisor
+    request_id = fal_helpers.fal_client.submit(APPLICATION, arguments={"prompt": "a"}).request_id
+
+    with pytest.raises(FalRequestFailed, match="Timed out"):
+        supervisor.wait(APPLICATION, request_id, timeout=0.01)
+
+    assert len(supervisor) == 0
+
+
+def test_queue_completes_from_webhook(queue, monkeypatch):
+    monkeypatch.setattr(fal_helpers, "FAL_WEBHOOK_URL", "https://api.example.com/fal/webhook?token=s3cret")
+    monkeypatch.setattr(fal_helpers, "FAL_WEBHOOK_SECRET", "s3cret")
+    # polling far too slow to finish the test, only the webhook can
+    monkeypatch.setattr(fal_helpers, "fal_supervisor", FalQueueSupervisor(min_interval=60, max_interval=60))
+
+    started = time.monotonic()
+    result = fal_run(APPLICATION, {"prompt": "a"}, job_id="job", step="segment_1")
+
+    assert time.monotonic() - started < 10
+    assert result["video"]["url"] in queue.urls
+    assert queue.calls["fal_status"] == 0
+    assert get_fal_request("job", "segment_1")["status"] == "COMPLETED"
+
+
+def test_webhook_url_needs_a_secret(queue, monkeypatch):
+    monkeypatch.setattr(fal_helpers, "FAL_WEBHOOK_URL", "https://api.example.com/fal/webhook")
+
+    fal_run(APPLICATION, {"prompt": "a"}, job_id="job", step="segment_1")
+
+    request_id = get_fal_request("job", "segment_1")["request_id"]
+    assert queue.queue[request_id]["webhook_url"] is None
+
+
+def test_queue_resumes_submitted_request(queue):
+    handle = queue.submit(APPLICATION, {"prompt": "first attempt"})
+    set_fal_request("job", "segment_1", APPLICATION, handle.request_id, "SUBMITTED")
+
+    # the prompt differs from the first attempt, resuming is keyed on the step
+    result = fal_run(APPLICATION, {"prompt": "second attempt"}, job_id="job", step="segment_1")
+
+    assert queue.calls["fal_submit"] == 1
+    assert result == queue.result(APPLICATION, handle.request_id)
+    assert get_fal_request("job", "segment_1")["request_id"] == handle.request_id
+
+
+def test_queue_reuses_completed_and_resubmits_failed(queue):
+    first = fal_run(APPLICATION, {"prompt": "a"}, job_id="job", step="segment_1")
+    assert fal_run(APPLICATION, {"prompt": "a"}, job_id="job", step="segment_1") == first
+    assert queue.calls["fal_submit"] == 1
+
+    record = get_fal_request("job", "segment_1")
+    set_fal_request("job", "segment_1", APPLICATION, record["request_id"], "FAILED")
+    fal_run(APPLICATION, {"prompt": "a"}, job_id="job", step="segment_1")
+    assert queue.calls["fal_submit"] == 2
+
+
+def test_webhook_endpoint_rejects_without_secret(queue, monkeypatch):
+    from fastapi.testclient import TestClient
+    from src import main
+
+    client = TestClient(main.app)
+    monkeypatch.setattr(main, "FAL_WEBHOOK_SECRET", None)
+    assert client.post("/fal/webhook", json={"request_id": "x", "status": "OK"}).status_code == 403
+
+    monkeypatch.setattr(main, "FAL_WEBHOOK_SECRET", "s3cret")
+    assert client.post("/fal/webhook?token=wrong", json={"request_id": "x", "status": "OK"}).status_code == 403
+    response = client.post("/fal/webhook?token=s3cret", json={"request_id": "x", "status": "OK", "payload": {}})
+    assert response.status_code == 200
+    assert response.json()["waiting"] is False
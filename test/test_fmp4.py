@@ -0,0 +1,50 @@
+import cv2
+import pytest
+
+from src.utils.fmp4 import FragmentedMp4Appender
+from src.utils.helpers import encode_segment_part, prepare_watermark
+from replay import synthesize_logo, synthesize_video
+
+
+@pytest.fixture
+def parts(tmp_path):
+    sprite = prepare_watermark(synthesize_logo(str(tmp_path / "logo.png")), 160, str(tmp_path / "sprite.png"))
+    paths = []
+    for i in range(3):
+        segment = synthesize_video(str(tmp_path / f"segment_{i}.mp4"), 160, 90, 1.0, seed=i)
+        paths.append(encode_segment_part(segment, sprite, (160, 90), str(tmp_path / f"part_{i}.mp4")))
+    return paths
+
+
+def frame_count(path):
+    capture = cv2.VideoCapture(path)
+    frames = 0
+    while capture.read()[0]:
+        frames += 1
+    capture.release()
+    return frames
+
+
+def test_parts_append_into_one_playable_video(parts, tmp_path):
+    output = str(tmp_path / "running.mp4")
+    appender = FragmentedMp4Appender(output)
+
+    for count, part in enumerate(parts, start=1):
+        appender.append(part)
+        # a valid preview after every append
+        assert appender.duration == pytest.approx(count, abs=0.05)
+        assert frame_count(output) == frame_count(parts[0]) * count
+
+    assert appender.sequence >= 3
+
+
+def test_part_with_other_settings_is_rejected(parts, tmp_path):
+    sprite = prepare_watermark(synthesize_logo(str(tmp_path / "logo.png")), 320, str(tmp_path / "sprite_320.png"))
+    segment = synthesize_video(str(tmp_path / "large.mp4"), 320, 180, 1.0)
+    other = encode_segment_part(segment, sprite, (320, 180), str(tmp_path / "part_large.mp4"))
+
+    appender = FragmentedMp4Appender(str(tmp_path / "running.mp4"))
+    appender.append(parts[0])
+    with pytest.raises(ValueError):
+        appender.append(other)
+    assert appender.parts == 1
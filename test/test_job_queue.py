@@ -0,0 +1,100 @@
+import asyncio
+import threading
+import time
+
+from src.services import video_pipeline
+from src.services.video_pipeline import job_status, start_video_job
+from src.utils.db_helpers import get_resumable_job_id
+from src.utils.job_queue import SqliteJobQueue
+from src.worker import Worker
+from replay import offline_request, sample_request
+from test_video_pipeline import stored_response
+
+
+def test_claims_are_exclusive_and_expired_leases_are_taken_over():
+    queue = SqliteJobQueue(max_attempts=2)
+    queue.enqueue("job", "fp", "{}", owner="a@example.com")
+
+    job = queue.claim("first", lease_seconds=60)
+    assert (job.job_id, job.status, job.attempts) == ("job", "running", 1)
+    assert queue.claim("second") is None
+    assert queue.find_active("fp").worker_id == "first"
+
+    # the first worker died, its lease runs out
+    assert queue.heartbeat("job", "first", lease_seconds=-1)
+    job = queue.claim("second", lease_seconds=60)
+    assert (job.worker_id, job.attempts) == ("second", 2)
+    assert not queue.heartbeat("job", "first")
+    assert not queue.complete("job", "first", "response")
+
+    assert queue.complete("job", "second", "response")
+    assert queue.get("job").identifier == "response"
+    assert queue.find_active("fp") is None
+
+
+def test_job_that_keeps_killing_workers_fails():
+    queue = SqliteJobQueue(max_attempts=1)
+    queue.enqueue("job", "fp", "{}")
+    queue.claim("first", lease_seconds=-1)
+
+    assert queue.claim("second") is None
+    assert queue.get("job").status == "failed"
+
+
+def test_worker_runs_queued_jobs_for_the_api(offline, monkeypatch):
+    monkeypatch.setattr(video_pipeline, "job_queue", SqliteJobQueue())
+    monkeypatch.setattr(video_pipeline, "QUEUE_POLL_INTERVAL", 0.05)
+    request = offline_request(offline, duration=5, width=320, height=180)
+    worker = Worker(SqliteJobQueue(), "worker", poll_interval=0.05)
+
+    async def scenario():
+        job_id, future = await start_video_job(request)
+        joined_id, joined = await start_video_job(request.model_copy(update={"email": "other@example.com"}))
+        assert job_status(job_id).status == "queued"
+        thread = threading.Thread(target=worker.run_once)
+        thread.start()
+        response = await future
+        await joined
+        thread.join()
+        return job_id, joined_id, response
+
+    job_id, joined_id, response = asyncio.run(scenario())
+
+    assert joined_id == job_id
+    assert job_status(job_id).status == "completed"
+    assert job_status(job_id).identifier == response.identifier
+    assert get_resumable_job_id(video_pipeline.request_fingerprint(request)) is None
+    # the sample request has no email, only the requester who joined is notified
+    assert offline.calls["mailgun"] == 1
+
+
+def test_failed_queued_job_is_resumed_under_its_id(monkeypatch):
+    monkeypatch.setattr(video_pipeline, "job_queue", SqliteJobQueue())
+    monkeypatch.setattr(video_pipeline, "QUEUE_POLL_INTERVAL", 0.05)
+    attempts = []
+
+    def flaky_pipeline(request, job_id):
+        attempts.append(job_id)
+        if len(attempts) == 1:
+            raise RuntimeError("kling is down")
+        return stored_response()
+
+    monkeypatch.setattr("src.worker.run_video_pipeline", flaky_pipeline)
+    worker = Worker(SqliteJobQueue(), "worker")
+
+    async def run(request):
+        job_id, future = await start_video_job(request)
+        await asyncio.get_running_loop().run_in_executor(None, worker.run_once)
+        try:
+            await future
+        except RuntimeError as e:
+            return job_id, str(e)
+        return job_id, None
+
+    first_id, error = asyncio.run(run(sample_request()))
+    second_id, second_error = asyncio.run(run(sample_request()))
+
+    assert error == "kling is down"
+    assert job_status(first_id).status == "completed"
+    assert (second_id, second_error) == (first_id, None)
+    assert attempts == [first_id, first_id]
@@ -0,0 +1,72 @@
+import google.generativeai as genai
+
+from src.models.schemas import TextOverlays, VideoGenerationPrompts
+from src.services.video_generator import VideoGenerator
+from src.utils import extraction
+from src.utils.extraction import extract, json_schema
+from src.utils.llm_cache import LlmCache, cache_key, hits, misses
+from replay import offline_request
+
+PROMPTS = '{"hero_prompt": "bottle", "keyframe_prompt": "studio", "motion_prompt": "spin"}'
+
+
+def writer(schema):
+    return genai.GenerativeModel(model_name="gemini-1.5-flash", system_instruction="extract the json",
+                                 generation_config={"response_mime_type": "application/json", "response_schema": schema})
+
+
+def test_key_covers_the_schema_and_input(offline):
+    key = cache_key(writer(VideoGenerationPrompts), "answer")
+    assert key == cache_key(writer(VideoGenerationPrompts), "answer")
+    assert key != cache_key(writer(TextOverlays), "answer")
+    assert key != cache_key(writer(VideoGenerationPrompts), "another answer")
+
+
+def test_only_valid_output_is_memoized(monkeypatch):
+    monkeypatch.setattr(extraction, "llm_cache", LlmCache())
+    monkeypatch.setattr(extraction.time, "sleep", lambda _: None)
+    outputs = ["not json", PROMPTS]
+    calls = []
+
+    def call():
+        calls.append(1)
+        return outputs.pop(0)
+
+    hits_before, misses_before = hits.value(step="prompts"), misses.value(step="prompts")
+    first = extract(call, json_schema(VideoGenerationPrompts), step="prompts", cache_key="key")
+    second = extract(call, json_schema(VideoGenerationPrompts), step="prompts", cache_key="key")
+
+    assert first == second
+    assert len(calls) == 2
+    assert hits.value(step="prompts") - hits_before == 1
+    assert misses.value(step="prompts") - misses_before == 1
+
+
+def test_entries_expire_and_are_evicted_by_size():
+    now = [1000.0]
+    cache = LlmCache(max_mb=3000 / 2**20, ttl=60, clock=lambda: now[0])
+    for i in range(3):
+        cache.put(f"key-{i}", "x" * 1000)
+        now[0] += 1
+    cache.get("key-0")
+    now[0] += 1
+    cache.put("key-3", "x" * 1000)
+
+    # the least recently used entry went, the one just read stayed
+    assert cache.get("key-1") is None
+    assert cache.get("key-0") is not None and cache.get("key-2") is not None
+    assert cache.get("key-3") is not None
+
+    now[0] += cache.ttl + 1
+    assert cache.get("key-3") is None
+
+
+def test_resumed_job_skips_the_extraction_round_trip(offline):
+    request = offline_request(offline, duration=5, width=320, height=180)
+
+    first = VideoGenerator(request, job_id="job").extract_prompts("creative director answer")
+    calls = offline.calls["generate_content"]
+    second = VideoGenerator(request, job_id="job").extract_prompts("creative director answer")
+
+    assert first == second
+    assert offline.calls["generate_content"] == calls
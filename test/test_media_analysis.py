@@ -0,0 +1,37 @@
+import numpy as np
+
+from src.utils.helpers import get_last_frame, get_video_metadata
+from src.utils.media_analysis import ContactSheet, PaletteStats, Poster, ScoringProxy, TailFrame, VideoInfo, analyze
+from replay import synthesize_video
+
+
+def test_one_pass_matches_the_separate_readers(workdir):
+    path = synthesize_video(str(workdir / "clip.mp4"), 320, 180, duration=3.0, fps=24)
+    proxy_path = str(workdir / "proxy.mp4")
+
+    results = analyze(path, [VideoInfo(path), TailFrame(), ContactSheet(columns=3, rows=2, thumb_width=96),
+                             Poster(), PaletteStats(), ScoringProxy(proxy_path, width=160, rate=4)])
+
+    metadata, probed = results["metadata"], get_video_metadata(path)
+    assert metadata.resolution == probed.resolution and metadata.duration_seconds == probed.duration_seconds
+    assert metadata.frame_count == probed.frame_count == 72
+    tail = np.asarray(results["tail_frame"], dtype=np.int16)
+    assert np.abs(tail - np.asarray(get_last_frame(path), dtype=np.int16)).mean() < 2
+    assert results["contact_sheet"].size == (3 * 96, 2 * 54)
+    assert results["poster"].size == (320, 180)
+    palette = results["palette"]["palette"]
+    assert len(palette) == 5 and sum(color["share"] for color in palette) <= 1
+    assert 0 < results["palette"]["mean_brightness"] < 255
+    proxy = get_video_metadata(results["proxy"])
+    assert proxy.resolution.width == 160 and proxy.duration_seconds == 3
+
+
+def test_contact_sheet_samples_the_whole_video(workdir):
+    path = synthesize_video(str(workdir / "clip.mp4"), 160, 90, duration=2.0, fps=10)
+    sheet = ContactSheet(columns=4, rows=1, thumb_width=40)
+
+    analyze(path, [sheet])
+
+    assert len(sheet.thumbs) == 4
+    # the box moves, so no two thumbnails are the same
+    assert len({thumb.tobytes() for thumb in sheet.thumbs}) == 4
@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.utils.helpers import get_last_frame, get_video_metadata, prepare_watermark
+from src.utils.media_analysis import analyze
+from src.utils.media_pool import (AnalysisTask, BackgroundStatsTask, LastFrameTask, MediaPool, ProbeTask, WatermarkTask,
+                                  pool_size)
+from src.utils.metrics import job_timeline
+from src.utils.text_placement import BackgroundStats
+from replay import synthesize_logo, synthesize_video
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = MediaPool(workers=1)
+    yield pool
+    pool.shutdown()
+
+
+def test_pool_size_per_core():
+    cores = os.cpu_count()
+
+    assert pool_size(0) == 0
+    assert pool_size(1) == cores and pool_size(2) == 2 * cores
+    assert pool_size(0.01) == 1
+
+
+def test_tasks_run_in_a_worker_and_report_their_timings(pool, tmp_path):
+    sprite = prepare_watermark(synthesize_logo(str(tmp_path / "logo.png")), 160, str(tmp_path / "sprite.png"))
+    segment = synthesize_video(str(tmp_path / "segment.mp4"), 160, 90, 1.0)
+
+    with job_timeline() as timeline:
+        part = pool.run(WatermarkTask(segment, sprite, (160, 90), str(tmp_path / "part.mp4")))
+
+    assert get_video_metadata(part).resolution.width == 160
+    spans = {span.operation: span for span in timeline.to_list()}
+    assert spans["media_task"].labels == {"task": "WatermarkTask"}
+    # timed in the worker, inside the task's span
+    encode = spans["moviepy_encode"]
+    assert encode.labels["step"] == "segment_part"
+    assert spans["media_task"].start <= encode.start <= encode.start + encode.duration <= spans["media_task"].start + spans["media_task"].duration + 0.01
+
+
+def test_last_frame_is_passed_back_as_a_file(pool, tmp_path):
+    segment = synthesize_video(str(tmp_path / "segment.mp4"), 320, 180, 2.0)
+
+    results = pool.run(LastFrameTask(segment, str(tmp_path / "last.png")))
+
+    assert results["last_frame"] == str(tmp_path / "last.png")
+    with Image.open(results["last_frame"]) as saved:
+        difference = np.abs(np.asarray(saved.convert("RGB"), dtype=int) - np.asarray(get_last_frame(segment), dtype=int))
+    assert difference.mean() < 2
+    assert len(results["segment_quality"]["hashes"]) == 16
+    assert results["metadata"].resolution.width == 320
+
+
+def test_relative_paths_and_errors_are_the_caller_s(pool, tmp_path, monkeypatch):
+    synthesize_video(str(tmp_path / "clip.mp4"), 160, 90, 1.0)
+    monkeypatch.chdir(tmp_path)
+
+    assert pool.run(ProbeTask("clip.mp4")) == get_video_metadata("clip.mp4")
+    with pytest.raises(FileNotFoundError):
+        pool.run(ProbeTask("missing.mp4"))
+
+
+def test_no_workers_runs_in_the_calling_thread(tmp_path):
+    path = synthesize_video(str(tmp_path / "clip.mp4"), 160, 90, 1.0)
+    inline = MediaPool(workers=0)
+
+    assert inline.run(ProbeTask(path)) == get_video_metadata(path)
+    assert inline._executor is None
+
+
+def test_analysis_saves_the_images_and_returns_the_numbers(pool, tmp_path):
+    logo = synthesize_logo(str(tmp_path / "logo.png"))
+    video = synthesize_video(str(tmp_path / "clip.mp4"), 320, 180, 2.0)
+    task = AnalysisTask(video, str(tmp_path / "poster.jpg"), str(tmp_path / "sheet.jpg"), ["#F0B414", "#141414"], logo)
+
+    results = pool.run(task)
+
+    assert set(results) == {"palette", "brand"}
+    assert results["brand"]["frames_sampled"] == 4 and results["brand"]["logo_presence"] == 0
+    with Image.open(task.poster_path) as poster, Image.open(task.contact_sheet_path) as sheet:
+        assert poster.size == (320, 180) and sheet.width > 0
+
+
+def test_background_stats_are_the_same_in_a_worker(pool, tmp_path):
+    video = synthesize_video(str(tmp_path / "clip.mp4"), 320, 180, 1.0)
+
+    stats = pool.run(BackgroundStatsTask(video))
+
+    expected = analyze(video, [BackgroundStats()])["background"]
+    assert stats.keys() == expected.keys()
+    assert all(np.array_equal(stats[key], expected[key]) for key in expected)
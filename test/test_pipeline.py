@@ -0,0 +1,87 @@
+import threading
+import time
+
+import pytest
+
+from src.utils.pipeline import Pipeline
+from src.utils.progress import broker, current_job_id
+
+
+def test_stages_receive_dependency_results_in_order():
+    order = []
+    pipeline = Pipeline()
+    pipeline.add_stage("render", lambda: order.append("render") or 2)
+    pipeline.add_stage("double", lambda render: order.append("double") or render * 2, deps=["render"])
+    pipeline.add_stage("total", lambda render, double: order.append("total") or render + double, deps=["render", "double"])
+
+    results = pipeline.run()
+
+    assert results == {"render": 2, "double": 4, "total": 6}
+    assert order == ["render", "double", "total"]
+    assert set(pipeline.timings) == {"render", "double", "total"}
+    assert pipeline.timings["double"].start >= pipeline.timings["render"].end
+
+
+def test_independent_stages_run_concurrently():
+    # both branches must be running at the same time to get past the barrier
+    barrier = threading.Barrier(2, timeout=5)
+    pipeline = Pipeline()
+    pipeline.add_stage("render", lambda: "video")
+    pipeline.add_stage("upload", lambda render: barrier.wait(), deps=["render"])
+    pipeline.add_stage("score", lambda render: barrier.wait(), deps=["render"])
+
+    pipeline.run()
+
+    assert pipeline.timings["upload"].start <= pipeline.timings["score"].end
+    assert pipeline.timings["score"].start <= pipeline.timings["upload"].end
+
+
+def test_failure_cancels_stages_not_started():
+    ran = []
+
+    def fail(render):
+        raise RuntimeError("upload failed")
+
+    def slow(render):
+        time.sleep(0.2)
+        ran.append("slow")
+
+    pipeline = Pipeline(max_workers=2)
+    pipeline.add_stage("render", lambda: "video")
+    pipeline.add_stage("upload", fail, deps=["render"])
+    pipeline.add_stage("score", slow, deps=["render"])
+    pipeline.add_stage("persist", lambda upload, score: ran.append("persist"), deps=["upload", "score"])
+
+    with pytest.raises(RuntimeError, match="upload failed"):
+        pipeline.run()
+    assert "persist" not in ran
+    assert "persist" not in pipeline.timings
+
+
+def test_graph_is_checked_before_running():
+    ran = []
+    pipeline = Pipeline()
+    pipeline.add_stage("a", lambda b: ran.append("a"), deps=["b"])
+    pipeline.add_stage("b", lambda a: ran.append("b"), deps=["a"])
+    with pytest.raises(ValueError, match="cycle"):
+        pipeline.run()
+
+    pipeline = Pipeline()
+    pipeline.add_stage("a", lambda missing: None, deps=["missing"])
+    with pytest.raises(ValueError, match="unknown stage"):
+        pipeline.run()
+
+    with pytest.raises(ValueError, match="already exists"):
+        Pipeline().add_stage("a", lambda: None).add_stage("a", lambda: None)
+    assert ran == []
+
+
+def test_stages_publish_under_the_callers_job():
+    token = current_job_id.set("pipeline-test-job")
+    try:
+        Pipeline().add_stage("render", lambda: None).run()
+    finally:
+        current_job_id.reset(token)
+
+    events = [(e.event, e.data["stage"], e.data["status"]) for e in broker.history("pipeline-test-job")]
+    assert events == [("stage", "render", "started"), ("stage", "render", "finished")]
@@ -0,0 +1,35 @@
+import time
+
+from src.utils.prefetch import Prefetcher
+
+
+def test_work_during_a_remote_wait_is_hidden():
+    prefetch = Prefetcher()
+    with prefetch.remote_wait():
+        prefetch.submit("encode", time.sleep, 0.2).result()
+    report = prefetch.close()
+
+    assert report["encode"]["count"] == 1
+    assert report["encode"]["hidden_seconds"] >= 0.15
+    assert report["encode"]["hidden_seconds"] <= report["encode"]["seconds"]
+
+
+def test_work_outside_remote_waits_is_not_hidden():
+    prefetch = Prefetcher()
+    with prefetch.remote_wait():
+        pass
+    prefetch.submit("encode", time.sleep, 0.05).result()
+    report = prefetch.close()
+
+    assert report["encode"]["seconds"] >= 0.05
+    assert report["encode"]["hidden_seconds"] == 0
+
+
+def test_tasks_run_in_submission_order():
+    prefetch = Prefetcher()
+    order = []
+    for i in range(5):
+        prefetch.submit("step", order.append, i)
+    prefetch.close()
+
+    assert order == [0, 1, 2, 3, 4]
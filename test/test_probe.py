@@ -0,0 +1,70 @@
+import subprocess
+
+import imageio_ffmpeg
+import pytest
+
+from src.utils import probe as probe_module
+from src.utils.fmp4 import FRAGMENTED_MP4_FLAGS
+from src.utils.probe import probe, probe_ffmpeg, probe_mp4
+from replay import synthesize_video
+
+
+def remux(source, output, input_options=(), output_options=()):
+    subprocess.run([imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-loglevel", "error", *input_options, "-i", source,
+                    "-c", "copy", *output_options, output], check=True)
+    return output
+
+
+@pytest.fixture
+def clip(workdir):
+    # 4.9 s, which int(frame_count / fps) used to report as 4
+    return synthesize_video(str(workdir / "clip.mp4"), 320, 180, duration=4.9, fps=24)
+
+
+def test_moov_probe_reads_the_header(clip):
+    metadata = probe_mp4(clip)
+    reference = probe_ffmpeg(clip)
+
+    assert metadata.resolution == reference.resolution
+    assert metadata.codec == reference.codec == "h264"
+    assert metadata.fps == 24.0 and metadata.frame_count == 117
+    assert metadata.duration == pytest.approx(117 / 24) and metadata.duration_seconds == 5
+    assert metadata.bitrate_kbps == pytest.approx(reference.bitrate_kbps, rel=0.05)
+    assert metadata.rotation == 0 and metadata.variable_frame_rate is False
+
+
+def test_rotation_from_the_display_matrix(clip, workdir):
+    rotated = remux(clip, str(workdir / "rotated.mp4"), input_options=["-display_rotation:v", "90"])
+    # ffmpeg's display rotation is counterclockwise
+    assert probe_mp4(rotated).rotation == 270
+
+
+def test_fragmented_mp4_falls_back_to_ffmpeg(clip, workdir):
+    fragmented = remux(clip, str(workdir / "fragmented.mp4"), output_options=FRAGMENTED_MP4_FLAGS)
+    with pytest.raises(ValueError):
+        probe_mp4(fragmented)
+
+    metadata = probe(fragmented)
+    assert metadata.resolution.width == 320 and metadata.duration == pytest.approx(4.9, abs=0.1)
+
+
+def test_probe_is_cached_per_file_content(clip, workdir, monkeypatch):
+    calls = []
+    monkeypatch.setattr(probe_module, "_cache", probe_module._ProbeCache())
+    monkeypatch.setattr(probe_module, "probe_mp4", lambda path: calls.append(path) or probe_mp4(path))
+    copy = workdir / "copy.mp4"
+    copy.write_bytes(open(clip, "rb").read())
+
+    first = probe(clip)
+    first.resolution.width = 1
+    second = probe(str(copy))
+
+    assert len(calls) == 1
+    assert second.resolution.width == 320
+
+
+def test_unreadable_file_raises(workdir):
+    path = workdir / "not_a_video.mp4"
+    path.write_bytes(b"not a video" * 100)
+    with pytest.raises(ValueError):
+        probe(str(path))
@@ -0,0 +1,82 @@
+import asyncio
+import threading
+
+from src.utils.progress import ProgressBroker, format_sse
+
+
+def test_history_is_bounded_per_job_and_by_job_count():
+    broker = ProgressBroker(history_size=3, max_jobs=2)
+    for i in range(5):
+        broker.publish("a", "stage", index=i)
+    assert [e.id for e in broker.history("a")] == [3, 4, 5]
+    assert broker.latest("a").data == {"index": 4}
+
+    broker.publish("b", "queued")
+    broker.publish("c", "queued")
+    assert broker.history("a") == []
+    assert broker.latest("c").event == "queued"
+
+
+def test_subscribe_replays_backlog_and_follows_threads():
+    broker = ProgressBroker()
+
+    async def scenario():
+        broker.publish("job", "queued")
+        broker.publish("job", "started")
+        received = []
+
+        def worker():
+            broker.publish("job", "stage", stage="render")
+            broker.publish("job", "completed", identifier="id")
+
+        async for event in broker.subscribe("job", last_event_id=1, heartbeat=5):
+            received.append(event.event)
+            if event.event == "started":
+                threading.Thread(target=worker).start()
+        return received
+
+    assert asyncio.run(asyncio.wait_for(scenario(), 10)) == ["started", "stage", "completed"]
+
+
+def test_subscribe_sends_heartbeats():
+    broker = ProgressBroker()
+
+    async def scenario():
+        stream = broker.subscribe("job", heartbeat=0.01)
+        first = await stream.__anext__()
+        await stream.aclose()
+        return first
+
+    assert asyncio.run(scenario()) is None
+    assert format_sse(None) == ": heartbeat\n\n"
+
+
+def test_finished_job_stream_ends_after_backlog():
+    broker = ProgressBroker()
+    broker.publish("job", "started")
+    broker.publish("job", "failed", error="boom")
+
+    async def scenario():
+        return [event async for event in broker.subscribe("job")]
+
+    events = asyncio.run(asyncio.wait_for(scenario(), 5))
+    assert [e.event for e in events] == ["started", "failed"]
+    assert format_sse(events[-1]).startswith("id: 2\nevent: failed\n")
+
+
+def test_slow_watcher_still_gets_the_end_of_the_stream():
+    broker = ProgressBroker(queue_size=2)
+
+    async def scenario():
+        broker.publish("job", "started")
+        stream = broker.subscribe("job", heartbeat=5)
+        received = [(await stream.__anext__()).event]
+        # the watcher falls behind while the job finishes
+        for i in range(5):
+            broker.publish("job", "stage", stage=i)
+        broker.publish("job", "completed")
+        await asyncio.sleep(0.05)
+        received += [event.event async for event in stream]
+        return received
+
+    assert asyncio.run(asyncio.wait_for(scenario(), 5)) == ["started", "stage", "completed"]
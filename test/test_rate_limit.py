@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+
+from src.utils.metrics import render_metrics
+from src.utils.rate_limit import ProviderLimit, RateLimiter, TokenBucket
+
+
+class Throttled(Exception):
+    def __init__(self, retry_after=None):
+        super().__init__("429 Too Many Requests")
+        self.status_code = 429
+        self.retry_after = retry_after
+
+
+def test_bucket_allows_a_burst_then_the_rate():
+    now = [0.0]
+    bucket = TokenBucket(rpm=60, burst=2, clock=lambda: now[0])
+
+    assert [bucket.reserve() for _ in range(4)] == [0.0, 0.0, 1.0, 2.0]
+    now[0] = 10.0
+    assert bucket.reserve() == 0.0
+
+
+def test_bucket_backs_off_and_recovers():
+    now = [0.0]
+    bucket = TokenBucket(rpm=60, burst=1, clock=lambda: now[0])
+
+    assert bucket.throttle(5.0, attempt=0) == 5.0
+    assert bucket.rate == 0.5
+    assert bucket.reserve() == 5.0
+    for _ in range(20):
+        bucket.recover()
+    assert bucket.rate == 1.0
+
+
+def test_retries_after_429_with_retry_after():
+    limiter = RateLimiter({"gemini": ProviderLimit(rpm=6000, burst=10)}, retries=2)
+    answers = [Throttled(retry_after=0.05), "ok"]
+
+    def call(prompt):
+        answer = answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return f"{answer} {prompt}"
+
+    started = time.perf_counter()
+    assert limiter.call("gemini", "flash", call, "prompt") == "ok prompt"
+    assert time.perf_counter() - started >= 0.05
+    metrics = render_metrics()
+    assert 'video_api_rate_limit_backoff_seconds_count{model="flash",provider="gemini"} 1' in metrics
+    assert 'video_api_rate_limit_queue_depth{model="flash",provider="gemini"} 0' in metrics
+
+
+def test_gives_up_and_ignores_other_errors():
+    limiter = RateLimiter({"gemini": ProviderLimit(rpm=6000, burst=10)}, retries=1)
+    calls = []
+
+    def throttled():
+        calls.append(1)
+        raise Throttled(retry_after=0)
+
+    with pytest.raises(Throttled):
+        limiter.call("gemini", "flash", throttled)
+    assert len(calls) == 2
+    with pytest.raises(ValueError):
+        limiter.call("gemini", "flash", lambda: int("not a number"))
+
+
+def test_concurrency_limit_per_model():
+    limiter = RateLimiter({"fal": ProviderLimit(rpm=6000, burst=10), "fal/kling": ProviderLimit(rpm=6000, burst=10, concurrency=1)})
+    running, peak = [0], [0]
+    lock = threading.Lock()
+
+    def render():
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+
+    threads = [threading.Thread(target=limiter.call, args=("fal", "kling", render)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak[0] == 1
+    assert limiter.limiter("fal", "flux").slots is None
@@ -0,0 +1,21 @@
+import json
+
+from replay import Recorder, Replayer, sample_request
+
+
+def test_cassette_replays_the_recorded_request(tmp_path):
+    recorded = sample_request(duration=15, logo_url="https://cdn.example.com/logo.png")
+    recorder = Recorder(str(tmp_path / "cassette"))
+    recorder.record_request(recorded)
+    recorder.save()
+
+    replayer = Replayer(str(tmp_path / "cassette"), str(tmp_path / "work"), latency_scale=0)
+
+    assert replayer.request == recorded
+
+
+def test_old_cassettes_have_no_request(tmp_path):
+    (tmp_path / "cassette").mkdir()
+    (tmp_path / "cassette" / "cassette.json").write_text(json.dumps({"calls": [], "files": {}}))
+
+    assert Replayer(str(tmp_path / "cassette"), str(tmp_path / "work")).request is None
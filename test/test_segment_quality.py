@@ -0,0 +1,138 @@
+import uuid
+
+import numpy as np
+import pytest
+
+from src.services.video_generator import VideoGenerator
+from src.utils.db_helpers import get_checkpoints
+from src.utils.media_analysis import VideoInfo, analyze
+from src.utils.progress import broker, current_job_id
+from src.utils.segment_quality import SegmentQuality, check_segment, dhash, hamming
+from replay import offline_request, synthesize_video
+
+
+def write_clip(path, make_frame, duration=2.0, size=(160, 90), fps=24):
+    from moviepy import VideoClip
+    clip = VideoClip(lambda t: make_frame(t, size), duration=duration).with_fps(fps)
+    clip.write_videofile(str(path), codec="libx264", audio=False, logger=None, preset="ultrafast")
+    clip.close()
+    return str(path)
+
+
+def frozen(t, size):
+    frame = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+    frame[:, : size[0] // 2] = (200, 120, 40)
+    frame[size[1] // 3:, :] += 30
+    return frame
+
+
+def report(path, **kwargs):
+    results = analyze(path, [VideoInfo(path), SegmentQuality()])
+    return check_segment(results["segment_quality"], results["metadata"], **kwargs)
+
+
+def test_hashes_of_similar_frames_are_close():
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, size=(8, 9)).astype(np.uint8)
+    hashes = dhash(np.stack([image, np.clip(image.astype(int) + 3, 0, 255).astype(np.uint8), 255 - image]))
+
+    assert hamming(hashes[0], hashes[1]) <= 2
+    assert hamming(hashes[0], hashes[2]) > 48
+
+
+def test_moving_segment_passes(workdir):
+    path = synthesize_video(str(workdir / "segment.mp4"), 320, 180, duration=2.0)
+
+    checked = report(path, expected_duration=2, expected_size=(320, 180))
+
+    assert checked.passed, checked.problems
+    assert checked.stats["samples"] == 16 and checked.stats["glitches"] == 0
+
+
+def test_frozen_black_and_glitched_segments_fail(workdir):
+    black = write_clip(workdir / "black.mp4", lambda t, size: np.zeros((size[1], size[0], 3), dtype=np.uint8))
+    still = write_clip(workdir / "still.mp4", frozen)
+    noise = np.random.default_rng(1).integers(0, 256, size=(90, 160, 3), dtype=np.uint8)
+
+    def glitch(t, size):
+        # one burst of noise in an otherwise slowly panning gradient
+        if 1.0 <= t < 1.1:
+            return noise
+        xs = np.linspace(0, 2 * np.pi, size[0]) + t
+        row = (127 + 100 * np.sin(xs)).astype(np.uint8)
+        return np.broadcast_to(row[None, :, None], (size[1], size[0], 3)).copy()
+
+    glitched = write_clip(workdir / "glitched.mp4", glitch)
+
+    assert any("black" in problem for problem in report(black, expected_duration=2).problems)
+    assert any("frozen" in problem for problem in report(still, expected_duration=2).problems)
+    assert any("sudden jumps" in problem for problem in report(glitched, expected_duration=2).problems)
+
+
+def test_short_or_resized_segment_fails(workdir):
+    path = synthesize_video(str(workdir / "segment.mp4"), 320, 180, duration=2.0)
+
+    problems = report(path, expected_duration=5, expected_size=(640, 360)).problems
+
+    assert problems == ["lasts 2.00s instead of 5s", "is 320x180 instead of 640x360"]
+
+
+def test_failed_segment_is_rendered_again(offline, monkeypatch):
+    render = offline._render
+    renders = []
+
+    def frozen_first(application):
+        renders.append(application)
+        if "kling" in application and renders.count(application) == 1:
+            path = write_clip(offline.workdir + "/fal/frozen.mp4", frozen, duration=offline.segment_duration,
+                              size=offline.segment_size)
+            return {"video": {"url": offline.register(path)}}
+        return render(application)
+
+    monkeypatch.setattr(offline, "_render", frozen_first)
+    request = offline_request(offline, duration=5, width=320, height=180)
+    # the broker outlives the test, its history must not hold other jobs
+    job_id = str(uuid.uuid4())
+    generator = VideoGenerator(request, job_id=job_id)
+    token = current_job_id.set(job_id)
+    try:
+        generator.render_video()
+    finally:
+        current_job_id.reset(token)
+
+    assert sum("kling" in application for application in renders) == 2
+    checks = [event.data for event in broker.history(job_id) if event.event == "segment_quality"]
+    assert [(check["attempt"], check["passed"]) for check in checks] == [(1, False), (2, True)]
+    assert "frozen" in checks[0]["problems"][0]
+    # the chain continues from the accepted render
+    assert "frozen" not in get_checkpoints(job_id)["segment_0"]["video_url"]
+
+
+def test_segment_failing_every_attempt_fails_the_job(offline, monkeypatch):
+    render = offline._render
+
+    def always_frozen(application):
+        if "kling" in application:
+            path = write_clip(offline.workdir + "/fal/frozen.mp4", frozen, duration=offline.segment_duration,
+                              size=offline.segment_size)
+            return {"video": {"url": offline.register(path)}}
+        return render(application)
+
+    monkeypatch.setattr(offline, "_render", always_frozen)
+    request = offline_request(offline, duration=5, width=320, height=180)
+    job_id = str(uuid.uuid4())
+
+    with pytest.raises(Exception, match="segment_0 failed the quality check 2 times"):
+        VideoGenerator(request, job_id=job_id).render_video()
+    assert "segment_0" not in get_checkpoints(job_id)
+
+
+def test_restored_segment_restores_its_size(offline):
+    request = offline_request(offline, duration=5, width=320, height=180)
+    job_id = str(uuid.uuid4())
+    VideoGenerator(request, job_id=job_id).render_video()
+    segment = get_checkpoints(job_id)["segment_0"]
+
+    resumed = VideoGenerator(request, job_id=job_id)
+    assert resumed.generate_segment("prompt", "image", segment["path"]) == segment["last_frame_url"]
+    assert resumed.segment_size == tuple(offline.segment_size)
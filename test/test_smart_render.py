@@ -0,0 +1,102 @@
+import uuid
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+
+from src.services import video_generator
+from src.services.video_generator import VideoGenerator
+from src.utils.encoding import encode_profile
+from src.utils.fmp4 import FragmentedMp4Appender
+from src.utils.helpers import encode_segment_part, fade_in_text, prepare_watermark
+from src.utils.progress import broker, current_job_id
+from src.utils.smart_render import keyframe_params, smart_render, touched_ranges
+from replay import offline_request, synthesize_logo, synthesize_video
+
+PROFILE = encode_profile("fast-preview")
+
+
+@pytest.fixture
+def fonts(monkeypatch):
+    # fade_in_text loads the fonts from resources/
+    monkeypatch.chdir(Path(__file__).parent.parent)
+
+
+@pytest.fixture
+def watermarked(tmp_path, fonts):
+    sprite = prepare_watermark(synthesize_logo(str(tmp_path / "logo.png")), 160, str(tmp_path / "sprite.png"))
+    appender = FragmentedMp4Appender(str(tmp_path / "watermarked.mp4"))
+    for i in range(3):
+        segment = synthesize_video(str(tmp_path / f"segment_{i}.mp4"), 160, 90, 2.0, seed=i)
+        appender.append(encode_segment_part(segment, sprite, (160, 90), str(tmp_path / f"part_{i}.mp4"),
+                                            PROFILE, keyframe_params(1)))
+    return appender.output_path
+
+
+def text(video_path, start, end):
+    return fade_in_text(video_path, {"start": start, "end": end}, "SMART", "small", {"x": 50, "y": 50},
+                        "rgb(255,255,255)", "Bold", "landscape")
+
+
+def frames(path):
+    capture = cv2.VideoCapture(path)
+    decoded = []
+    while True:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        decoded.append(frame)
+    capture.release()
+    return decoded
+
+
+def test_overlapping_ranges_are_merged_and_clipped():
+    class Clip:
+        def __init__(self, start, end):
+            self.start, self.end = start, end
+
+    clips = [Clip(4.0, 7.0), Clip(0.5, 1.5), Clip(1.0, 2.0), Clip(-1.0, 0.2), Clip(6.5, 6.8)]
+
+    assert touched_ranges(clips, duration=6.0) == [(0, 0.2), (0.5, 2.0), (4.0, 6.0)]
+
+
+def test_only_the_keyframe_spans_under_the_texts_are_encoded_again(watermarked, tmp_path):
+    output = str(tmp_path / "text.mp4")
+
+    seconds = smart_render(watermarked, [text(watermarked, 0.5, 1.5), text(watermarked, 4.2, 4.8)], output, PROFILE)
+
+    assert seconds == {"reencoded": 3.0, "copied": 3.0}
+    source, rendered = frames(watermarked), frames(output)
+    assert len(rendered) == len(source) == 144
+    differs = [cv2.absdiff(a, b).mean() > 8 for a, b in zip(source, rendered)]
+    # the text is there while it is on screen and nowhere else
+    assert all(differs[18:30]) and all(differs[106:112])
+    assert not any(differs[:12] + differs[38:100] + differs[116:])
+    # the copied spans are the very same frames
+    assert all(np.array_equal(a, b) for a, b in zip(source[48:96], rendered[48:96]))
+
+
+def test_video_that_is_not_fragmented_is_refused(tmp_path, fonts):
+    plain = synthesize_video(str(tmp_path / "plain.mp4"), 160, 90, 1.0)
+
+    with pytest.raises(ValueError):
+        smart_render(plain, [text(plain, 0.2, 0.8)], str(tmp_path / "text.mp4"), PROFILE)
+
+
+def test_generator_splices_the_text_overlay(offline, monkeypatch):
+    monkeypatch.setattr(video_generator, "SMART_RENDER", True)
+    # six one second segments
+    request = offline_request(offline, duration=30, width=320, height=180)
+    request.encode_profile = PROFILE.name
+    job_id = str(uuid.uuid4())
+    token = current_job_id.set(job_id)
+    try:
+        output = VideoGenerator(request, job_id=job_id).render_video()
+    finally:
+        current_job_id.reset(token)
+
+    (spliced,) = [event.data for event in broker.history(job_id) if event.data.get("step") == "smart_render"]
+    # the fake model shows its texts from 0.5s to 2.5s and from 3s to 4.5s
+    assert spliced == {"step": "smart_render", "reencoded": 5.0, "copied": 1.0}
+    assert len(frames(output)) == 144
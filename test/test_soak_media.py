@@ -0,0 +1,17 @@
+import os
+
+from soak_media import run_jobs
+
+# the full soak is `python test/soak_media.py --jobs 100`
+SOAK_JOBS = int(os.environ.get("SOAK_JOBS", "6"))
+
+
+def test_repeated_jobs_do_not_leak_readers_or_memory(offline):
+    # without a gc pass, readers that are only closed when collected count
+    samples = run_jobs(offline, SOAK_JOBS, collect=False)
+
+    # the first jobs warm up imports, fonts, ffmpeg and the allocator
+    first_rss, first_fds = samples[0]
+    warm_rss = max(rss for rss, _ in samples[:2])
+    assert max(fds for _, fds in samples[1:]) <= first_fds
+    assert max(rss for rss, _ in samples[2:]) - warm_rss < 10 + 0.5 * SOAK_JOBS
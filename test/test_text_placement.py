@@ -0,0 +1,117 @@
+import numpy as np
+
+from src.services import video_generator
+from src.services.video_generator import VideoGenerator
+from src.utils.db_helpers import get_checkpoints
+from src.utils.media_analysis import StreamInfo
+from src.utils.helpers import watermark_box
+from src.utils.text_placement import BackgroundStats, place_texts, text_size
+from replay import offline_request
+
+SIZE = (640, 360)
+
+
+def background(make_frame, seconds=2, rate=4):
+    stats = BackgroundStats(rate=rate)
+    stats.start(StreamInfo(width=SIZE[0], height=SIZE[1], fps=rate, duration=seconds))
+    for index in range(seconds * rate):
+        stats.consume(index, index / rate, make_frame(index))
+    return stats.finish()
+
+
+def copy(text, start=0.0, end=2.0, font_size="small"):
+    return {"text": text, "text_duration": {"start": start, "end": end}, "font": "Bold", "font_size": font_size}
+
+
+def box(overlay):
+    width, height = text_size(overlay["text"], overlay["font"], overlay["font_size"], SIZE[0])
+    x = overlay["position"]["x"] * SIZE[0] / 100 - width / 2
+    y = overlay["position"]["y"] * SIZE[1] / 100 - height / 2
+    return x, y, x + width, y + height
+
+
+def test_text_goes_where_the_background_is_calm():
+    rng = np.random.default_rng(0)
+
+    def frame(index):
+        # noise on the left, flat dark blue on the right
+        frame = np.empty((SIZE[1], SIZE[0], 3), dtype=np.uint8)
+        frame[:, :SIZE[0] // 2] = rng.integers(0, 256, size=(SIZE[1], SIZE[0] // 2, 3))
+        frame[:, SIZE[0] // 2:] = (10, 20, 60)
+        return frame
+
+    (overlay,) = place_texts(background(frame), [copy("CALM")], SIZE)["texts"]
+
+    assert overlay["position"]["x"] > 50
+    assert overlay["color"] == "rgb(255,255,255)"
+
+
+def test_dark_text_on_a_light_background_and_brand_colors_are_tried():
+    stats = background(lambda index: np.full((SIZE[1], SIZE[0], 3), 235, dtype=np.uint8))
+
+    (plain,) = place_texts(stats, [copy("LIGHT")], SIZE)["texts"]
+    (branded,) = place_texts(stats, [copy("LIGHT")], SIZE, palette=["#000080"])["texts"]
+
+    assert plain["color"] == "rgb(20,20,20)"
+    assert branded["color"] == "rgb(0,0,128)"
+
+
+def test_positions_are_scored_with_the_colour_drawn():
+    def frame(index):
+        # black in the middle, where the gray brand colour only reaches 5:1,
+        # and a dark gray edge, where white reaches 10:1 and the brand colour doesn't make 4.5:1
+        frame = np.full((SIZE[1], SIZE[0], 3), 63, dtype=np.uint8)
+        frame[:, SIZE[0] // 4:3 * SIZE[0] // 4] = 0
+        return frame
+
+    (overlay,) = place_texts(background(frame), [copy("X")], SIZE, palette=["#7C7C7C"])["texts"]
+
+    assert overlay["color"] == "rgb(255,255,255)"
+    assert overlay["position"]["x"] == 20
+
+
+def test_watermark_box_follows_the_logo_shape():
+    square = watermark_box(SIZE)
+    wide = watermark_box(SIZE, logo_size=(400, 100))
+
+    assert square[2] - square[0] == square[3] - square[1] == SIZE[0] // 8
+    assert wide[2] - wide[0] == SIZE[0] // 8 and wide[3] - wide[1] == 20
+    assert wide[2:] == square[2:]
+
+
+def test_texts_on_screen_together_do_not_overlap_or_cover_the_watermark():
+    stats = background(lambda index: np.zeros((SIZE[1], SIZE[0], 3), dtype=np.uint8))
+    copies = [copy("FIRST HEADLINE", font_size="medium"), copy("SECOND LINE", font_size="medium"), copy("LATER", 2.5, 4.0)]
+
+    first, second, later = place_texts(stats, copies, SIZE, logo_size=(300, 200))["texts"]
+
+    x0, y0, x1, y1 = box(first)
+    a0, b0, a1, b1 = box(second)
+    assert x1 <= a0 or a1 <= x0 or y1 <= b0 or b1 <= y0
+    w0, v0, w1, v1 = watermark_box(SIZE, (300, 200))
+    for overlay in (first, second, later):
+        x0, y0, x1, y1 = box(overlay)
+        assert x1 <= w0 or w1 <= x0 or y1 <= v0 or v1 <= y0
+
+
+def test_local_planner_does_not_upload_the_final_video(offline, monkeypatch):
+    uploaded = []
+
+    def upload_to_gemini(path, mime_type=None):
+        uploaded.append(path)
+        return upload(path, mime_type)
+
+    upload = video_generator.upload_to_gemini
+    monkeypatch.setattr(video_generator, "upload_to_gemini", upload_to_gemini)
+    # big enough for the two texts the fake model writes, side by side
+    offline.segment_size = SIZE
+    request = offline_request(offline, duration=10, width=640, height=360)
+    request.text_planner = "local"
+
+    VideoGenerator(request, job_id="job").render_video()
+
+    # the last frame and video of the first segment
+    assert len(uploaded) == 2 and not any("merged" in path for path in uploaded)
+    texts = get_checkpoints("job")["text_plan"]["text_overlays"]["texts"]
+    assert [text["text"] for text in texts] == ["OFFLINE TEXT", "OFFLINE TEXT"]
+    assert texts[0]["position"] != texts[1]["position"]
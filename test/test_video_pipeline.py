@@ -0,0 +1,98 @@
+import asyncio
+import threading
+
+import pytest
+
+from src.models.schemas import Metadata, Resolution, VideoResponse
+from src.services import video_pipeline
+from src.services.video_pipeline import job_status, start_video_job
+from src.utils.db_helpers import set_cached_response_id, set_response_data
+from src.utils.dedupe import request_fingerprint
+from replay import sample_request
+
+
+def stored_response() -> VideoResponse:
+    return set_response_data(VideoResponse(
+        status="success",
+        video_url="https://offline.invalid/video.mp4",
+        scoring={"total_score": 7.0},
+        metadata=Metadata(file_size_mb=1.0, duration_seconds=10, resolution=Resolution(width=1280, height=720)),
+        identifier="",
+    ))
+
+
+def test_cached_job_is_completed_when_started(monkeypatch):
+    monkeypatch.setattr(video_pipeline, "RESULT_CACHE_TTL", 60)
+    request = sample_request()
+    response = stored_response()
+    set_cached_response_id(request_fingerprint(request), response.identifier)
+
+    async def scenario():
+        job_id, future = await start_video_job(request)
+        # what POST /jobs reports, before the future has had a chance to run
+        status = job_status(job_id)
+        return status, await future
+
+    status, served = asyncio.run(scenario())
+
+    assert status.status == "completed"
+    assert status.identifier == response.identifier
+    assert served.identifier == response.identifier
+
+
+def test_runs_get_their_own_job_id_and_joiners_share_it(monkeypatch):
+    release = threading.Event()
+
+    def fake_pipeline(request, job_id):
+        release.wait(5)
+        return stored_response()
+
+    monkeypatch.setattr(video_pipeline, "run_video_pipeline", fake_pipeline)
+    request = sample_request()
+
+    async def scenario():
+        first_id, first = await start_video_job(request)
+        joined_id, joined = await start_video_job(request)
+        release.set()
+        await asyncio.gather(first, joined)
+        second_id, second = await start_video_job(request)
+        await second
+        return first_id, joined_id, second_id
+
+    first_id, joined_id, second_id = asyncio.run(scenario())
+
+    assert joined_id == first_id
+    assert second_id != first_id
+    # each run has a history of its own
+    assert [e.event for e in video_pipeline.broker.history(second_id)] == ["queued"]
+
+
+def test_failed_job_is_resumed_under_its_id(monkeypatch):
+    attempts = []
+
+    def flaky_pipeline(request, job_id):
+        attempts.append(job_id)
+        if len(attempts) == 1:
+            raise RuntimeError("segment 5 failed")
+        return stored_response()
+
+    monkeypatch.setattr(video_pipeline, "run_video_pipeline", flaky_pipeline)
+    request = sample_request()
+
+    async def scenario():
+        failed_id, failed = await start_video_job(request)
+        with pytest.raises(RuntimeError):
+            await failed
+        retried_id, retried = await start_video_job(request)
+        # the failed attempt's events are gone, the retry is not over
+        assert job_status(retried_id).status == "queued"
+        await retried
+        fresh_id, fresh = await start_video_job(request)
+        await fresh
+        return failed_id, retried_id, fresh_id
+
+    failed_id, retried_id, fresh_id = asyncio.run(scenario())
+
+    assert retried_id == failed_id
+    assert fresh_id != failed_id
+    assert attempts == [failed_id, failed_id, fresh_id]